@@ -6,16 +6,18 @@ Provides REST API endpoints for processing emails and managing relationships
 from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, EmailStr
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterable
+import asyncio
 import json
 import logging
 from datetime import datetime, date
 import os
 from contextlib import asynccontextmanager
 
-from email_processor import EmailProcessor
+from email_processor import EmailProcessor, MAX_OPEN_THREADS
 from database_manager import DatabaseManager
 from llm_prompts import LLMPromptTemplates
+from email_io import is_ndjson, iter_ndjson_stream
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -76,6 +78,7 @@ class UserResponse(BaseModel):
 class EmailProcessingRequest(BaseModel):
     user_email: EmailStr
     emails: List[Dict[str, Any]]
+    grouped_by_thread: bool = False  # emails come from a thread export (GMAIL_BY_THREAD=1)
 
 class EmailProcessingResponse(BaseModel):
     success: bool
@@ -179,15 +182,7 @@ async def process_emails(
 ):
     """Process emails and extract relationships"""
     try:
-        # Get or create user
-        user = db.get_user_by_email(request.user_email)
-        if not user:
-            # Create user if doesn't exist
-            user_id = db.create_user(request.user_email, request.user_email.split('@')[0])
-            if not user_id:
-                raise HTTPException(status_code=500, detail="Failed to create user")
-        else:
-            user_id = user['id']
+        user_id = get_or_create_user_id(request.user_email, db)
         
         # Process emails in background
         background_tasks.add_task(
@@ -196,7 +191,8 @@ async def process_emails(
             request.user_email,
             request.emails,
             db,
-            processor
+            processor,
+            request.grouped_by_thread
         )
         
         return EmailProcessingResponse(
@@ -210,39 +206,79 @@ async def process_emails(
         logger.error(f"Error processing emails: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+def get_or_create_user_id(user_email: str, db: DatabaseManager) -> int:
+    """ID of the user with this email, creating the user if it doesn't exist"""
+    user = db.get_user_by_email(user_email)
+    if user:
+        return user['id']
+    user_id = db.create_user(user_email, user_email.split('@')[0])
+    if not user_id:
+        raise HTTPException(status_code=500, detail="Failed to create user")
+    return user_id
+
 async def process_emails_background(
     user_id: int,
     user_email: str,
-    emails: List[Dict[str, Any]],
+    emails: Iterable[Dict[str, Any]],
     db: DatabaseManager,
-    processor: EmailProcessor
+    processor: EmailProcessor,
+    grouped_by_thread: bool = False
 ):
     """Background task to process emails"""
     try:
         logger.info(f"Starting background processing for user {user_email}")
         
-        # Process emails
-        processed_data = processor.process_emails(emails, user_email)
-        
-        # Store results in database
-        await store_processing_results(user_id, processed_data, db)
+        # Process emails thread by thread (LLM calls for independent threads run
+        # concurrently) and store each thread's results as soon as they are ready.
+        # A request body is already in memory, so its threads are grouped whole; only
+        # streamed uploads are held to MAX_OPEN_THREADS
+        max_open_threads = None if isinstance(emails, list) else MAX_OPEN_THREADS
+        stats = {}
+        primary_user_id = create_primary_user_person(user_id, user_email, db)
+        async for thread_data in processor.aiter_process_emails(emails, user_email, grouped_by_thread=grouped_by_thread,
+                                                                max_open_threads=max_open_threads, stats=stats):
+            if not thread_data['thread_complete']:
+                logger.warning(f"Storing part of thread {thread_data['thread_id']}: it was split by the open-thread limit")
+            await store_processing_results(user_id, thread_data, db, primary_user_id)
         
-        logger.info(f"Completed processing for user {user_email}")
+        logger.info(f"Completed processing for user {user_email}: {stats}")
         
     except Exception as e:
         logger.error(f"Error in background processing: {str(e)}")
 
-async def store_processing_results(user_id: int, processed_data: Dict, db: DatabaseManager):
-    """Store processing results in database"""
+async def process_upload_background(
+    user_id: int,
+    user_email: str,
+    file: UploadFile,
+    gzipped: bool,
+    db: DatabaseManager,
+    processor: EmailProcessor
+):
+    """Background task that streams an NDJSON upload into process_emails_background"""
+    try:
+        # aiter_process_emails pulls records a filter batch at a time on worker threads,
+        # so the upload is parsed as it is processed and never held in memory
+        emails = iter_ndjson_stream(file.file, gzipped=gzipped)
+        await process_emails_background(user_id, user_email, emails, db, processor)
+    finally:
+        await file.close()
+
+def create_primary_user_person(user_id: int, user_email: str, db: DatabaseManager) -> Optional[int]:
+    """Create (or get) the person record of the primary user"""
+    return db.create_or_get_person(
+        user_id=user_id,
+        email=user_email,
+        name=user_email.split('@')[0],
+        is_primary_user=True
+    )
+
+async def store_processing_results(user_id: int, processed_data: Dict, db: DatabaseManager,
+                                   primary_user_id: Optional[int] = None):
+    """Store processing results in database (primary_user_id: from create_primary_user_person, once per job)"""
     try:
-        # Create primary user person record
         primary_user_email = processed_data['user_email']
-        primary_user_id = db.create_or_get_person(
-            user_id=user_id,
-            email=primary_user_email,
-            name=primary_user_email.split('@')[0],
-            is_primary_user=True
-        )
+        if primary_user_id is None:
+            primary_user_id = create_primary_user_person(user_id, primary_user_email, db)
         
         # Store companies
         company_id_map = {}
@@ -326,7 +362,7 @@ async def store_processing_results(user_id: int, processed_data: Dict, db: Datab
                 filter_reason=email.get('_filter_reason', '')
             )
         
-        logger.info(f"Stored processing results for user {user_id}")
+        logger.debug(f"Stored processing results for user {user_id}")
         
     except Exception as e:
         logger.error(f"Error storing processing results: {str(e)}")
@@ -395,19 +431,42 @@ async def get_user_stats(
 
 @app.post("/upload-emails")
 async def upload_emails(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     user_email: str = "",
     db: DatabaseManager = Depends(get_db_manager),
     processor: EmailProcessor = Depends(get_email_processor)
 ):
-    """Upload emails from a JSON file"""
+    """Upload emails from a JSON file or an NDJSON export (.ndjson/.jsonl, optionally .gz)"""
     try:
-        if not file.filename.endswith('.json'):
-            raise HTTPException(status_code=400, detail="Only JSON files are supported")
-        
-        # Read and parse JSON file
-        content = await file.read()
-        emails = json.loads(content.decode('utf-8'))
+        if is_ndjson(file.filename):
+            # Validates user_email; the records are streamed from the spooled upload by the
+            # background task instead of being parsed here
+            request = EmailProcessingRequest(user_email=user_email, emails=[])
+            user_id = get_or_create_user_id(request.user_email, db)
+            gzipped = file.filename.lower().endswith('.gz')
+            background_tasks.add_task(
+                process_upload_background,
+                user_id,
+                request.user_email,
+                file,
+                gzipped,
+                db,
+                processor
+            )
+            return EmailProcessingResponse(
+                success=True,
+                message="Email processing started",
+                processing_stats={},
+                user_id=user_id
+            )
+        elif file.filename.endswith('.json'):
+            # Read and parse JSON file (a single document: loaded in one go, on a worker thread)
+            content = await file.read()
+            loop = asyncio.get_running_loop()
+            emails = await loop.run_in_executor(None, json.loads, content.decode('utf-8'))
+        else:
+            raise HTTPException(status_code=400, detail="Only JSON and NDJSON files are supported")
         
         if not isinstance(emails, list):
             raise HTTPException(status_code=400, detail="Invalid JSON format - expected list of emails")
@@ -418,8 +477,10 @@ async def upload_emails(
             emails=emails
         )
         
-        return await process_emails(request, None, db, processor)
+        return await process_emails(request, background_tasks, db, processor)
         
+    except HTTPException:
+        raise
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid JSON format")
     except Exception as e:
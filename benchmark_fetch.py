@@ -0,0 +1,163 @@
+"""
+Fetch-throughput benchmark for the exporters, run against fake_gmail_server.py.
+Measures messages/second and peak RSS for fetch_last_n_full (and its streaming
+variant) and fetch_latest_metadata, without touching real Gmail.
+
+The fake server and every case run in separate processes so each peak RSS
+figure belongs to one case only.
+
+  python benchmark_fetch.py --messages 2000 --latency-ms 50 --error-rate 0.02
+  python benchmark_fetch.py --cases sequential,full --workers 8 --batch-size 50
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import urllib.request
+
+CASES = ["sequential", "full", "full-stream", "metadata"]
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB (None where it can't be measured)."""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return peak / (1024 * 1024) if peak > 1 << 32 else peak / 1024
+
+
+def _serve(options, port_queue, stop_event):
+    from fake_gmail_server import start_server
+
+    server, _ = start_server(**options)
+    port_queue.put(server.server_port)
+    stop_event.wait()
+    server.shutdown()
+
+
+def _run_case(case, endpoint, options, result_queue):
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import build
+
+    import fetch_email_metadata
+    import fetch_last_1000_full
+    from email_io import NDJSONWriter
+    from gmail_fetch import FetchEngine
+
+    def make_service():
+        return build(
+            "gmail",
+            "v1",
+            credentials=Credentials(token="fake"),
+            client_options={"api_endpoint": endpoint},
+            static_discovery=True,
+        )
+
+    engine_options = {
+        "quota_units_per_second": options["quota"],
+        "batch_uri": endpoint + "batch/gmail/v1",
+    }
+    if case == "sequential":
+        engine = FetchEngine(make_service, workers=1, batch_size=0, **engine_options)
+    else:
+        engine = FetchEngine(
+            make_service, workers=options["workers"], batch_size=options["batch_size"], **engine_options
+        )
+    service = make_service()
+    n = options["messages"]
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if case in ("sequential", "full"):
+            fetched = len(fetch_last_1000_full.fetch_last_n_full(service, n, engine))
+        elif case == "full-stream":
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                with NDJSONWriter(os.path.join(tmp_dir, "bench.ndjson.gz")) as writer:
+                    for msg in fetch_last_1000_full.iter_last_n_full(service, n, engine):
+                        writer.write(fetch_last_1000_full.to_serializable(msg))
+                    fetched = writer.count
+        else:
+            # messages.list caps maxResults at 500 per page
+            n = min(n, 500)
+            fetched = len(fetch_email_metadata.fetch_latest_metadata(service, n, engine)[0])
+    elapsed = time.perf_counter() - start
+    result_queue.put({"case": case, "messages": fetched, "seconds": elapsed, "peak_rss_mb": _peak_rss_mb()})
+
+
+def _server_stats(endpoint):
+    with urllib.request.urlopen(endpoint + "_stats") as resp:
+        return json.loads(resp.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Gmail fetch throughput against a local fake API")
+    parser.add_argument("--messages", type=int, default=1000, help="messages to fetch (and mailbox size)")
+    parser.add_argument("--body-kb", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="fake server latency per HTTP request")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="probability of an injected 429")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--quota", type=float, default=250.0, help="quota units per second (0 = unlimited)")
+    parser.add_argument("--cases", default=",".join(CASES), help=f"comma-separated subset of {CASES}")
+    args = parser.parse_args()
+
+    cases = [c.strip() for c in args.cases.split(",") if c.strip()]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        parser.error(f"Unknown cases: {sorted(unknown)}")
+
+    port_queue = multiprocessing.Queue()
+    stop_event = multiprocessing.Event()
+    server_options = {
+        "size": args.messages,
+        "body_kb": args.body_kb,
+        "latency_ms": args.latency_ms,
+        "error_rate": args.error_rate,
+    }
+    server = multiprocessing.Process(target=_serve, args=(server_options, port_queue, stop_event), daemon=True)
+    server.start()
+    endpoint = f"http://127.0.0.1:{port_queue.get(timeout=30)}/"
+    options = {
+        "messages": args.messages,
+        "workers": args.workers,
+        "batch_size": args.batch_size,
+        "quota": args.quota,
+    }
+
+    print(f"Fake Gmail at {endpoint}: {args.messages} messages, {args.latency_ms:.0f} ms latency, "
+          f"{args.error_rate:.1%} injected 429s")
+    print(f"Engine: {args.workers} workers, batch size {args.batch_size}, quota {args.quota:g} units/s\n")
+    print(f"{'case':<12} {'messages':>8} {'seconds':>8} {'msg/s':>8} {'peak RSS MB':>12} {'HTTP reqs':>10} {'429s':>6}")
+    try:
+        for case in cases:
+            before = _server_stats(endpoint)
+            result_queue = multiprocessing.Queue()
+            worker = multiprocessing.Process(target=_run_case, args=(case, endpoint, options, result_queue))
+            worker.start()
+            result = result_queue.get()
+            worker.join()
+            after = _server_stats(endpoint)
+            rate = result["messages"] / result["seconds"] if result["seconds"] else 0.0
+            rss = f"{result['peak_rss_mb']:.1f}" if result["peak_rss_mb"] is not None else "n/a"
+            print(f"{case:<12} {result['messages']:>8} {result['seconds']:>8.2f} {rate:>8.1f} {rss:>12} "
+                  f"{after['http_requests'] - before['http_requests']:>10} "
+                  f"{after['injected_429'] - before['injected_429']:>6}")
+    finally:
+        stop_event.set()
+        server.join(timeout=5)
+
+
+if __name__ == "__main__":
+    main()
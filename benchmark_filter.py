@@ -0,0 +1,226 @@
+"""
+Speed and accuracy benchmark for EmailFilter on the synthetic corpus from filter_corpus.py.
+
+Measures, for filter_emails on a freshly constructed filter:
+- emails/second (best of --repeat runs, cold sender cache each run)
+- p50/p99 per-email latency (should_filter_email timed one email at a time)
+- the keep/filter confusion matrix against the corpus labels, overall and per category
+
+and compares the numbers with a stored baseline. A speed regression is a drop in
+emails/second or a rise in p99 beyond --speed-tolerance (relative); an accuracy
+regression is a drop in accuracy, precision or recall, or a rise in the rate of real
+mail filtered, beyond --accuracy-tolerance (absolute). Any regression exits with
+status 1. Speed numbers depend on the machine: pass --no-speed to check accuracy
+only, and --update after an intended change to store the new numbers.
+
+  python benchmark_filter.py
+  python benchmark_filter.py --emails 20000 --seed 7 --baseline /tmp/filter_baseline.json --update
+  python benchmark_filter.py --no-speed
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+from email_filter import EmailFilter
+from filter_corpus import EXPECTED, generate_corpus
+
+BASELINE_FILE = Path(__file__).with_name('filter_baseline.json')
+SPEED_TOLERANCE = 0.2
+ACCURACY_TOLERANCE = 0.002
+# metric -> True when higher is better
+SPEED_METRICS = {'emails_per_second': True, 'p99_ms': False}
+ACCURACY_METRICS = {'accuracy': True, 'precision': True, 'recall': True, 'false_filter_rate': False}
+
+
+def confusion(emails: List[Dict], kept: List[Dict]) -> Dict[str, Any]:
+    """
+    Keep/filter confusion matrix of a filter run against the corpus labels
+
+    'filter' is the positive class: precision is the share of filtered emails that
+    should have been filtered, recall the share of bulk mail that was filtered, and
+    false_filter_rate the share of real mail that was filtered (lost).
+
+    Args:
+        emails: Labelled emails (with _expected and _category)
+        kept: The emails the filter kept
+
+    Returns:
+        Dict with matrix (expected -> decided -> count), by_category and the rates
+    """
+    kept_ids = {id(email) for email in kept}
+    matrix = {expected: {'keep': 0, 'filter': 0} for expected in ('keep', 'filter')}
+    by_category = {category: {'keep': 0, 'filter': 0} for category in sorted(EXPECTED)}
+    for email in emails:
+        decided = 'keep' if id(email) in kept_ids else 'filter'
+        matrix[email['_expected']][decided] += 1
+        by_category[email['_category']][decided] += 1
+    tp, fn = matrix['filter']['filter'], matrix['filter']['keep']
+    fp, tn = matrix['keep']['filter'], matrix['keep']['keep']
+    return {
+        'matrix': matrix,
+        'by_category': by_category,
+        'accuracy': (tp + tn) / len(emails) if emails else 0.0,
+        'precision': tp / (tp + fp) if tp + fp else 0.0,
+        'recall': tp / (tp + fn) if tp + fn else 0.0,
+        'false_filter_rate': fp / (fp + tn) if fp + tn else 0.0,
+    }
+
+
+def run_benchmark(emails: List[Dict], repeat: int = 3,
+                  make_filter: Callable[[], EmailFilter] = EmailFilter) -> Dict[str, Any]:
+    """
+    Time filter_emails and per-email decisions on a labelled corpus
+
+    Args:
+        emails: Labelled emails (see filter_corpus.generate_corpus)
+        repeat: filter_emails runs; the fastest counts
+        make_filter: Builds the filter under test, once per run
+
+    Returns:
+        Dict with emails, seconds, emails_per_second, p50_ms, p99_ms and the confusion() fields
+    """
+    best = None
+    for _ in range(max(1, repeat)):
+        email_filter = make_filter()
+        start = time.perf_counter()
+        kept, _ = email_filter.filter_emails(emails)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+
+    email_filter = make_filter()
+    latencies = np.empty(len(emails), dtype=np.float64)
+    for i, email in enumerate(emails):
+        start = time.perf_counter()
+        email_filter.should_filter_email(email)
+        latencies[i] = time.perf_counter() - start
+    p50, p99 = np.percentile(latencies * 1000, [50, 99]) if len(emails) else (0.0, 0.0)
+
+    return {
+        'emails': len(emails),
+        'seconds': best,
+        'emails_per_second': len(emails) / best if best else 0.0,
+        'p50_ms': float(p50),
+        'p99_ms': float(p99),
+        **confusion(emails, kept),
+    }
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], speed_tolerance: float = SPEED_TOLERANCE,
+            accuracy_tolerance: float = ACCURACY_TOLERANCE, check_speed: bool = True) -> List[str]:
+    """
+    Regressions of result against baseline, one message each (empty when none)
+
+    Args:
+        result: run_benchmark() output
+        baseline: A stored run_benchmark() output
+        speed_tolerance: Allowed relative slowdown of the speed metrics
+        accuracy_tolerance: Allowed absolute loss on the accuracy metrics
+        check_speed: False to compare accuracy only
+    """
+    regressions = []
+    if check_speed:
+        for metric, higher_is_better in SPEED_METRICS.items():
+            old, new = baseline[metric], result[metric]
+            limit = old * (1 - speed_tolerance) if higher_is_better else old * (1 + speed_tolerance)
+            if (new < limit) if higher_is_better else (new > limit):
+                regressions.append(f"{metric}: {new:.4g} vs baseline {old:.4g} (limit {limit:.4g})")
+    for metric, higher_is_better in ACCURACY_METRICS.items():
+        old, new = baseline[metric], result[metric]
+        limit = old - accuracy_tolerance if higher_is_better else old + accuracy_tolerance
+        if (new < limit) if higher_is_better else (new > limit):
+            regressions.append(f"{metric}: {new:.4f} vs baseline {old:.4f} (limit {limit:.4f})")
+    return regressions
+
+
+def load_baseline(path: Union[str, Path] = BASELINE_FILE) -> Optional[Dict[str, Any]]:
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(result: Dict[str, Any], corpus: Dict[str, int], path: Union[str, Path] = BASELINE_FILE) -> Path:
+    """Write result, with the corpus parameters it was measured on, as the new baseline"""
+    path = Path(path)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'corpus': corpus, **result}, f, indent=2)
+        f.write('\n')
+    return path
+
+
+def report(result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> str:
+    """Human-readable summary, with the baseline figures alongside when given"""
+    def column(metric: str, fmt: str) -> str:
+        line = f"{metric:<18} {format(result[metric], fmt):>12}"
+        if baseline:
+            line += f" {format(baseline[metric], fmt):>12}"
+        return line
+
+    lines = [f"{'metric':<18} {'current':>12}" + (f" {'baseline':>12}" if baseline else '')]
+    lines += [
+        column('emails_per_second', '.0f'),
+        column('p50_ms', '.4f'),
+        column('p99_ms', '.4f'),
+        column('accuracy', '.4f'),
+        column('precision', '.4f'),
+        column('recall', '.4f'),
+        column('false_filter_rate', '.4f'),
+    ]
+    for title, rows in (('expected', result['matrix']), ('category', result['by_category'])):
+        lines += ['', f"{title:<14} {'kept':>8} {'filtered':>9}"]
+        lines += [f"{label:<14} {counts['keep']:>8} {counts['filter']:>9}" for label, counts in rows.items()]
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark EmailFilter speed and accuracy against a stored baseline')
+    parser.add_argument('--emails', type=int, default=None, help='Corpus size (default: the baseline corpus, else 5000)')
+    parser.add_argument('--seed', type=int, default=None, help='Corpus seed (default: the baseline corpus, else 1)')
+    parser.add_argument('--repeat', type=int, default=3, help='filter_emails runs; the fastest counts')
+    parser.add_argument('--baseline', default=str(BASELINE_FILE))
+    parser.add_argument('--update', action='store_true', help='Store this run as the new baseline')
+    parser.add_argument('--no-speed', action='store_true', help='Check accuracy only (e.g. on other hardware)')
+    parser.add_argument('--speed-tolerance', type=float, default=SPEED_TOLERANCE)
+    parser.add_argument('--accuracy-tolerance', type=float, default=ACCURACY_TOLERANCE)
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline)
+    stored = baseline['corpus'] if baseline else {'emails': 5000, 'seed': 1}
+    corpus = {
+        'emails': args.emails if args.emails is not None else stored['emails'],
+        'seed': args.seed if args.seed is not None else stored['seed'],
+    }
+    if baseline and corpus != baseline['corpus'] and not args.update:
+        print(f"Baseline {args.baseline} was measured on corpus {baseline['corpus']}, not {corpus}; "
+              f"rerun with --update to replace it")
+        sys.exit(2)
+
+    emails = generate_corpus(corpus['emails'], corpus['seed'])
+    result = run_benchmark(emails, args.repeat)
+    print(f"Corpus: {corpus['emails']} emails, seed {corpus['seed']}\n")
+    print(report(result, None if args.update else baseline))
+
+    if args.update:
+        print(f"\nSaved baseline {save_baseline(result, corpus, args.baseline)}")
+        return
+    if not baseline:
+        print(f"\nNo baseline at {args.baseline}; run with --update to create one")
+        return
+    regressions = compare(result, baseline, args.speed_tolerance, args.accuracy_tolerance, not args.no_speed)
+    if regressions:
+        print('\nRegressions:')
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print('\nNo regressions')
+
+
+if __name__ == '__main__':
+    main()
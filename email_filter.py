@@ -1,292 +1,586 @@
 """
 Email filtering logic to identify and exclude newsletters, notifications, and automated messages
+
+The pattern lists, domains and other rule data live in filter_rules.json. EmailFilter
+checks the file for changes every few seconds and swaps in the new version between
+decisions, without a restart; every FilterResult names the ruleset version that made it.
 """
 
+import logging
+import os
 import re
-from typing import List, Dict, Tuple
+import threading
+import time
+from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, List, Dict, Sequence, Tuple, Optional, Union
 from dataclasses import dataclass
+from filter_profile import FilterProfiler
+from filter_rules import RULES_FILE, Ruleset, load_ruleset, rules_file_key
+from gmail_payload import ESP_HEADERS
+
+try:
+    import numpy as np
+    from newsletter_model import NewsletterModel
+except ImportError:  # filter_emails works without numpy; filter_batch and the classifier need it
+    np = None
+    NewsletterModel = None
+
+# Fields the filter looks at; the batch API accepts these as columns
+FILTER_FIELDS = ('From', 'To', 'Cc', 'Bcc', 'Subject', 'body', 'labelIds', 'headers')
+BATCH_CHUNK_SIZE = 1000
+NO_MATCH_RULE = 0
+SENDER_CACHE_SIZE = 10000
+# Unsubscribe / "view in browser" markers almost always sit near the start or end of a body
+BODY_HEAD_CHARS = 4096
+BODY_TAIL_CHARS = 4096
+SHORT_BODY_CHARS = 50
+# Precedence values of bulk mail (RFC 2076). 'list' is left out: discussion lists
+# such as Google Groups send it on mail written by people
+BULK_PRECEDENCE = ('bulk', 'junk')
+# Headers that decide before the sender rules; see EmailFilter._bulk_header_decision
+STRONG_HEADERS = ('Auto-Submitted', 'Precedence')
+# How often (seconds) the rules file is checked for changes
+RELOAD_INTERVAL = 5.0
+# Earlier rulesets kept so batch decisions can still be described after a reload
+RECENT_RULESETS = 8
+NON_SPACE_RE = re.compile(r'\S')
+_MISSING = object()
+
+logger = logging.getLogger(__name__)
 
 @dataclass
 class FilterResult:
     should_filter: bool
     reason: str
     confidence: float  # 0.0 to 1.0
+    rule_id: int = NO_MATCH_RULE  # Index into the deciding ruleset's rules
+    ruleset_version: str = ''  # Ruleset.version of the rules that decided
+
+@dataclass
+class FilterDecisions:
+    """Columnar filter decisions, one entry per email in input order"""
+    keep: 'np.ndarray'  # bool
+    rule_id: 'np.ndarray'  # int16, index into the ruleset's rules (0 = no rule matched)
+    confidence: 'np.ndarray'  # float64, 0.0 to 1.0
+    ruleset_version: str = ''  # The whole batch is decided by one ruleset
+    
+    def __len__(self) -> int:
+        return len(self.keep)
+    
+    def filtered_indices(self) -> 'np.ndarray':
+        return np.flatnonzero(~self.keep)
+
+class SenderDecisionCache:
+    """
+    Bounded LRU map from a lower-cased From header to its sender-stage decision
+    ((rule_id, detail) or None). Safe to share between threads; pickles as empty.
+    """
+    
+    def __init__(self, max_size: int = SENDER_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, sender: str, default: Any = None) -> Any:
+        with self._lock:
+            if sender in self._entries:
+                self._entries.move_to_end(sender)
+                self.hits += 1
+                return self._entries[sender]
+            self.misses += 1
+            return default
+    
+    def put(self, sender: str, decision: Optional[Tuple[int, Any]]):
+        with self._lock:
+            self._entries[sender] = decision
+            self._entries.move_to_end(sender)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+    
+    def __getstate__(self):
+        # Process-pool workers start with an empty cache of their own
+        return {'max_size': self.max_size}
+    
+    def __setstate__(self, state):
+        self.__init__(state['max_size'])
+
+@dataclass(frozen=True)
+class ActiveRules:
+    """A ruleset plus the state that goes stale with it; replaced as a whole on reload"""
+    ruleset: Ruleset
+    sender_cache: Optional[SenderDecisionCache]
+    profiler: Optional[FilterProfiler]
+    file_key: Optional[Tuple[str, int, int]] = None  # rules_file_key it was loaded at
+
+# Process-pool worker state: each worker gets its own copy of the filter and rules once
+_worker_filter = None
+_worker_rules = None
+
+def _init_worker(email_filter: 'EmailFilter', active: ActiveRules):
+    global _worker_filter, _worker_rules
+    _worker_filter = email_filter
+    _worker_rules = active
+
+def _filter_columns(columns: Dict[str, Sequence]) -> Tuple[List[int], List[float]]:
+    return _worker_filter._decide_columns(columns, _worker_rules)
+
+def _ruleset_property(name: str) -> property:
+    """Read-only EmailFilter attribute that reads `name` from the current ruleset"""
+    return property(lambda self: getattr(self.ruleset, name))
 
 class EmailFilter:
-    def __init__(self):
-        # Patterns that indicate newsletters/notifications
-        self.newsletter_patterns = [
-            r'unsubscribe',
-            r'newsletter',
-            r'daily digest',
-            r'weekly digest',
-            r'marketing',
-            r'promotion',
-            r'sale',
-            r'discount',
-            r'offer',
-            r'deal',
-            r'subscription',
-            r'update.*notification',
-            r'notification.*update',
-            r'alert',
-            r'reminder',
-            r'invitation.*accepted',
-            r'registration.*approved',
-            r'calendar.*notification',
-            r'meeting.*invitation',
-            r'event.*reminder'
-        ]
-        
-        # Patterns that indicate automated/system emails
-        self.automated_patterns = [
-            r'noreply@',
-            r'no-reply@',
-            r'do-not-reply@',
-            r'notification@',
-            r'alerts@',
-            r'mailer@',
-            r'digest@',
-            r'updates@',
-            r'calendar@',
-            r'meetings@',
-            r'invitations@',
-            r'team@',
-            r'support@',
-            r'billing@',
-            r'account@',
-            r'security@',
-            r'privacy@',
-            r'legal@',
-            r'abuse@',
-            r'postmaster@',
-            r'admin@'
-        ]
+    def __init__(self, sender_cache_size: int = SENDER_CACHE_SIZE,
+                 body_head_chars: int = BODY_HEAD_CHARS, body_tail_chars: int = BODY_TAIL_CHARS,
+                 legacy_body_scan: bool = False, profile: bool = False,
+                 classifier: Optional[Union[str, 'NewsletterModel']] = None,
+                 rules: Union[str, Path, Ruleset] = RULES_FILE,
+                 reload_interval: Optional[float] = RELOAD_INTERVAL,
+                 workers: int = 1):
+        """
+        Initialize the email filter
         
-        # Subject patterns to filter
-        self.subject_filter_patterns = [
-            r'^\s*\[.*\]\s*',  # Square bracket prefixes like [Newsletter]
-            r'^\s*Re:\s*\[.*\]\s*',  # Re: [Newsletter]
-            r'^\s*Fwd:\s*\[.*\]\s*',  # Fwd: [Newsletter]
-            r'Your .* statement',
-            r'Your .* receipt',
-            r'Your .* invoice',
-            r'Your .* order',
-            r'Your .* subscription',
-            r'Your .* account',
-            r'Your .* password',
-            r'Your .* verification',
-            r'Your .* confirmation',
-            r'Your .* registration',
-            r'Your .* booking',
-            r'Your .* reservation',
-            r'Payment.*received',
-            r'Transaction.*complete',
-            r'Order.*shipped',
-            r'Delivery.*update',
-            r'Package.*tracking',
-            r'Shipping.*notification',
-            r'Appointment.*reminder',
-            r'Meeting.*reminder',
-            r'Calendar.*invitation',
-            r'Event.*invitation',
-            r'You.*been.*invited',
-            r'You.*been.*added',
-            r'You.*been.*mentioned',
-            r'Welcome to',
-            r'Thank you for',
-            r'Confirm your',
-            r'Verify your',
-            r'Update your',
-            r'Change your',
-            r'Reset your',
-            r'Your.*has been',
-            r'Your.*have been',
-            r'Your.*was',
-            r'Your.*were',
-            r'Important notice',
-            r'Action required',
-            r'Urgent.*required',
-            r'Security.*alert',
-            r'Privacy.*update',
-            r'Terms.*update',
-            r'Policy.*update'
-        ]
+        Args:
+            sender_cache_size: Distinct senders whose sender/domain decision is kept
+                (LRU); 0 disables the cache
+            body_head_chars: Leading body characters scanned before the rest of the body
+            body_tail_chars: Trailing body characters scanned before the rest of the body
+            legacy_body_scan: Scan the whole lower-cased body in one go, as before. The
+                windowed scan makes the same keep/filter decisions, but when several body
+                patterns match it can name one found in a window over an earlier-listed
+                one elsewhere in the body
+            profile: Record per-rule evaluation/hit counts and timings and per-email
+                decision times in self.profiler (see filter_profile.py); batches then
+                run in-process. Counters restart when new rules are loaded
+            classifier: NewsletterModel (or the path of a saved one) to score emails
+                that pass the header rules. Scores at or above its filter_threshold
+                filter the email, scores at or below its keep_threshold keep it, and
+                only emails in between go through the subject and body patterns
+            rules: Rules config file (see filter_rules.json), or a fixed Ruleset
+            reload_interval: Seconds between checks of the rules file for changes;
+                None never reloads. A file that fails to load is logged and the
+                current rules stay in use
+            workers: Default processes for filter_batch and filter_emails. 1 filters
+                in-process; more starts a process pool per call, which only pays off
+                for batches of thousands of emails
+        """
+        self.body_head_chars = body_head_chars
+        self.body_tail_chars = body_tail_chars
+        self.legacy_body_scan = legacy_body_scan
+        self.sender_cache_size = sender_cache_size
+        self.profile = profile
+        self.workers = workers
         
-        # Body patterns that indicate automated content
-        self.body_filter_patterns = [
-            r'click here to unsubscribe',
-            r'unsubscribe.*here',
-            r'opt out.*here',
-            r'preferences.*here',
-            r'manage.*subscription',
-            r'update.*preferences',
-            r'download.*app',
-            r'get.*app',
-            r'install.*app',
-            r'follow us on',
-            r'connect with us',
-            r'social media',
-            r'facebook.*twitter',
-            r'instagram.*linkedin',
-            r'terms.*conditions',
-            r'privacy.*policy',
-            r'legal.*notice',
-            r'disclaimer',
-            r'no longer receive',
-            r'stop receiving',
-            r'don\'t want to receive',
-            r'if you received this',
-            r'this email was sent',
-            r'sent to.*because',
-            r'you received this',
-            r'view this email',
-            r'display problems',
-            r'email not displaying',
-            r'view in browser',
-            r'online version'
-        ]
+        if isinstance(rules, Ruleset):
+            self.rules_path = None
+            self._active = self._activate(rules)
+        else:
+            self.rules_path = Path(rules)
+            key = rules_file_key(self.rules_path)
+            self._active = self._activate(load_ruleset(self.rules_path), key)
+        self.reload_interval = reload_interval if self.rules_path else None
+        self._next_reload_check = time.monotonic() + (reload_interval or 0)
+        self._recent_rulesets = OrderedDict([(self._active.ruleset.version, self._active.ruleset)])
         
-        # Common newsletter/notification domains
-        self.filter_domains = [
-            'mailchimp.com',
-            'sendgrid.com',
-            'constantcontact.com',
-            'campaignmonitor.com',
-            'mailgun.com',
-            'postmarkapp.com',
-            'convertkit.com',
-            'aweber.com',
-            'getresponse.com',
-            'activecampaign.com',
-            'hubspot.com',
-            'salesforce.com',
-            'marketo.com',
-            'pardot.com',
-            'customer.io',
-            'braze.com',
-            'leanplum.com',
-            'airship.com',
-            'onesignal.com',
-            'pushwoosh.com'
-        ]
+        if classifier is not None and NewsletterModel is None:
+            raise ImportError("The newsletter classifier needs numpy (pip install numpy)")
+        if isinstance(classifier, (str, os.PathLike)):
+            classifier = NewsletterModel.load(classifier)
+        self.classifier = classifier
+        # Auto-Submitted and Precedence are dictionary lookups, so they go before any
+        # pattern; the weaker List-Unsubscribe / ESP signals follow the sender rules
+        if classifier is None:
+            self._email_checks = (self._check_bulk_headers, self._check_sender, self._check_list_headers,
+                                  self._check_subject, self._check_body, self._check_recipients, self._check_labels,
+                                  self._check_notification_sender)
+            self._header_checks = (self._check_bulk_headers, self._check_sender, self._check_list_headers,
+                                   self._check_subject, self._check_recipients, self._check_labels,
+                                   self._check_notification_sender)
+        else:
+            # The cheap header rules first; the subject and body patterns (the source of
+            # most false positives) only for emails the classifier is unsure about
+            self._header_checks = (self._check_bulk_headers, self._check_sender, self._check_list_headers,
+                                   self._check_recipients, self._check_labels, self._check_notification_sender)
+            self._email_checks = self._header_checks + (self._check_classifier, self._check_subject, self._check_body)
+    
+    def _activate(self, ruleset: Ruleset, file_key: Optional[Tuple[str, int, int]] = None) -> ActiveRules:
+        # Sender decisions and profile counters are rule IDs of one ruleset, so both start
+        # afresh with it
+        return ActiveRules(
+            ruleset=ruleset,
+            sender_cache=SenderDecisionCache(self.sender_cache_size) if self.sender_cache_size else None,
+            profiler=FilterProfiler(ruleset.rules) if self.profile else None,
+            file_key=file_key
+        )
+    
+    def _current(self) -> ActiveRules:
+        """The rules to decide with, reloading the rules file if it changed"""
+        if self.reload_interval is not None and time.monotonic() >= self._next_reload_check:
+            self.reload()
+        return self._active
+    
+    def reload(self) -> Ruleset:
+        """
+        Load the rules file now if it changed since it was last loaded
         
-        # Compile all regex patterns
-        self.newsletter_regex = [re.compile(pattern, re.IGNORECASE) for pattern in self.newsletter_patterns]
-        self.automated_regex = [re.compile(pattern, re.IGNORECASE) for pattern in self.automated_patterns]
-        self.subject_filter_regex = [re.compile(pattern, re.IGNORECASE) for pattern in self.subject_filter_patterns]
-        self.body_filter_regex = [re.compile(pattern, re.IGNORECASE) for pattern in self.body_filter_patterns]
-
+        Returns:
+            The ruleset in use afterwards (the old one if the file could not be loaded)
+        """
+        if self.rules_path is None:
+            return self._active.ruleset
+        self._next_reload_check = time.monotonic() + (self.reload_interval or 0)
+        try:
+            key = rules_file_key(self.rules_path)
+            if key != self._active.file_key:
+                ruleset = load_ruleset(self.rules_path)
+                if ruleset is not self._active.ruleset:
+                    # One assignment: a decision in progress keeps the rules it started with
+                    self._active = self._activate(ruleset, key)
+                    self._recent_rulesets[ruleset.version] = ruleset
+                    while len(self._recent_rulesets) > RECENT_RULESETS:
+                        self._recent_rulesets.popitem(last=False)
+                    logger.info(f"Email filter now using rules {ruleset.version}")
+        except (OSError, ValueError) as e:
+            logger.error(f"Keeping filter rules {self._active.ruleset.version}: could not load {self.rules_path}: {e}")
+        return self._active.ruleset
+    
+    @property
+    def ruleset(self) -> Ruleset:
+        return self._current().ruleset
+    
+    @property
+    def sender_cache(self) -> Optional[SenderDecisionCache]:
+        return self._active.sender_cache
+    
+    @property
+    def profiler(self) -> Optional[FilterProfiler]:
+        return self._active.profiler
+    
+    # Pattern lists, matchers, the rule table and rule IDs of the current ruleset
+    newsletter_patterns = _ruleset_property('newsletter_patterns')
+    automated_patterns = _ruleset_property('automated_patterns')
+    subject_filter_patterns = _ruleset_property('subject_filter_patterns')
+    body_filter_patterns = _ruleset_property('body_filter_patterns')
+    filter_domains = _ruleset_property('filter_domains')
+    notification_senders = _ruleset_property('notification_senders')
+    filter_labels = _ruleset_property('filter_labels')
+    max_recipients = _ruleset_property('max_recipients')
+    automated_matcher = _ruleset_property('automated_matcher')
+    subject_matcher = _ruleset_property('subject_matcher')
+    body_matcher = _ruleset_property('body_matcher')
+    rules = _ruleset_property('rules')
+    automated_rule = _ruleset_property('automated_rule')
+    domain_rule = _ruleset_property('domain_rule')
+    subject_rule = _ruleset_property('subject_rule')
+    body_rule = _ruleset_property('body_rule')
+    short_body_rule = _ruleset_property('short_body_rule')
+    recipients_rule = _ruleset_property('recipients_rule')
+    labels_rule = _ruleset_property('labels_rule')
+    notification_sender_rule = _ruleset_property('notification_sender_rule')
+    classifier_rule = _ruleset_property('classifier_rule')
+    auto_submitted_rule = _ruleset_property('auto_submitted_rule')
+    precedence_rule = _ruleset_property('precedence_rule')
+    list_unsubscribe_rule = _ruleset_property('list_unsubscribe_rule')
+    esp_rule = _ruleset_property('esp_rule')
+    header_rules = _ruleset_property('header_rules')
+    
+    @staticmethod
+    def _match(rs: Ruleset, rule_id: int, detail: Any = None) -> FilterResult:
+        reason, confidence = rs.rules[rule_id]
+        if detail is not None:
+            reason = f"{reason}: {detail}"
+        return FilterResult(should_filter=True, reason=reason, confidence=confidence, rule_id=rule_id,
+                            ruleset_version=rs.version)
+    
     def should_filter_email(self, email: Dict) -> FilterResult:
         """
         Determine if an email should be filtered out (excluded from processing)
         
         Args:
             email: Dictionary containing email data with keys: From, To, Subject, body, etc.
-            
+        
         Returns:
             FilterResult with decision and reasoning
         """
+        return self._decide(email, self._email_checks, self._current())
+    
+    def should_filter_headers(self, email: Dict) -> FilterResult:
+        """
+        Header-only subset of should_filter_email: bulk-mail headers, sender, domain,
+        subject, recipient count, Gmail labels and notification senders. Needs no body,
+        so it can run on format=metadata messages before deciding which bodies to download.
         
-        # Check sender email address
-        sender_email = email.get('From', '').lower()
-        for pattern in self.automated_regex:
-            if pattern.search(sender_email):
-                return FilterResult(
-                    should_filter=True,
-                    reason=f"Automated sender pattern: {pattern.pattern}",
-                    confidence=0.9
-                )
+        Args:
+            email: Dictionary with header keys (From, To, Cc, Bcc, Subject, labelIds, headers)
+        
+        Returns:
+            FilterResult with decision and reasoning
+        """
+        return self._decide(email, self._header_checks, self._current())
+    
+    def _decide(self, email: Dict, checks: Sequence, active: ActiveRules,
+                probability: Optional[float] = None) -> FilterResult:
+        """
+        Run checks in order until one decides; probability is the classifier score
+        when the batch API has already computed it
+        """
+        profiler = active.profiler
+        if profiler is None:
+            for check in checks:
+                if probability is None or check != self._check_classifier:
+                    result = check(email, active)
+                else:
+                    result = check(email, active, probability)
+                if result:
+                    return result
+            return self._no_match(active.ruleset)
+        
+        # Same chain, timing each stage and the whole decision
+        rs = active.ruleset
+        stage_rules = {
+            'recipients': rs.recipients_rule,
+            'labels': rs.labels_rule,
+            'notification_sender': rs.notification_sender_rule
+        }
+        start = time.perf_counter()
+        result = None
+        for check in checks:
+            stage_start = time.perf_counter()
+            if probability is None or check != self._check_classifier:
+                result = check(email, active)
+            else:
+                result = check(email, active, probability)
+            elapsed = time.perf_counter() - stage_start
+            stage = check.__name__[len('_check_'):]
+            profiler.stage(stage, elapsed)
+            # Stages that are a single rule are timed as that rule
+            if stage in stage_rules:
+                profiler.rule(stage_rules[stage], elapsed)
+            if result:
+                break
+        result = result or self._no_match(rs)
+        profiler.decision(result.rule_id, time.perf_counter() - start)
+        return result
+    
+    @staticmethod
+    def _no_match(rs: Ruleset) -> FilterResult:
+        # If none of the filters matched, don't filter
+        reason, confidence = rs.rules[NO_MATCH_RULE]
+        return FilterResult(should_filter=False, reason=reason, confidence=confidence, rule_id=NO_MATCH_RULE,
+                            ruleset_version=rs.version)
+    
+    def _check_bulk_headers(self, email: Dict, active: ActiveRules) -> Optional[FilterResult]:
+        headers = email.get('headers')
+        if not headers:
+            return None
+        decision = self._bulk_header_decision(active.ruleset, headers)
+        return self._match(active.ruleset, *decision) if decision else None
+    
+    @staticmethod
+    def _bulk_header_decision(rs: Ruleset, headers: Dict[str, str]) -> Optional[Tuple[int, Any]]:
+        """(rule_id, detail) for an Auto-Submitted or bulk Precedence header, or None"""
+        # Auto-Submitted: no marks mail sent by a person (RFC 3834)
+        auto_submitted = headers.get('Auto-Submitted', '').split(';')[0].strip().lower()
+        if auto_submitted and auto_submitted != 'no':
+            return rs.auto_submitted_rule, auto_submitted
+        precedence = headers.get('Precedence', '').strip().lower()
+        if precedence in BULK_PRECEDENCE:
+            return rs.precedence_rule, precedence
+        return None
+    
+    def _check_list_headers(self, email: Dict, active: ActiveRules) -> Optional[FilterResult]:
+        headers = email.get('headers')
+        if not headers:
+            return None
+        decision = self._list_header_decision(active.ruleset, headers)
+        return self._match(active.ruleset, *decision) if decision else None
+    
+    @staticmethod
+    def _list_header_decision(rs: Ruleset, headers: Dict[str, str]) -> Optional[Tuple[int, Any]]:
+        """
+        (rule_id, detail) for List-Unsubscribe with an ESP header or without a List-Id, or None
         
-        # Check sender domain
-        sender_domain = self._extract_domain(sender_email)
-        if sender_domain in self.filter_domains:
-            return FilterResult(
-                should_filter=True,
-                reason=f"Known email marketing domain: {sender_domain}",
-                confidence=0.8
-            )
+        Neither header is bulk mail on its own: discussion lists (Google Groups, Mailman)
+        add List-Id and List-Unsubscribe to mail written by people, and transactional
+        relays (Amazon SES, SendGrid, ...) send personal replies with an ESP header.
+        """
+        if 'List-Unsubscribe' not in headers:
+            return None
+        for name, vendor in ESP_HEADERS.items():
+            if name in headers:
+                return rs.esp_rule, vendor
+        if 'List-Id' in headers:
+            return None
+        return rs.list_unsubscribe_rule, None
+    
+    def _check_sender(self, email: Dict, active: ActiveRules) -> Optional[FilterResult]:
+        decision = self._sender_decision(email.get('From', '').lower(), active)
+        return self._match(active.ruleset, *decision) if decision else None
+    
+    def _sender_decision(self, sender_email: str, active: ActiveRules) -> Optional[Tuple[int, Any]]:
+        """(rule_id, detail) of the sender/domain stage for a lower-cased From header"""
+        cache, profiler, rs = active.sender_cache, active.profiler, active.ruleset
+        if cache is not None:
+            decision = cache.get(sender_email, _MISSING)
+            if decision is not _MISSING:
+                return decision
         
+        decision = None
+        # Check sender email address
+        index = rs.automated_matcher.first_match(sender_email, profiler, rs.automated_rule)
+        if index is not None:
+            decision = (rs.automated_rule + index, None)
+        else:
+            # Check sender domain
+            start = time.perf_counter() if profiler is not None else 0.0
+            sender_domain = self._extract_domain(sender_email)
+            if sender_domain in rs.filter_domains:
+                decision = (rs.domain_rule, sender_domain)
+            if profiler is not None:
+                profiler.rule(rs.domain_rule, time.perf_counter() - start)
+        
+        if cache is not None:
+            cache.put(sender_email, decision)
+        return decision
+    
+    def _check_classifier(self, email: Dict, active: ActiveRules,
+                          probability: Optional[float] = None) -> Optional[FilterResult]:
+        rs = active.ruleset
+        if probability is None:
+            probability = float(self.classifier.score([email])[0])
+        if probability >= self.classifier.filter_threshold:
+            return FilterResult(should_filter=True, reason=rs.rules[rs.classifier_rule][0],
+                                confidence=probability, rule_id=rs.classifier_rule, ruleset_version=rs.version)
+        if probability <= self.classifier.keep_threshold:
+            # Confidently personal: stop here so no subject/body pattern can filter it
+            return self._no_match(rs)
+        return None
+    
+    def _check_subject(self, email: Dict, active: ActiveRules) -> Optional[FilterResult]:
         # Check subject line
+        rs = active.ruleset
         subject = email.get('Subject', '').lower()
-        for pattern in self.subject_filter_regex:
-            if pattern.search(subject):
-                return FilterResult(
-                    should_filter=True,
-                    reason=f"Subject filter pattern: {pattern.pattern}",
-                    confidence=0.7
-                )
+        index = rs.subject_matcher.first_match(subject, active.profiler, rs.subject_rule)
+        if index is not None:
+            return self._match(rs, rs.subject_rule + index)
+        return None
+    
+    def _check_body(self, email: Dict, active: ActiveRules) -> Optional[FilterResult]:
+        if self.legacy_body_scan:
+            return self._check_body_legacy(email, active)
         
+        rs, profiler = active.ruleset, active.profiler
+        body = email.get('body', '')
+        index = self._scan_body(body, active)
+        if index is not None:
+            return self._match(rs, rs.body_rule + index)
+        
+        # Check for very short or empty bodies (likely notifications)
+        start = time.perf_counter() if profiler is not None else 0.0
+        short = self._is_short_body(body)
+        if profiler is not None:
+            profiler.rule(rs.short_body_rule, time.perf_counter() - start)
+        if short:
+            return self._match(rs, rs.short_body_rule)
+        return None
+    
+    def _check_body_legacy(self, email: Dict, active: ActiveRules) -> Optional[FilterResult]:
         # Check body content
+        rs, profiler = active.ruleset, active.profiler
         body = email.get('body', '').lower()
-        for pattern in self.body_filter_regex:
-            if pattern.search(body):
-                return FilterResult(
-                    should_filter=True,
-                    reason=f"Body filter pattern: {pattern.pattern}",
-                    confidence=0.6
-                )
+        index = rs.body_matcher.first_match(body, profiler, rs.body_rule)
+        if index is not None:
+            return self._match(rs, rs.body_rule + index)
         
         # Check for very short or empty bodies (likely notifications)
-        if len(body.strip()) < 50:
-            return FilterResult(
-                should_filter=True,
-                reason="Very short or empty body content",
-                confidence=0.5
-            )
-        
+        start = time.perf_counter() if profiler is not None else 0.0
+        short = len(body.strip()) < SHORT_BODY_CHARS
+        if profiler is not None:
+            profiler.rule(rs.short_body_rule, time.perf_counter() - start)
+        if short:
+            return self._match(rs, rs.short_body_rule)
+        return None
+    
+    def _scan_body(self, body: str, active: ActiveRules) -> Optional[int]:
+        """Index of a matching body pattern: head and tail windows first, whole body if undecided"""
+        head, tail = self.body_head_chars, self.body_tail_chars
+        rs, profiler = active.ruleset, active.profiler
+        matcher = rs.body_matcher
+        if len(body) > head + tail and matcher.window_safe:
+            # Only the windows are lower-cased; most newsletters are decided here
+            matches = [
+                index for index in (
+                    matcher.first_match(body[:head].lower(), profiler, rs.body_rule) if head else None,
+                    matcher.first_match(body[-tail:].lower(), profiler, rs.body_rule) if tail else None,
+                )
+                if index is not None
+            ]
+            if matches:
+                return min(matches)
+        return matcher.first_match(body.lower(), profiler, rs.body_rule)
+    
+    def _is_short_body(self, body: str) -> bool:
+        """Same as len(body.lower().strip()) < SHORT_BODY_CHARS without copying long bodies"""
+        if len(body) >= SHORT_BODY_CHARS:
+            # lower() never shortens text, so enough characters between the first and
+            # last non-space character settle it
+            first = NON_SPACE_RE.search(body)
+            if first is not None and NON_SPACE_RE.search(body, first.start() + SHORT_BODY_CHARS - 1):
+                return False
+        return len(body.lower().strip()) < SHORT_BODY_CHARS
+    
+    def _check_recipients(self, email: Dict, active: ActiveRules) -> Optional[FilterResult]:
         # Check for high recipient count (likely newsletters/announcements)
+        rs = active.ruleset
+        recipient_count = self._recipient_count(email)
+        if recipient_count > rs.max_recipients:
+            return self._match(rs, rs.recipients_rule, recipient_count)
+        return None
+    
+    def _recipient_count(self, email: Dict) -> int:
         to_field = email.get('To', '').lower()
         cc_field = email.get('Cc', '').lower()
         bcc_field = email.get('Bcc', '').lower()
         
         all_recipients = f"{to_field} {cc_field} {bcc_field}"
-        recipient_count = len([r.strip() for r in all_recipients.split(',') if r.strip() and '@' in r])
-        
-        if recipient_count > 10:
-            return FilterResult(
-                should_filter=True,
-                reason=f"High recipient count: {recipient_count}",
-                confidence=0.6
-            )
-        
+        return len([r.strip() for r in all_recipients.split(',') if r.strip() and '@' in r])
+    
+    def _check_labels(self, email: Dict, active: ActiveRules) -> Optional[FilterResult]:
         # Check for Gmail categories that indicate automated content
+        rs = active.ruleset
         label_ids = email.get('labelIds', [])
-        if any(label in label_ids for label in ['CATEGORY_PROMOTIONS', 'CATEGORY_SOCIAL', 'CATEGORY_UPDATES']):
-            return FilterResult(
-                should_filter=True,
-                reason=f"Gmail category indicates automated content: {label_ids}",
-                confidence=0.7
-            )
-        
+        if any(label in label_ids for label in rs.filter_labels):
+            return self._match(rs, rs.labels_rule, label_ids)
+        return None
+    
+    def _check_notification_sender(self, email: Dict, active: ActiveRules) -> Optional[FilterResult]:
         # Check for common notification senders
-        notification_senders = [
-            'calendar-notification@google.com',
-            'calendar-noreply@google.com',
-            'drive-shares-noreply@google.com',
-            'docs-noreply@google.com',
-            'sheets-noreply@google.com',
-            'slides-noreply@google.com',
-            'meet-noreply@google.com',
-            'classroom-noreply@google.com',
-            'no-reply@accounts.google.com',
-            'security-noreply@google.com',
-            'password-assistance@accounts.google.com'
-        ]
-        
-        if any(sender in notification_senders for sender in [sender_email]):
-            return FilterResult(
-                should_filter=True,
-                reason=f"Known notification sender: {sender_email}",
-                confidence=0.9
-            )
-        
-        # If none of the filters matched, don't filter
-        return FilterResult(
-            should_filter=False,
-            reason="No filtering criteria matched",
-            confidence=0.0
-        )
+        rs = active.ruleset
+        sender_email = email.get('From', '').lower()
+        if sender_email in rs.notification_senders:
+            return self._match(rs, rs.notification_sender_rule, sender_email)
+        return None
     
     def _extract_domain(self, email_address: str) -> str:
         """Extract domain from email address"""
@@ -295,28 +589,181 @@ class EmailFilter:
             return match.group(1).lower()
         return ""
     
+    def describe(self, rule_id: int, email: Dict, ruleset_version: Optional[str] = None) -> str:
+        """
+        Rebuild the reason string for a batch decision
+        
+        Args:
+            rule_id: Rule ID from FilterDecisions.rule_id
+            email: The email the decision was made for (only headers are read)
+            ruleset_version: FilterDecisions.ruleset_version (None = the current rules)
+        
+        Returns:
+            The same reason should_filter_email would have given
+        
+        Raises:
+            KeyError: If that ruleset version is no longer kept
+        """
+        rs = self._active.ruleset if ruleset_version is None else self._recent_rulesets[ruleset_version]
+        rule_id = int(rule_id)
+        reason, _ = rs.rules[rule_id]
+        if rule_id in rs.header_rules:
+            headers = email.get('headers') or {}
+            _, detail = self._bulk_header_decision(rs, headers) or self._list_header_decision(rs, headers)
+            return reason if detail is None else f"{reason}: {detail}"
+        sender_email = email.get('From', '').lower()
+        if rule_id == rs.domain_rule:
+            return f"{reason}: {self._extract_domain(sender_email)}"
+        if rule_id == rs.recipients_rule:
+            return f"{reason}: {self._recipient_count(email)}"
+        if rule_id == rs.labels_rule:
+            return f"{reason}: {email.get('labelIds', [])}"
+        if rule_id == rs.notification_sender_rule:
+            return f"{reason}: {sender_email}"
+        return reason
+    
+    def _decide_emails(self, emails: Sequence[Dict], active: ActiveRules) -> Tuple[List[int], List[float]]:
+        """rule_id and confidence lists for a batch of emails"""
+        rule_ids = [NO_MATCH_RULE] * len(emails)
+        confidences = [0.0] * len(emails)
+        rs, profiler = active.ruleset, active.profiler
+        
+        # Pre-pass: decide each distinct sender once; every email from a bulk sender
+        # gets that decision without running any other check
+        senders = [email.get('From', '') for email in emails]
+        bulk_senders = {}
+        start = time.perf_counter() if profiler is not None else 0.0
+        for sender in set(senders):
+            decision = self._sender_decision(sender.lower(), active)
+            if decision:
+                bulk_senders[sender] = decision[0]
+        if profiler is not None:
+            profiler.stage('sender_prepass', time.perf_counter() - start)
+        
+        # Classifier scores for everything else, in one vectorized pass
+        probabilities = {}
+        if self.classifier is not None:
+            start = time.perf_counter() if profiler is not None else 0.0
+            pending = [i for i, sender in enumerate(senders) if sender not in bulk_senders]
+            if pending:
+                scores = self.classifier.score([emails[i] for i in pending])
+                probabilities = dict(zip(pending, scores.tolist()))
+            if profiler is not None:
+                profiler.stage('classifier_batch', time.perf_counter() - start)
+        
+        for i, email in enumerate(emails):
+            start = time.perf_counter() if profiler is not None else 0.0
+            # Auto-Submitted and Precedence rank above the sender rules, so emails carrying
+            # either go the long way
+            headers = email.get('headers')
+            strong = headers and any(name in headers for name in STRONG_HEADERS)
+            rule_id = bulk_senders.get(senders[i]) if not strong else None
+            if rule_id is None:
+                result = self._decide(email, self._email_checks, active, probabilities.get(i))
+                rule_id, confidence = result.rule_id, result.confidence
+            else:
+                confidence = rs.rules[rule_id][1]
+                if profiler is not None:
+                    profiler.decision(rule_id, time.perf_counter() - start)
+            rule_ids[i] = rule_id
+            confidences[i] = confidence
+        return rule_ids, confidences
+    
+    def _decide_columns(self, columns: Dict[str, Sequence], active: ActiveRules) -> Tuple[List[int], List[float]]:
+        """rule_id and confidence lists for one chunk of columns (runs in pool workers)"""
+        fields = list(columns)
+        emails = [
+            {f: v for f, v in zip(fields, values) if v is not None}
+            for values in zip(*(columns[f] for f in fields))
+        ]
+        return self._decide_emails(emails, active)
+    
+    def filter_batch(self, emails: Optional[Sequence[Dict]] = None,
+                     columns: Optional[Dict[str, Sequence]] = None,
+                     workers: Optional[int] = None,
+                     chunk_size: int = BATCH_CHUNK_SIZE) -> FilterDecisions:
+        """
+        Filter many emails at once without modifying them
+        
+        Args:
+            emails: Email dictionaries (give either emails or columns)
+            columns: Equal-length sequences keyed by field name (From, To, Cc, Bcc,
+                Subject, body, labelIds, headers); missing fields count as empty
+            workers: Processes to spread matching over; None uses the filter's workers.
+                Always 1 while profiling, since worker processes could not report back
+            chunk_size: Emails sent to a worker at a time
+        
+        Returns:
+            FilterDecisions with keep flags, rule IDs and confidences in input order,
+            all decided by the ruleset named in its ruleset_version
+        
+        Raises:
+            ImportError: If numpy is not installed (filter_emails does not need it)
+        """
+        if np is None:
+            raise ImportError("filter_batch needs numpy (pip install numpy); use filter_emails without it")
+        rule_ids, confidences, ruleset_version = self._decide_batch(emails, columns, workers, chunk_size)
+        rule_ids = np.array(rule_ids, dtype=np.int16)
+        return FilterDecisions(keep=rule_ids == NO_MATCH_RULE, rule_id=rule_ids,
+                               confidence=np.array(confidences, dtype=np.float64), ruleset_version=ruleset_version)
+    
+    def _decide_batch(self, emails: Optional[Sequence[Dict]], columns: Optional[Dict[str, Sequence]],
+                      workers: Optional[int], chunk_size: int) -> Tuple[List[int], List[float], str]:
+        """rule_id and confidence lists in input order, and the deciding ruleset version (see filter_batch)"""
+        if (emails is None) == (columns is None):
+            raise ValueError("Pass exactly one of emails or columns")
+        size = len(emails) if emails is not None else len(next(iter(columns.values()), []))
+        active = self._current()
+        if workers is None:
+            workers = self.workers
+        if active.profiler is not None:
+            workers = 1
+        
+        rule_ids, confidences = [], []
+        if workers <= 1 or size <= chunk_size:
+            if emails is not None:
+                rule_ids, confidences = self._decide_emails(emails, active)
+            elif size:
+                rule_ids, confidences = self._decide_columns(columns, active)
+        else:
+            # Ship only the fields the rules read, chunk by chunk
+            def chunks():
+                for start in range(0, size, chunk_size):
+                    if emails is not None:
+                        part = emails[start:start + chunk_size]
+                        yield {f: [e.get(f) for e in part] for f in FILTER_FIELDS}
+                    else:
+                        yield {f: list(values[start:start + chunk_size]) for f, values in columns.items()}
+            
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self, active)) as pool:
+                for chunk_rules, chunk_confidences in pool.map(_filter_columns, chunks()):
+                    rule_ids.extend(chunk_rules)
+                    confidences.extend(chunk_confidences)
+        
+        return rule_ids, confidences, active.ruleset.version
+    
     def filter_emails(self, emails: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
         """
         Filter a list of emails into kept and filtered lists
         
         Args:
             emails: List of email dictionaries
-            
+        
         Returns:
             Tuple of (kept_emails, filtered_emails)
         """
         kept_emails = []
         filtered_emails = []
         
-        for email in emails:
-            filter_result = self.should_filter_email(email)
-            
-            if filter_result.should_filter:
-                email['_filter_reason'] = filter_result.reason
-                email['_filter_confidence'] = filter_result.confidence
-                filtered_emails.append(email)
-            else:
+        rule_ids, confidences, ruleset_version = self._decide_batch(emails, None, None, BATCH_CHUNK_SIZE)
+        for email, rule_id, confidence in zip(emails, rule_ids, confidences):
+            if rule_id == NO_MATCH_RULE:
                 kept_emails.append(email)
+            else:
+                email['_filter_reason'] = self.describe(rule_id, email, ruleset_version)
+                email['_filter_confidence'] = float(confidence)
+                email['_filter_ruleset'] = ruleset_version
+                filtered_emails.append(email)
         
         return kept_emails, filtered_emails
 
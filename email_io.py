@@ -0,0 +1,153 @@
+"""
+Reading and writing email export files.
+
+Formats are picked by file name:
+- *.json: a JSON list of records (the original export format)
+- *.ndjson / *.jsonl: one JSON record per line, gzip-compressed when the name ends in .gz
+- *.store: a chunked, indexed EmailStore directory (see email_store.py)
+
+Writers append one record at a time and readers yield one record at a time, so an
+export never has to be held in memory as a whole.
+"""
+
+import gzip
+import io
+import json
+from pathlib import Path
+from typing import Dict, IO, Iterable, Iterator, Union
+
+from email_store import EmailStore, is_store
+
+NDJSON_SUFFIXES = ('.ndjson', '.jsonl')
+
+
+def is_ndjson(path: Union[str, Path]) -> bool:
+    """True for *.ndjson / *.jsonl paths, optionally with a trailing .gz"""
+    name = str(path).lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return name.endswith(NDJSON_SUFFIXES)
+
+
+def _open_text(path: Union[str, Path], mode: str) -> IO[str]:
+    if str(path).lower().endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class NDJSONWriter:
+    """Append one JSON record per line (gzip when the path ends in .gz)"""
+
+    def __init__(self, path: Union[str, Path], append: bool = False):
+        self.path = Path(path)
+        self.count = 0
+        self._file = _open_text(self.path, 'a' if append else 'w')
+
+    def write(self, record: Dict):
+        self._file.write(json.dumps(record, ensure_ascii=False))
+        self._file.write('\n')
+        self.count += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class JSONListWriter:
+    """Write a JSON list one element at a time (same layout as json.dump(indent=2))"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.count = 0
+        self._file = _open_text(self.path, 'w')
+        self._file.write('[')
+
+    def write(self, record: Dict):
+        self._file.write(',\n  ' if self.count else '\n  ')
+        text = json.dumps(record, indent=2, ensure_ascii=False)
+        self._file.write(text.replace('\n', '\n  '))
+        self.count += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.write('\n]' if self.count else ']')
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def open_writer(path: Union[str, Path], append: bool = False):
+    """Streaming writer for an export path; the format is chosen by file name"""
+    if is_store(path):
+        # A store is always appended to; records with a known ID replace the stored copy
+        return EmailStore(path)
+    if is_ndjson(path):
+        return NDJSONWriter(path, append=append)
+    if append:
+        raise ValueError(f"Appending is only supported for NDJSON exports, not {path}")
+    return JSONListWriter(path)
+
+
+def write_emails(path: Union[str, Path], records: Iterable[Dict]) -> int:
+    """Stream records into an export file; returns the number written"""
+    with open_writer(path) as writer:
+        for record in records:
+            writer.write(record)
+        return writer.count
+
+
+def iter_ndjson(lines: Iterable[Union[str, bytes]]) -> Iterator[Dict]:
+    """Parse NDJSON lines lazily, skipping blank lines"""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def iter_ndjson_stream(stream: IO[bytes], gzipped: bool = False) -> Iterator[Dict]:
+    """Parse NDJSON from a binary file object (e.g. an upload) without reading it all; the stream is left open"""
+    if gzipped:
+        # Explicit mode: GzipFile would otherwise take it from the file object (uploads are w+b)
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    text = io.TextIOWrapper(stream, encoding='utf-8')
+    try:
+        yield from iter_ndjson(text)
+    finally:
+        # Closing (or garbage-collecting) the wrapper would close the caller's stream
+        text.detach()
+
+
+def iter_emails(path: Union[str, Path]) -> Iterator[Dict]:
+    """
+    Yield email records from an export file.
+    NDJSON files and stores are read incrementally; legacy JSON lists are loaded in one go.
+    """
+    if is_store(path):
+        with EmailStore(path) as store:
+            yield from store.iter_emails()
+        return
+    if is_ndjson(path):
+        with _open_text(path, 'r') as f:
+            yield from iter_ndjson(f)
+        return
+    with _open_text(path, 'r') as f:
+        records = json.load(f)
+    if not isinstance(records, list):
+        raise ValueError(f"{path} does not contain a list of emails")
+    yield from records
@@ -4,27 +4,70 @@ Main email processing pipeline for extracting relationships, expertise, and inte
 
 import json
 import logging
-from typing import Dict, List, Optional, Tuple, Any
+import sys
+import asyncio
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple, Any
 from datetime import datetime, date
 import re
 from email.utils import parseaddr
+from itertools import islice
 from email_filter import EmailFilter, FilterResult
 from llm_prompts import LLMPromptTemplates
+from llm_async import DEFAULT_MAX_CONCURRENCY, LLMExecutor
+from llm_cache import LLMCache, cache_key
+from email_io import iter_emails
+from email_store import EmailStore, is_store
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Streaming (iter_process_emails): emails filtered per batch, threads held open at most
+STREAM_BATCH_SIZE = 500
+MAX_OPEN_THREADS = 1000
+# Fields kept of a filtered email in streamed results (the body is dropped)
+FILTERED_FIELDS = ('id', 'threadId', 'From', 'Subject', 'Date', '_filter_reason', '_filter_confidence', '_filter_ruleset')
+
 class EmailProcessor:
-    def __init__(self, llm_client=None):
+    def __init__(self, llm_client=None, email_filter: Optional[EmailFilter] = None,
+                 combined_extraction: bool = False, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 llm_rate_limits: Optional[Dict[str, float]] = None, llm_cache: Optional[LLMCache] = None,
+                 thread_extraction: bool = False, model_id: Optional[str] = None):
         """
         Initialize the email processor
         
         Args:
             llm_client: Client for making LLM API calls (OpenAI, Anthropic, etc.)
+            email_filter: Configured EmailFilter (e.g. with a newsletter classifier);
+                defaults to EmailFilter()
+            combined_extraction: Extract people, companies, summary, expertise and roles
+                with one LLM call per email instead of four
+            max_concurrency: Most LLM requests in flight at once in aprocess_emails
+            llm_rate_limits: Requests per second by provider for aprocess_emails (see
+                llm_async.provider_of); unlisted providers are not rate limited
+            llm_cache: Cache of parsed-OK LLM responses, keyed by prompt, model and
+                template version (see llm_cache.py)
+            thread_extraction: Analyze multi-email threads with one LLM call over a compacted
+                transcript; per-email people and interactions come from the headers
+            model_id: Model the client calls, part of every llm_cache key; defaults to
+                llm_client.model
+        
+        Raises:
+            ValueError: If llm_cache is given for a client without a `model` attribute
+                and no model_id
         """
+        model_id = model_id or getattr(llm_client, 'model', None)
+        if llm_cache is not None and llm_client is not None and not model_id:
+            raise ValueError("llm_cache needs model_id when the LLM client has no 'model' attribute")
         self.llm_client = llm_client
-        self.email_filter = EmailFilter()
+        self.model_id = str(model_id) if model_id else None
+        self.email_filter = email_filter or EmailFilter()
+        self.combined_extraction = combined_extraction
+        self.max_concurrency = max_concurrency
+        self.llm_rate_limits = llm_rate_limits or {}
+        self.llm_cache = llm_cache
+        self.thread_extraction = thread_extraction
         self.prompt_templates = LLMPromptTemplates()
         
         # Cache for processed data to avoid duplicate processing
@@ -32,17 +75,74 @@ class EmailProcessor:
         self.companies_cache = {}
         self.expertise_cache = {}
     
-    def process_emails(self, emails: List[Dict], user_email: str) -> Dict[str, Any]:
+    def process_emails(self, emails: List[Dict], user_email: str,
+                       grouped_by_thread: bool = False) -> Dict[str, Any]:
         """
         Process a list of emails and extract relationships, expertise, and interactions
         
         Args:
             emails: List of email dictionaries
             user_email: Email address of the primary user
+            grouped_by_thread: True when emails already come grouped by thread and in date
+                order within each thread (thread exports), so the date sort is skipped
+            
+        Returns:
+            Dictionary containing processed data
+        """
+        processed_data, threaded_emails = self._start_processing(emails, user_email, grouped_by_thread)
+        
+        for thread_id, thread_emails in threaded_emails.items():
+            try:
+                thread_result = self._process_thread(thread_emails, user_email)
+                self._merge_thread_result(processed_data, thread_result)
+            except Exception as e:
+                logger.error(f"Error processing thread {thread_id}: {str(e)}")
+                continue
+        
+        return self._finish_processing(processed_data)
+    
+    async def aprocess_emails(self, emails: List[Dict], user_email: str,
+                              grouped_by_thread: bool = False) -> Dict[str, Any]:
+        """
+        process_emails with the LLM calls of independent threads and emails running concurrently
+        
+        At most max_concurrency requests are in flight, within llm_rate_limits. The result
+        is the same as process_emails would return (threads are merged in the same order).
+        
+        Args:
+            emails: List of email dictionaries
+            user_email: Email address of the primary user
+            grouped_by_thread: As for process_emails
             
         Returns:
             Dictionary containing processed data
         """
+        # Filtering and grouping are CPU-bound; keep them off the event loop
+        processed_data, threaded_emails = await asyncio.get_running_loop().run_in_executor(
+            None, self._start_processing, emails, user_email, grouped_by_thread
+        )
+        
+        llm = LLMExecutor(self.llm_client, self.max_concurrency, self.llm_rate_limits) if self.llm_client else None
+        try:
+            thread_results = await asyncio.gather(
+                *(self._aprocess_thread(thread_emails, user_email, llm) for thread_emails in threaded_emails.values()),
+                return_exceptions=True
+            )
+        finally:
+            if llm:
+                llm.close()
+        
+        for thread_id, thread_result in zip(threaded_emails, thread_results):
+            if isinstance(thread_result, Exception):
+                logger.error(f"Error processing thread {thread_id}: {str(thread_result)}")
+                continue
+            self._merge_thread_result(processed_data, thread_result)
+        
+        return self._finish_processing(processed_data)
+    
+    def _start_processing(self, emails: List[Dict], user_email: str,
+                          grouped_by_thread: bool) -> Tuple[Dict[str, Any], Dict[str, List[Dict]]]:
+        """Filter and group the emails; returns the empty processed data and the threads"""
         logger.info(f"Processing {len(emails)} emails for user {user_email}")
         
         # Step 1: Filter out newsletters and notifications
@@ -50,7 +150,7 @@ class EmailProcessor:
         logger.info(f"Filtered {len(filtered_emails)} emails, keeping {len(kept_emails)}")
         
         # Step 2: Group emails by thread for better context
-        threaded_emails = self._group_by_thread(kept_emails)
+        threaded_emails = self._group_by_thread(kept_emails, presorted=grouped_by_thread)
         
         # Step 3: Process each email/thread
         processed_data = {
@@ -68,25 +168,222 @@ class EmailProcessor:
                 'threads_processed': len(threaded_emails)
             }
         }
+        return processed_data, threaded_emails
+    
+    def _finish_processing(self, processed_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Post-process merged thread results"""
+        # Step 4: Post-process and clean up data
+        self._post_process_data(processed_data)
         
-        for thread_id, thread_emails in threaded_emails.items():
+        logger.info(f"Processing complete. Found {len(processed_data['people'])} people, "
+                   f"{len(processed_data['companies'])} companies, {len(processed_data['interactions'])} interactions")
+        
+        return processed_data
+    
+    def process_store(self, store: EmailStore, user_email: str,
+                      max_threads: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Process the most recently active threads of an EmailStore
+        
+        Args:
+            store: Open EmailStore to read from
+            user_email: Email address of the primary user
+            max_threads: Only read this many threads (None = all); other chunks stay compressed
+            
+        Returns:
+            Dictionary containing processed data
+        """
+        emails = [email for thread in store.iter_threads(max_threads) for email in thread]
+        return self.process_emails(emails, user_email, grouped_by_thread=True)
+    
+    def iter_process_store(self, store: EmailStore, user_email: str,
+                           max_threads: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """process_store as a stream of per-thread results (see iter_process_emails)"""
+        emails = (email for thread in store.iter_threads(max_threads) for email in thread)
+        return self.iter_process_emails(emails, user_email, grouped_by_thread=True)
+    
+    def iter_process_emails(self, emails: Iterable[Dict], user_email: str, grouped_by_thread: bool = False,
+                            batch_size: int = STREAM_BATCH_SIZE, max_open_threads: Optional[int] = MAX_OPEN_THREADS,
+                            stats: Optional[Dict[str, int]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming process_emails: yields one result per thread as soon as it is processed
+        
+        Each result has the shape of process_emails' output for that thread alone (plus
+        thread_id, thread_complete, participant_roles and thread_summary), so it can be
+        stored right away; filtered emails come in separate results (thread_id None)
+        without their bodies.
+        Memory holds one filter batch and the open threads, not the whole mailbox.
+        
+        Args:
+            emails: Iterable of email dictionaries (e.g. email_io.iter_emails(path))
+            user_email: Email address of the primary user
+            grouped_by_thread: True when emails come grouped by thread and in date order
+                within each thread (thread exports, EmailStore.iter_threads): a thread is
+                complete when the next one starts
+            batch_size: Emails filtered per filter_batch call
+            max_open_threads: Ungrouped input only: when more threads are open, the least
+                recently started one is processed early and its result (and those of later
+                parts of it) has thread_complete False; None = no limit, every thread is held
+                until the input ends (for input that is already in memory)
+            stats: Dict that receives running total/kept/filtered email and thread counts
+            
+        Yields:
+            Per-thread (or per filtered batch) processed data dictionaries
+        """
+        for thread_id, thread_emails, complete in self._stream_threads(emails, grouped_by_thread, batch_size,
+                                                                       max_open_threads, stats):
+            if thread_id is None:
+                yield self._stream_result(user_email, None, filtered_emails=thread_emails)
+                continue
             try:
                 thread_result = self._process_thread(thread_emails, user_email)
-                self._merge_thread_result(processed_data, thread_result)
             except Exception as e:
                 logger.error(f"Error processing thread {thread_id}: {str(e)}")
                 continue
+            yield self._stream_result(user_email, thread_id, thread_result, complete=complete)
+    
+    async def aiter_process_emails(self, emails: Iterable[Dict], user_email: str, grouped_by_thread: bool = False,
+                                   batch_size: int = STREAM_BATCH_SIZE, max_open_threads: Optional[int] = MAX_OPEN_THREADS,
+                                   stats: Optional[Dict[str, int]] = None,
+                                   window: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        iter_process_emails with the LLM calls of up to `window` threads running concurrently
+        (default 2 x max_concurrency); results come in the same order as iter_process_emails
+        """
+        llm = LLMExecutor(self.llm_client, self.max_concurrency, self.llm_rate_limits) if self.llm_client else None
+        window = window or 2 * self.max_concurrency
+        pending = deque()
+        threads = self._stream_threads(emails, grouped_by_thread, batch_size, max_open_threads, stats)
+        loop = asyncio.get_running_loop()
+        reading = None
+        try:
+            while True:
+                # Reading the input and filtering the next batch are blocking; keep them off the event loop
+                reading = loop.run_in_executor(None, next, threads, None)
+                item = await reading
+                if item is None:
+                    break
+                thread_id, thread_emails, complete = item
+                if thread_id is None:
+                    pending.append((None, thread_emails, True))
+                else:
+                    task = asyncio.ensure_future(self._aprocess_thread(thread_emails, user_email, llm))
+                    pending.append((thread_id, task, complete))
+                while len(pending) > window:
+                    result = await self._next_stream_result(pending, user_email)
+                    if result is not None:
+                        yield result
+            while pending:
+                result = await self._next_stream_result(pending, user_email)
+                if result is not None:
+                    yield result
+        finally:
+            for _, item, _ in pending:
+                if isinstance(item, asyncio.Future):
+                    item.cancel()
+            # Release the input reader now rather than at garbage collection; if a cancelled
+            # read is still running on its worker thread, close once it returns
+            if reading is not None and not reading.done():
+                reading.add_done_callback(lambda _: threads.close())
+            else:
+                threads.close()
+            if llm:
+                llm.close()
+    
+    async def _next_stream_result(self, pending: deque, user_email: str) -> Optional[Dict[str, Any]]:
+        """Result of the oldest pending thread or filtered batch (None when the thread failed)"""
+        thread_id, item, complete = pending.popleft()
+        if thread_id is None:
+            return self._stream_result(user_email, None, filtered_emails=item)
+        try:
+            return self._stream_result(user_email, thread_id, await item, complete=complete)
+        except Exception as e:
+            logger.error(f"Error processing thread {thread_id}: {str(e)}")
+            return None
+    
+    def _stream_threads(self, emails: Iterable[Dict], grouped_by_thread: bool, batch_size: int,
+                        max_open_threads: Optional[int],
+                        stats: Optional[Dict[str, int]]) -> Iterator[Tuple[Optional[str], List[Dict], bool]]:
+        """
+        Filter emails batch by batch; yield (thread ID, kept emails in date order, complete) as
+        threads complete and (None, filtered email records, True) once per batch with filtered
+        emails. complete is False for the parts of a thread that hit max_open_threads.
+        """
+        if stats is None:
+            stats = {}
+        for key in ('total_emails', 'kept_emails', 'filtered_emails', 'threads_processed', 'partial_threads'):
+            stats.setdefault(key, 0)
         
-        # Step 4: Post-process and clean up data
-        self._post_process_data(processed_data)
+        def complete(thread_id, thread_emails):
+            stats['threads_processed'] += 1
+            if not grouped_by_thread:
+                thread_emails.sort(key=lambda x: self._parse_date(x.get('Date', '')))
+            if thread_id in split_threads:
+                stats['partial_threads'] += 1
+                return thread_id, thread_emails, False
+            return thread_id, thread_emails, True
         
-        logger.info(f"Processing complete. Found {len(processed_data['people'])} people, "
-                   f"{len(processed_data['companies'])} companies, {len(processed_data['interactions'])} interactions")
+        # Threads closed early because of max_open_threads: later emails of them are partial too
+        split_threads = set()
+        open_threads = OrderedDict()
+        emails = iter(emails)
+        try:
+            while True:
+                batch = list(islice(emails, max(1, batch_size)))
+                if not batch:
+                    break
+                kept_emails, filtered_emails = self.email_filter.filter_emails(batch)
+                stats['total_emails'] += len(kept_emails) + len(filtered_emails)
+                stats['kept_emails'] += len(kept_emails)
+                stats['filtered_emails'] += len(filtered_emails)
+                if filtered_emails:
+                    yield None, [{key: email[key] for key in FILTERED_FIELDS if key in email} for email in filtered_emails], True
+                
+                for email in kept_emails:
+                    thread_id = email.get('threadId', email.get('id'))
+                    if grouped_by_thread and open_threads and thread_id not in open_threads:
+                        # Grouped input: the previous thread is complete
+                        yield complete(*open_threads.popitem())
+                    open_threads.setdefault(thread_id, []).append(email)
+                    if max_open_threads is not None and len(open_threads) > max(1, max_open_threads):
+                        oldest_id, oldest_emails = open_threads.popitem(last=False)
+                        split_threads.add(oldest_id)
+                        logger.warning(f"Thread {oldest_id} closed early: more than {max_open_threads} threads open")
+                        yield complete(oldest_id, oldest_emails)
+        finally:
+            # A consumer that stops early closes this generator; pass that on to the reader
+            # (NDJSON/gzip file, store cursor) instead of leaving it open
+            if hasattr(emails, 'close'):
+                emails.close()
         
+        while open_threads:
+            yield complete(*open_threads.popitem(last=False))
+    
+    def _stream_result(self, user_email: str, thread_id: Optional[str], thread_result: Optional[Dict] = None,
+                       filtered_emails: Optional[List[Dict]] = None, complete: bool = True) -> Dict[str, Any]:
+        """processed_data of one thread (or one batch of filtered emails)"""
+        processed_data = {
+            'user_email': user_email,
+            'thread_id': thread_id,
+            'thread_complete': complete,
+            'processed_emails': [],
+            'people': {},
+            'companies': {},
+            'interactions': [],
+            'expertise_instances': [],
+            'participant_roles': [],
+            'filtered_emails': filtered_emails or []
+        }
+        if thread_result:
+            self._merge_thread_result(processed_data, thread_result)
+            processed_data['participant_roles'] = thread_result.get('participant_roles', [])
+            if 'thread_summary' in thread_result:
+                processed_data['thread_summary'] = thread_result['thread_summary']
+        self._post_process_data(processed_data)
         return processed_data
     
-    def _group_by_thread(self, emails: List[Dict]) -> Dict[str, List[Dict]]:
-        """Group emails by thread ID"""
+    def _group_by_thread(self, emails: List[Dict], presorted: bool = False) -> Dict[str, List[Dict]]:
+        """Group emails by thread ID (presorted: already in date order within each thread)"""
         threads = {}
         for email in emails:
             thread_id = email.get('threadId', email.get('id'))
@@ -94,6 +391,9 @@ class EmailProcessor:
                 threads[thread_id] = []
             threads[thread_id].append(email)
         
+        if presorted:
+            return threads
+        
         # Sort emails within each thread by date
         for thread_id in threads:
             threads[thread_id].sort(key=lambda x: self._parse_date(x.get('Date', '')))
@@ -104,6 +404,8 @@ class EmailProcessor:
         """Process a single email thread"""
         if len(thread_emails) == 1:
             return self._process_single_email(thread_emails[0], user_email)
+        elif self.thread_extraction and self.llm_client:
+            return self._process_thread_level(thread_emails, user_email)
         else:
             return self._process_multi_email_thread(thread_emails, user_email)
     
@@ -111,17 +413,21 @@ class EmailProcessor:
         """Process a single email"""
         email_id = email.get('id')
         
-        # Extract people and companies
-        people_result = self._extract_people_and_companies(email)
-        
-        # Generate interaction summary
-        interaction_result = self._extract_interaction_summary(email)
-        
-        # Identify expertise
-        expertise_result = self._identify_expertise(email, people_result['people'])
-        
-        # Analyze participant roles
-        roles_result = self._extract_participant_roles(email, people_result['people'])
+        if self.combined_extraction and self.llm_client:
+            # People, companies, summary, expertise and roles in one call
+            people_result, interaction_result, expertise_result, roles_result = self._extract_email_analysis(email)
+        else:
+            # Extract people and companies
+            people_result = self._extract_people_and_companies(email)
+            
+            # Generate interaction summary
+            interaction_result = self._extract_interaction_summary(email)
+            
+            # Identify expertise
+            expertise_result = self._identify_expertise(email, people_result['people'])
+            
+            # Analyze participant roles
+            roles_result = self._extract_participant_roles(email, people_result['people'])
         
         return {
             'emails_processed': [email_id],
@@ -145,28 +451,30 @@ class EmailProcessor:
         all_roles = []
         
         for email in thread_emails:
-            # Extract people and companies
-            people_result = self._extract_people_and_companies(email)
-            for person in people_result['people']:
-                email_key = person.get('email', person.get('name', ''))
-                if email_key and email_key not in all_people:
-                    all_people[email_key] = person
+            if self.combined_extraction and self.llm_client:
+                people_result, interaction_result, expertise_result, roles_result = \
+                    self._extract_email_analysis(email, list(all_people.values()))
+            else:
+                people_result = interaction_result = expertise_result = roles_result = None
             
-            for company in people_result['companies']:
-                company_key = company.get('domain', company.get('name', ''))
-                if company_key and company_key not in all_companies:
-                    all_companies[company_key] = company
+            # Extract people and companies
+            if people_result is None:
+                people_result = self._extract_people_and_companies(email)
+            self._add_people_and_companies(all_people, all_companies, people_result)
             
             # Generate individual interaction summary
-            interaction_result = self._extract_interaction_summary(email)
+            if interaction_result is None:
+                interaction_result = self._extract_interaction_summary(email)
             all_interactions.append(interaction_result)
             
             # Identify expertise
-            expertise_result = self._identify_expertise(email, list(all_people.values()))
+            if expertise_result is None:
+                expertise_result = self._identify_expertise(email, list(all_people.values()))
             all_expertise.extend(expertise_result['expertise_instances'])
             
             # Extract participant roles
-            roles_result = self._extract_participant_roles(email, list(all_people.values()))
+            if roles_result is None:
+                roles_result = self._extract_participant_roles(email, list(all_people.values()))
             all_roles.extend(roles_result['participant_roles'])
         
         return {
@@ -179,6 +487,173 @@ class EmailProcessor:
             'thread_summary': thread_summary
         }
     
+    def _process_thread_level(self, thread_emails: List[Dict], user_email: str) -> Dict[str, Any]:
+        """
+        Process a multi-email thread with one LLM call
+        
+        People, expertise, roles and the thread summary come from a single prompt over a
+        compacted transcript, so the cost grows with the (capped) transcript, not with
+        messages x accumulated people. Per-email work is header parsing.
+        """
+        header_people, header_companies = self._thread_participants(thread_emails)
+        prompt = self.prompt_templates.extract_thread_analysis(thread_emails, list(header_people.values()))
+        return self._parse_thread_analysis(thread_emails, header_people, header_companies, self._call_llm(prompt))
+    
+    def _thread_participants(self, thread_emails: List[Dict]) -> Tuple[Dict, Dict]:
+        """People and companies of a thread from the From/To/Cc/Bcc headers"""
+        people = {}
+        companies = {}
+        for email in thread_emails:
+            self._add_people_and_companies(people, companies, self._basic_people_company_extraction(email))
+        return people, companies
+    
+    def _parse_thread_analysis(self, thread_emails: List[Dict], header_people: Dict, header_companies: Dict,
+                               response: str) -> Dict[str, Any]:
+        """Thread result from a thread-level LLM response; header data fills the gaps"""
+        try:
+            result = json.loads(response)
+        except json.JSONDecodeError:
+            result = None
+        if not isinstance(result, dict) or 'error' in result:
+            logger.error(f"Failed to parse LLM response for thread analysis")
+            result = {'thread_summary': 'Failed to generate thread summary'}
+        
+        # LLM entries first (they carry roles and companies), then header-only participants
+        all_people = {}
+        all_companies = {}
+        self._add_people_and_companies(all_people, all_companies, {
+            'people': result.get('people') or [], 'companies': result.get('companies') or []
+        })
+        self._add_people_and_companies(all_people, all_companies, {
+            'people': list(header_people.values()), 'companies': list(header_companies.values())
+        })
+        
+        summaries = {
+            item['message']: item for item in result.get('message_summaries') or []
+            if isinstance(item, dict) and isinstance(item.get('message'), int)
+        }
+        interactions = []
+        for number, email in enumerate(thread_emails, 1):
+            interaction = self._basic_interaction_summary(email)
+            summary = summaries.get(number)
+            if summary:
+                interaction['interaction_summary'] = summary.get('summary') or interaction['interaction_summary']
+                interaction['interaction_type'] = summary.get('interaction_type') or interaction['interaction_type']
+            interactions.append(interaction)
+        
+        return {
+            'emails_processed': [email.get('id') for email in thread_emails],
+            'people': list(all_people.values()),
+            'companies': list(all_companies.values()),
+            'interactions': interactions,
+            'expertise_instances': result.get('expertise_instances') or [],
+            'participant_roles': result.get('participant_roles') or [],
+            'thread_summary': {key: result[key] for key in ('thread_summary', 'key_topics', 'action_items')
+                               if key in result}
+        }
+    
+    async def _aprocess_thread(self, thread_emails: List[Dict], user_email: str,
+                               llm: Optional[LLMExecutor]) -> Dict[str, Any]:
+        """_process_thread with concurrent LLM calls"""
+        if len(thread_emails) == 1:
+            return await self._aprocess_single_email(thread_emails[0], user_email, llm)
+        elif self.thread_extraction and llm:
+            header_people, header_companies = self._thread_participants(thread_emails)
+            prompt = self.prompt_templates.extract_thread_analysis(thread_emails, list(header_people.values()))
+            return self._parse_thread_analysis(thread_emails, header_people, header_companies,
+                                               await self._acall_llm(prompt, llm))
+        else:
+            return await self._aprocess_multi_email_thread(thread_emails, user_email, llm)
+    
+    async def _aprocess_single_email(self, email: Dict, user_email: str,
+                                     llm: Optional[LLMExecutor]) -> Dict[str, Any]:
+        """_process_single_email; expertise and roles wait only for the people"""
+        if self.combined_extraction and llm:
+            people_result, interaction_result, expertise_result, roles_result = \
+                await self._aextract_email_analysis(email, llm)
+        else:
+            people_result, interaction_result = await asyncio.gather(
+                self._aextract_people_and_companies(email, llm),
+                self._aextract_interaction_summary(email, llm)
+            )
+            expertise_result, roles_result = await asyncio.gather(
+                self._aidentify_expertise(email, people_result['people'], llm),
+                self._aextract_participant_roles(email, people_result['people'], llm)
+            )
+        
+        return {
+            'emails_processed': [email.get('id')],
+            'people': people_result['people'],
+            'companies': people_result['companies'],
+            'interactions': [interaction_result],
+            'expertise_instances': expertise_result['expertise_instances'],
+            'participant_roles': roles_result['participant_roles']
+        }
+    
+    async def _aprocess_multi_email_thread(self, thread_emails: List[Dict], user_email: str,
+                                           llm: Optional[LLMExecutor]) -> Dict[str, Any]:
+        """
+        _process_multi_email_thread with concurrent LLM calls
+        
+        The expertise and role prompts of each email name the people found up to that
+        email, exactly as in the sequential version, so they run once all people are known.
+        """
+        all_people = {}
+        all_companies = {}
+        
+        if self.combined_extraction and llm:
+            async def analyze_in_order():
+                # Each prompt names the people found earlier in the thread
+                analyses = []
+                for email in thread_emails:
+                    analysis = await self._aextract_email_analysis(email, llm, list(all_people.values()))
+                    self._add_people_and_companies(all_people, all_companies, analysis[0])
+                    analyses.append(analysis)
+                return analyses
+            
+            thread_summary, analyses = await asyncio.gather(
+                self._agenerate_thread_summary(thread_emails, llm), analyze_in_order()
+            )
+            _, interactions, expertise_results, roles_results = zip(*analyses)
+        else:
+            thread_summary, people_results, interactions = await asyncio.gather(
+                self._agenerate_thread_summary(thread_emails, llm),
+                asyncio.gather(*(self._aextract_people_and_companies(email, llm) for email in thread_emails)),
+                asyncio.gather(*(self._aextract_interaction_summary(email, llm) for email in thread_emails))
+            )
+            people_so_far = []
+            for people_result in people_results:
+                self._add_people_and_companies(all_people, all_companies, people_result)
+                people_so_far.append(list(all_people.values()))
+            expertise_results, roles_results = await asyncio.gather(
+                asyncio.gather(*(self._aidentify_expertise(email, people, llm)
+                                 for email, people in zip(thread_emails, people_so_far))),
+                asyncio.gather(*(self._aextract_participant_roles(email, people, llm)
+                                 for email, people in zip(thread_emails, people_so_far)))
+            )
+        
+        return {
+            'emails_processed': [email.get('id') for email in thread_emails],
+            'people': list(all_people.values()),
+            'companies': list(all_companies.values()),
+            'interactions': list(interactions),
+            'expertise_instances': [item for result in expertise_results for item in result['expertise_instances']],
+            'participant_roles': [item for result in roles_results for item in result['participant_roles']],
+            'thread_summary': thread_summary
+        }
+    
+    def _add_people_and_companies(self, all_people: Dict, all_companies: Dict, people_result: Dict):
+        """Add a people/companies result to a thread's people and companies, first mention wins"""
+        for person in people_result['people']:
+            email_key = person.get('email', person.get('name', ''))
+            if email_key and email_key not in all_people:
+                all_people[email_key] = person
+        
+        for company in people_result['companies']:
+            company_key = company.get('domain', company.get('name', ''))
+            if company_key and company_key not in all_companies:
+                all_companies[company_key] = company
+    
     def _extract_people_and_companies(self, email: Dict) -> Dict:
         """Extract people and companies from an email"""
         if not self.llm_client:
@@ -186,8 +661,9 @@ class EmailProcessor:
             return self._basic_people_company_extraction(email)
         
         prompt = self.prompt_templates.extract_people_and_companies(email)
-        response = self._call_llm(prompt)
-        
+        return self._parse_people_and_companies(email, self._call_llm(prompt))
+    
+    def _parse_people_and_companies(self, email: Dict, response: str) -> Dict:
         try:
             return json.loads(response)
         except json.JSONDecodeError:
@@ -200,27 +676,32 @@ class EmailProcessor:
             return self._basic_interaction_summary(email)
         
         prompt = self.prompt_templates.extract_interaction_summary(email)
-        response = self._call_llm(prompt)
-        
+        return self._parse_interaction_summary(email, self._call_llm(prompt))
+    
+    def _parse_interaction_summary(self, email: Dict, response: str) -> Dict:
         try:
-            result = json.loads(response)
-            result['email_id'] = email.get('id')
-            result['thread_id'] = email.get('threadId')
-            result['subject'] = email.get('Subject', '')
-            result['interaction_date'] = self._parse_date(email.get('Date', '')).date().isoformat()
-            return result
+            return self._annotate_interaction(json.loads(response), email)
         except json.JSONDecodeError:
             logger.error(f"Failed to parse LLM response for interaction summary")
             return self._basic_interaction_summary(email)
     
+    def _annotate_interaction(self, result: Dict, email: Dict) -> Dict:
+        """Add the email's IDs, subject and date to an LLM interaction summary"""
+        result['email_id'] = email.get('id')
+        result['thread_id'] = email.get('threadId')
+        result['subject'] = email.get('Subject', '')
+        result['interaction_date'] = self._parse_date(email.get('Date', '')).date().isoformat()
+        return result
+    
     def _identify_expertise(self, email: Dict, people: List[Dict]) -> Dict:
         """Identify expertise demonstrated in the email"""
         if not self.llm_client or not people:
             return {'expertise_instances': []}
         
         prompt = self.prompt_templates.identify_expertise(email, people)
-        response = self._call_llm(prompt)
-        
+        return self._parse_expertise(self._call_llm(prompt))
+    
+    def _parse_expertise(self, response: str) -> Dict:
         try:
             return json.loads(response)
         except json.JSONDecodeError:
@@ -233,22 +714,62 @@ class EmailProcessor:
             return {'participant_roles': []}
         
         prompt = self.prompt_templates.extract_interaction_participants(email, people)
-        response = self._call_llm(prompt)
-        
+        return self._parse_participant_roles(self._call_llm(prompt))
+    
+    def _parse_participant_roles(self, response: str) -> Dict:
         try:
             return json.loads(response)
         except json.JSONDecodeError:
             logger.error(f"Failed to parse LLM response for participant roles")
             return {'participant_roles': []}
     
+    def _extract_email_analysis(self, email: Dict,
+                                known_people: Optional[List[Dict]] = None) -> Tuple[Dict, Dict, Dict, Dict]:
+        """
+        People/companies, interaction summary, expertise and participant roles from one LLM call
+        
+        Args:
+            email: Email dictionary
+            known_people: People already identified earlier in the thread
+            
+        Returns:
+            Tuple of results shaped like those of _extract_people_and_companies,
+            _extract_interaction_summary, _identify_expertise and _extract_participant_roles
+        """
+        prompt = self.prompt_templates.extract_email_analysis(email, known_people)
+        return self._parse_email_analysis(email, self._call_llm(prompt))
+    
+    def _parse_email_analysis(self, email: Dict, response: str) -> Tuple[Dict, Dict, Dict, Dict]:
+        try:
+            result = json.loads(response)
+        except json.JSONDecodeError:
+            result = None
+        if not isinstance(result, dict) or 'error' in result:
+            logger.error(f"Failed to parse LLM response for combined email analysis")
+            return (self._basic_people_company_extraction(email), self._basic_interaction_summary(email),
+                    {'expertise_instances': []}, {'participant_roles': []})
+        
+        interaction = result.get('interaction')
+        if isinstance(interaction, dict):
+            interaction = self._annotate_interaction(interaction, email)
+        else:
+            interaction = self._basic_interaction_summary(email)
+        return (
+            {'people': result.get('people') or [], 'companies': result.get('companies') or []},
+            interaction,
+            {'expertise_instances': result.get('expertise_instances') or []},
+            {'participant_roles': result.get('participant_roles') or []}
+        )
+    
     def _generate_thread_summary(self, thread_emails: List[Dict]) -> Dict:
         """Generate thread summary"""
         if not self.llm_client:
             return {'thread_summary': 'Thread summary not available without LLM'}
         
         prompt = self.prompt_templates.generate_thread_summary(thread_emails)
-        response = self._call_llm(prompt)
-        
+        return self._parse_thread_summary(self._call_llm(prompt))
+    
+    def _parse_thread_summary(self, response: str) -> Dict:
         try:
             return json.loads(response)
         except json.JSONDecodeError:
@@ -345,14 +866,94 @@ class EmailProcessor:
         if not self.llm_client:
             return '{"error": "No LLM client configured"}'
         
+        key = self._cache_key(prompt)
+        if key:
+            cached = self.llm_cache.get(key)
+            if cached is not None:
+                return cached
+        
         # This should be implemented based on the specific LLM service being used
         # For example, OpenAI, Anthropic, or local LLM
         try:
             response = self.llm_client.generate(prompt)
-            return response
         except Exception as e:
             logger.error(f"LLM API call failed: {str(e)}")
             return '{"error": "LLM API call failed"}'
+        self._cache_response(key, response)
+        return response
+    
+    async def _acall_llm(self, prompt: str, llm: LLMExecutor) -> str:
+        """_call_llm through an LLMExecutor"""
+        key = self._cache_key(prompt)
+        # The SQLite tier blocks; keep its reads and writes off the event loop
+        loop = asyncio.get_running_loop() if key and self.llm_cache.path is not None else None
+        if key:
+            cached = await loop.run_in_executor(None, self.llm_cache.get, key) if loop else self.llm_cache.get(key)
+            if cached is not None:
+                return cached
+        
+        try:
+            response = await llm.generate(prompt)
+        except Exception as e:
+            logger.error(f"LLM API call failed: {str(e)}")
+            return '{"error": "LLM API call failed"}'
+        if loop:
+            await loop.run_in_executor(None, self._cache_response, key, response)
+        else:
+            self._cache_response(key, response)
+        return response
+    
+    def _cache_key(self, prompt: str) -> Optional[str]:
+        """LLM cache key of a prompt for the configured model (None without a cache)"""
+        if self.llm_cache is None:
+            return None
+        return cache_key(prompt, self.model_id, self.prompt_templates.VERSION)
+    
+    def _cache_response(self, key: Optional[str], response: str):
+        """Cache a response that parses as a JSON object and is not an error"""
+        if not key:
+            return
+        try:
+            parsed = json.loads(response)
+        except (TypeError, ValueError):
+            return
+        if isinstance(parsed, dict) and 'error' not in parsed:
+            self.llm_cache.put(key, response)
+    
+    async def _aextract_people_and_companies(self, email: Dict, llm: Optional[LLMExecutor]) -> Dict:
+        if not llm:
+            return self._basic_people_company_extraction(email)
+        prompt = self.prompt_templates.extract_people_and_companies(email)
+        return self._parse_people_and_companies(email, await self._acall_llm(prompt, llm))
+    
+    async def _aextract_interaction_summary(self, email: Dict, llm: Optional[LLMExecutor]) -> Dict:
+        if not llm:
+            return self._basic_interaction_summary(email)
+        prompt = self.prompt_templates.extract_interaction_summary(email)
+        return self._parse_interaction_summary(email, await self._acall_llm(prompt, llm))
+    
+    async def _aidentify_expertise(self, email: Dict, people: List[Dict], llm: Optional[LLMExecutor]) -> Dict:
+        if not llm or not people:
+            return {'expertise_instances': []}
+        prompt = self.prompt_templates.identify_expertise(email, people)
+        return self._parse_expertise(await self._acall_llm(prompt, llm))
+    
+    async def _aextract_participant_roles(self, email: Dict, people: List[Dict], llm: Optional[LLMExecutor]) -> Dict:
+        if not llm or not people:
+            return {'participant_roles': []}
+        prompt = self.prompt_templates.extract_interaction_participants(email, people)
+        return self._parse_participant_roles(await self._acall_llm(prompt, llm))
+    
+    async def _aextract_email_analysis(self, email: Dict, llm: LLMExecutor,
+                                       known_people: Optional[List[Dict]] = None) -> Tuple[Dict, Dict, Dict, Dict]:
+        prompt = self.prompt_templates.extract_email_analysis(email, known_people)
+        return self._parse_email_analysis(email, await self._acall_llm(prompt, llm))
+    
+    async def _agenerate_thread_summary(self, thread_emails: List[Dict], llm: Optional[LLMExecutor]) -> Dict:
+        if not llm:
+            return {'thread_summary': 'Thread summary not available without LLM'}
+        prompt = self.prompt_templates.generate_thread_summary(thread_emails)
+        return self._parse_thread_summary(await self._acall_llm(prompt, llm))
     
     def _merge_thread_result(self, processed_data: Dict, thread_result: Dict):
         """Merge thread processing results into main processed data"""
@@ -421,13 +1022,15 @@ if __name__ == "__main__":
     # This would be used with an actual LLM client
     processor = EmailProcessor(llm_client=None)
     
-    # Load sample emails
-    with open('last_1000_emails_full.json', 'r') as f:
-        emails = json.load(f)
-    
-    # Process first 10 emails as example
-    sample_emails = emails[:10]
-    result = processor.process_emails(sample_emails, 'joseph@growthandcompany.com')
+    source = sys.argv[1] if len(sys.argv) > 1 else 'last_1000_emails_full.json'
+    if is_store(source):
+        # Read only the 10 most recent threads from the store's index
+        with EmailStore(source) as store:
+            result = processor.process_store(store, 'joseph@growthandcompany.com', max_threads=10)
+    else:
+        # Load the first 10 sample emails (NDJSON exports are read lazily, line by line)
+        sample_emails = list(islice(iter_emails(source), 10))
+        result = processor.process_emails(sample_emails, 'joseph@growthandcompany.com')
     
     print(f"Processed {len(result['processed_emails'])} emails")
     print(f"Found {len(result['people'])} people and {len(result['companies'])} companies")
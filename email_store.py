@@ -0,0 +1,284 @@
+"""
+Chunked, compressed on-disk email store with a message/thread/date index.
+
+A store is a directory (by convention named *.store) holding:
+- emails.dat     records as NDJSON, compressed in chunks; each chunk is one gzip member
+- index.sqlite   chunk offsets, plus message ID -> (thread ID, internalDate, chunk, line)
+While compact() runs, the rewritten data goes to emails.dat.compact; opening a store
+after a crash finishes or discards an interrupted compaction.
+
+Reading one message, one thread or one date range decompresses only the chunks that
+hold those records. Writing a record whose ID is already stored replaces it (the old
+copy stays in emails.dat until compact()). Exporters write to a store when their
+output path ends in .store, and email_io.iter_emails reads one like any export file.
+"""
+
+import gzip
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+STORE_SUFFIX = '.store'
+DATA_FILE = 'emails.dat'
+COMPACT_FILE = DATA_FILE + '.compact'
+INDEX_FILE = 'index.sqlite'
+DEFAULT_CHUNK_RECORDS = 256
+CHUNK_CACHE_SIZE = 8
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS chunks (
+    chunk INTEGER PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    records INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS emails (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT,
+    internal_date INTEGER NOT NULL,
+    chunk INTEGER NOT NULL,
+    line INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_emails_thread ON emails(thread_id, internal_date);
+CREATE INDEX IF NOT EXISTS idx_emails_date ON emails(internal_date);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+def is_store(path: Union[str, Path]) -> bool:
+    """True for *.store paths"""
+    return str(path).lower().rstrip('/\\').endswith(STORE_SUFFIX)
+
+
+def _to_millis(value: Union[int, float, str, datetime, None]) -> Optional[int]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    return int(value)
+
+
+class EmailStore:
+    """Append-only chunked email store; also usable as a streaming export writer"""
+
+    def __init__(self, path: Union[str, Path], chunk_records: int = DEFAULT_CHUNK_RECORDS):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.chunk_records = max(1, int(chunk_records))
+        self.count = 0
+        self._db = sqlite3.connect(str(self.path / INDEX_FILE))
+        self._db.executescript(SCHEMA)
+        self._data_path = self.path / DATA_FILE
+        self._compact_path = self.path / COMPACT_FILE
+        # Before _repair: mid-compaction, the index may describe the file not yet moved into place
+        self._finish_compaction()
+        self._repair()
+        self._data = open(self._data_path, 'ab')
+        self._pending = []
+        self._cache = OrderedDict()
+
+    def _repair(self):
+        """Cut data written after the last indexed chunk (a crash between write and commit)"""
+        end = self._db.execute('SELECT COALESCE(MAX(offset + length), 0) FROM chunks').fetchone()[0]
+        if self._data_path.exists() and self._data_path.stat().st_size > end:
+            with open(self._data_path, 'rb+') as f:
+                f.truncate(end)
+
+    # Writing
+
+    def write(self, record: Dict):
+        self._pending.append(record)
+        self.count += 1
+        if len(self._pending) >= self.chunk_records:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        if not self._pending:
+            return
+        lines = ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in self._pending)
+        data = gzip.compress(lines.encode('utf-8'))
+        offset = self._data.seek(0, os.SEEK_END)
+        self._data.write(data)
+        self._data.flush()
+        os.fsync(self._data.fileno())
+        # The index only points at chunks that are fully on disk
+        with self._db:
+            cursor = self._db.execute(
+                'INSERT INTO chunks (offset, length, records) VALUES (?, ?, ?)',
+                (offset, len(data), len(self._pending))
+            )
+            chunk = cursor.lastrowid
+            self._db.executemany(
+                'INSERT OR REPLACE INTO emails (id, thread_id, internal_date, chunk, line) VALUES (?, ?, ?, ?, ?)',
+                [
+                    (r.get('id'), r.get('threadId'), int(r.get('internalDate') or 0), chunk, line)
+                    for line, r in enumerate(self._pending)
+                ]
+            )
+        self._pending = []
+
+    def flush(self):
+        """Write buffered records as a (possibly short) chunk"""
+        self._write_chunk()
+
+    def delete(self, ids: Iterable[str]) -> int:
+        """Drop records from the index; returns how many were stored"""
+        self.flush()
+        with self._db:
+            cursor = self._db.executemany('DELETE FROM emails WHERE id = ?', [(i,) for i in ids])
+        return cursor.rowcount
+
+    def close(self):
+        if self._data.closed:
+            return
+        self.flush()
+        self._data.close()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # Reading
+
+    def __len__(self) -> int:
+        self.flush()
+        return self._db.execute('SELECT COUNT(*) FROM emails').fetchone()[0]
+
+    def __contains__(self, msg_id: str) -> bool:
+        self.flush()
+        return self._db.execute('SELECT 1 FROM emails WHERE id = ?', (msg_id,)).fetchone() is not None
+
+    def _chunk_lines(self, chunk: int) -> List[str]:
+        lines = self._cache.get(chunk)
+        if lines is not None:
+            self._cache.move_to_end(chunk)
+            return lines
+        offset, length = self._db.execute(
+            'SELECT offset, length FROM chunks WHERE chunk = ?', (chunk,)
+        ).fetchone()
+        with open(self._data_path, 'rb') as f:
+            f.seek(offset)
+            # split('\n'), not splitlines(): records are written with ensure_ascii=False, so
+            # U+2028/U+2029/U+0085 can appear unescaped inside a line
+            lines = gzip.decompress(f.read(length)).decode('utf-8').split('\n')[:-1]
+        self._cache[chunk] = lines
+        if len(self._cache) > CHUNK_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return lines
+
+    def _read(self, rows: Iterable) -> Iterator[Dict]:
+        for chunk, line in rows:
+            yield json.loads(self._chunk_lines(chunk)[line])
+
+    def _query(self, sql: str, params=()) -> Iterator[Dict]:
+        self.flush()
+        # Materialize the (chunk, line) pairs so the cursor is not held while yielding
+        rows = self._db.execute(sql, params).fetchall()
+        return self._read(rows)
+
+    def get(self, msg_id: str) -> Optional[Dict]:
+        """One record by message ID, or None"""
+        return next(self._query('SELECT chunk, line FROM emails WHERE id = ?', (msg_id,)), None)
+
+    def iter_thread(self, thread_id: str) -> Iterator[Dict]:
+        """Records of one thread, oldest first"""
+        return self._query(
+            'SELECT chunk, line FROM emails WHERE thread_id = ? ORDER BY internal_date, id', (thread_id,)
+        )
+
+    def iter_range(self, start=None, end=None, newest_first: bool = True) -> Iterator[Dict]:
+        """
+        Records with start <= internalDate < end.
+
+        Args:
+            start: Lower bound as epoch milliseconds or a datetime (None = no bound)
+            end: Upper bound as epoch milliseconds or a datetime (None = no bound)
+            newest_first: Sort order by internalDate
+        """
+        start, end = _to_millis(start), _to_millis(end)
+        clauses, params = [], []
+        if start is not None:
+            clauses.append('internal_date >= ?')
+            params.append(start)
+        if end is not None:
+            clauses.append('internal_date < ?')
+            params.append(end)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        order = 'DESC' if newest_first else 'ASC'
+        return self._query(f'SELECT chunk, line FROM emails {where} ORDER BY internal_date {order}, id', params)
+
+    def iter_emails(self) -> Iterator[Dict]:
+        """All records, newest first (the order of the exports)"""
+        return self.iter_range()
+
+    def thread_ids(self, limit: Optional[int] = None) -> List[str]:
+        """Thread IDs, most recently active first"""
+        self.flush()
+        sql = 'SELECT thread_id FROM emails GROUP BY thread_id ORDER BY MAX(internal_date) DESC'
+        if limit:
+            sql += f' LIMIT {int(limit)}'
+        return [row[0] for row in self._db.execute(sql)]
+
+    def iter_threads(self, limit: Optional[int] = None) -> Iterator[List[Dict]]:
+        """Each thread as a list of records (oldest first), most recently active thread first"""
+        for thread_id in self.thread_ids(limit):
+            yield list(self.iter_thread(thread_id))
+
+    def compact(self):
+        """
+        Rewrite emails.dat with only the live records, dropping replaced and deleted copies.
+        The new file is written next to the old one and the index switches over in one
+        transaction that also marks the compaction as pending; the file is moved into
+        place after that commit, so an interruption at any point leaves a store that
+        _finish_compaction can complete or roll back.
+        """
+        self.flush()
+        rows = self._db.execute('SELECT id, chunk, line FROM emails ORDER BY internal_date DESC, id').fetchall()
+        chunks, index = [], []
+        try:
+            with open(self._compact_path, 'wb') as out:
+                for start in range(0, len(rows), self.chunk_records):
+                    batch = rows[start:start + self.chunk_records]
+                    lines = ''.join(self._chunk_lines(chunk)[line] + '\n' for _, chunk, line in batch)
+                    data = gzip.compress(lines.encode('utf-8'))
+                    chunk_no = len(chunks) + 1
+                    chunks.append((chunk_no, out.tell(), len(data), len(batch)))
+                    index.extend((chunk_no, line, msg_id) for line, (msg_id, _, _) in enumerate(batch))
+                    out.write(data)
+                out.flush()
+                os.fsync(out.fileno())
+            self._data.close()
+            self._cache.clear()
+            with self._db:
+                self._db.execute('DELETE FROM chunks')
+                self._db.executemany('INSERT INTO chunks (chunk, offset, length, records) VALUES (?, ?, ?, ?)', chunks)
+                self._db.executemany('UPDATE emails SET chunk = ?, line = ? WHERE id = ?', index)
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('compacting', '1')")
+        finally:
+            try:
+                self._finish_compaction()
+            finally:
+                if self._data.closed:
+                    self._data = open(self._data_path, 'ab')
+
+    def _finish_compaction(self):
+        """Complete a compaction whose index switch committed, or discard one that never got that far"""
+        pending = self._db.execute("SELECT 1 FROM meta WHERE key = 'compacting'").fetchone()
+        if pending:
+            if self._compact_path.exists():
+                self._compact_path.replace(self._data_path)
+            with self._db:
+                self._db.execute("DELETE FROM meta WHERE key = 'compacting'")
+        elif self._compact_path.exists():
+            # The index still describes the old file
+            self._compact_path.unlink()
@@ -0,0 +1,127 @@
+"""
+On-disk progress checkpoints for resumable exports.
+
+Next to the output file (e.g. last_1000_emails_full.json) a resumable export keeps:
+- last_1000_emails_full.json.ids.json       listed message IDs (+ mailbox historyId)
+- last_1000_emails_full.json.done           fetched message IDs, one per line, append-only
+- last_1000_emails_full.json.partial.ndjson fetched records, one per line, append-only
+
+A record is flushed to the spool before its ID goes into the done log, so after a
+crash every ID in the done log has its record on disk. A restart loads both and
+fetches only the missing IDs; the files are removed once the export is complete.
+"""
+
+import json
+import os
+from pathlib import Path
+
+from email_io import NDJSONWriter, iter_ndjson
+
+
+class ExportCheckpoint:
+    def __init__(self, output_file):
+        output_file = Path(output_file)
+        self.ids_path = output_file.with_name(output_file.name + ".ids.json")
+        self.done_path = output_file.with_name(output_file.name + ".done")
+        self.spool_path = output_file.with_name(output_file.name + ".partial.ndjson")
+        self._spool = None
+        self._done = None
+
+    def exists(self):
+        return self.ids_path.exists()
+
+    def start(self, ids, history_id=None):
+        """Persist the listed IDs for a fresh export and reset any old progress."""
+        for path in (self.done_path, self.spool_path):
+            if path.exists():
+                path.unlink()
+        tmp_path = self.ids_path.with_name(self.ids_path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"ids": list(ids), "historyId": history_id}, f)
+        tmp_path.replace(self.ids_path)
+
+    def load(self):
+        """Return (ids, done_ids, history_id) saved by an earlier run."""
+        with open(self.ids_path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        done = set()
+        if self.done_path.exists():
+            with open(self.done_path, "r", encoding="utf-8") as f:
+                done = {line.strip() for line in f if line.strip()}
+        return saved["ids"], done, saved.get("historyId")
+
+    def _repair_spool(self):
+        """Cut a half-written last line left by a crash, so appends start on a clean line."""
+        if not self.spool_path.exists():
+            return
+        with open(self.spool_path, "rb+") as f:
+            data_end = f.seek(0, os.SEEK_END)
+            pos = data_end
+            while pos > 0:
+                step = min(65536, pos)
+                f.seek(pos - step)
+                chunk = f.read(step)
+                newline = chunk.rfind(b"\n")
+                if newline != -1:
+                    pos = pos - step + newline + 1
+                    break
+                pos -= step
+            if pos != data_end:
+                f.truncate(pos)
+
+    def open(self):
+        """Open the spool and done log for appending."""
+        self._repair_spool()
+        self._spool = NDJSONWriter(self.spool_path, append=True)
+        self._done = open(self.done_path, "a", encoding="utf-8")
+        return self
+
+    def record(self, record):
+        """Persist one fetched record, then mark its ID as done."""
+        self._spool.write(record)
+        self._spool.flush()
+        self._done.write(f"{record['id']}\n")
+        self._done.flush()
+
+    def close(self):
+        if self._spool:
+            self._spool.close()
+            self._spool = None
+        if self._done:
+            self._done.close()
+            self._done = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def iter_records(self):
+        """
+        Yield spooled records once each (a record re-fetched after a crash wins), in the
+        order of the listed IDs. IDs that failed in an earlier run are spooled after the
+        rest on resume, so records are read back by offset rather than in spool order.
+        """
+        offsets = {}
+        with open(self.spool_path, "rb") as f:
+            offset = 0
+            for line in f:
+                for record in iter_ndjson([line]):
+                    offsets[record["id"]] = offset
+                offset += len(line)
+        with open(self.ids_path, "r", encoding="utf-8") as f:
+            ids = json.load(f)["ids"]
+        with open(self.spool_path, "rb") as f:
+            for msg_id in ids:
+                offset = offsets.get(msg_id)
+                if offset is not None:
+                    f.seek(offset)
+                    yield from iter_ndjson([f.readline()])
+
+    def clear(self):
+        """Remove all checkpoint files once the export has been written."""
+        self.close()
+        for path in (self.ids_path, self.done_path, self.spool_path):
+            if path.exists():
+                path.unlink()
@@ -0,0 +1,209 @@
+"""
+Export many mailboxes at once from the per-account token store (see token_store.py).
+
+Runs fetch_last_1000_full.run_export for each account, up to GMAIL_MAX_ACCOUNTS at a
+time, and writes exports/<account>.json (or GMAIL_EXPORT_SUFFIX, e.g. .ndjson.gz).
+The export mode flags of fetch_last_1000_full.py (GMAIL_INCREMENTAL, GMAIL_RESUMABLE,
+GMAIL_TWO_PHASE, GMAIL_BY_THREAD) apply to every account.
+
+Quota is shared fairly: the project budget (GMAIL_PROJECT_QUOTA_UNITS_PER_SEC) is split
+evenly between the accounts currently exporting and rebalanced whenever one starts or
+finishes, never exceeding the per-user limit (GMAIL_QUOTA_UNITS_PER_SEC). Across all
+accounts at most GMAIL_MAX_IN_FLIGHT HTTP requests run at once.
+
+A status line per account is printed every GMAIL_STATUS_INTERVAL seconds and the
+final report is saved to exports/status.json.
+
+  python export_scheduler.py                       # every stored account
+  python export_scheduler.py alice@example.com bob@example.com
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from googleapiclient.discovery import build
+
+import fetch_last_1000_full
+from gmail_fetch import BATCH_SIZE, DEFAULT_QUOTA_UNITS_PER_SECOND, DEFAULT_WORKERS, FetchEngine
+from token_store import TOKENS_DIR, account_key, list_accounts, load_credentials, token_path
+
+DEFAULT_MAX_ACCOUNTS = 4
+DEFAULT_MAX_IN_FLIGHT = 16
+DEFAULT_PROJECT_QUOTA_UNITS_PER_SECOND = 20000  # Gmail per-project limit (1,200,000 units per minute)
+DEFAULT_STATUS_INTERVAL = 30
+_output_dir = os.environ.get("GMAIL_EXPORT_DIR", "exports")
+OUTPUT_DIR = Path(_output_dir) if os.path.isabs(_output_dir) else Path(__file__).parent / _output_dir
+EXPORT_SUFFIX = os.environ.get("GMAIL_EXPORT_SUFFIX", ".json")
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class ExportScheduler:
+    """
+    Runs one export per account on a bounded pool and keeps a status dict per account:
+    {"account", "state" (queued/running/done/failed), "messages", "started", "finished",
+    "seconds", "quota_units_per_sec", "output", "error"}.
+    """
+
+    def __init__(self, accounts, output_dir=OUTPUT_DIR, tokens_dir=TOKENS_DIR,
+                 max_accounts=DEFAULT_MAX_ACCOUNTS, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 project_quota_units_per_second=DEFAULT_PROJECT_QUOTA_UNITS_PER_SECOND,
+                 user_quota_units_per_second=DEFAULT_QUOTA_UNITS_PER_SECOND,
+                 workers=DEFAULT_WORKERS, batch_size=BATCH_SIZE, n=fetch_last_1000_full.MAX_MESSAGES,
+                 service_factory=None, batch_uri=None):
+        self.accounts = [account_key(a) for a in accounts]
+        self.output_dir = Path(output_dir)
+        self.tokens_dir = Path(tokens_dir)
+        self.max_accounts = max(1, int(max_accounts))
+        self.project_quota = float(project_quota_units_per_second)
+        self.user_quota = float(user_quota_units_per_second)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.n = n
+        # service_factory(creds) -> Gmail service; replaceable to point at another endpoint
+        self.service_factory = service_factory or (lambda creds: build("gmail", "v1", credentials=creds))
+        self.batch_uri = batch_uri
+        self.slots = threading.BoundedSemaphore(max(1, int(max_in_flight)))
+        self.status = {
+            a: {"account": a, "state": "queued", "messages": 0, "started": None, "finished": None,
+                "seconds": None, "quota_units_per_sec": None, "output": None, "error": None}
+            for a in self.accounts
+        }
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, accounts):
+        """Build a scheduler with options taken from the GMAIL_* environment variables."""
+        return cls(
+            accounts,
+            max_accounts=int(os.environ.get("GMAIL_MAX_ACCOUNTS", DEFAULT_MAX_ACCOUNTS)),
+            max_in_flight=int(os.environ.get("GMAIL_MAX_IN_FLIGHT", DEFAULT_MAX_IN_FLIGHT)),
+            project_quota_units_per_second=float(
+                os.environ.get("GMAIL_PROJECT_QUOTA_UNITS_PER_SEC", DEFAULT_PROJECT_QUOTA_UNITS_PER_SECOND)
+            ),
+            user_quota_units_per_second=float(
+                os.environ.get("GMAIL_QUOTA_UNITS_PER_SEC", DEFAULT_QUOTA_UNITS_PER_SECOND)
+            ),
+            workers=int(os.environ.get("GMAIL_FETCH_WORKERS", DEFAULT_WORKERS)),
+            batch_size=int(os.environ.get("GMAIL_BATCH_SIZE", BATCH_SIZE)),
+        )
+
+    def fair_share(self, running):
+        """Quota units per second for each of `running` concurrent accounts."""
+        if self.project_quota <= 0:
+            return self.user_quota
+        share = self.project_quota / max(1, running)
+        return min(share, self.user_quota) if self.user_quota > 0 else share
+
+    def _rebalance(self):
+        # Caller holds self._lock
+        share = self.fair_share(len(self._engines))
+        for account, engine in self._engines.items():
+            engine.bucket.set_rate(share)
+            self.status[account]["quota_units_per_sec"] = share
+
+    def _export_account(self, account):
+        status = self.status[account]
+        output_file = self.output_dir / (account + EXPORT_SUFFIX)
+        start = time.monotonic()
+        status.update(state="running", started=_now(), output=str(output_file))
+        try:
+            creds = load_credentials(account, self.tokens_dir)
+            engine = FetchEngine(
+                lambda: self.service_factory(creds),
+                workers=self.workers,
+                quota_units_per_second=self.user_quota,
+                batch_size=self.batch_size,
+                slots=self.slots,
+                batch_uri=self.batch_uri,
+            )
+            with self._lock:
+                self._engines[account] = engine
+                self._rebalance()
+            count = fetch_last_1000_full.run_export(
+                self.service_factory(creds),
+                engine,
+                token_path(account, self.tokens_dir),
+                output_file,
+                self.n,
+                status=status,
+            )
+            status.update(state="done", messages=count)
+        except Exception as e:
+            status.update(state="failed", error=f"{type(e).__name__}: {e}")
+            traceback.print_exc()
+        finally:
+            with self._lock:
+                self._engines.pop(account, None)
+                self._rebalance()
+            status.update(finished=_now(), seconds=round(time.monotonic() - start, 1))
+        return status
+
+    def run(self, status_interval=DEFAULT_STATUS_INTERVAL):
+        """Export every account; returns the list of status dicts."""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        done = threading.Event()
+        reporter = None
+        if status_interval:
+            def report_periodically():
+                while not done.wait(status_interval):
+                    self.print_report()
+            reporter = threading.Thread(target=report_periodically, daemon=True)
+            reporter.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_accounts) as pool:
+                list(pool.map(self._export_account, self.accounts))
+        finally:
+            done.set()
+            if reporter:
+                reporter.join()
+        self.save_report()
+        return self.report()
+
+    def report(self):
+        return [dict(self.status[a]) for a in self.accounts]
+
+    def print_report(self, file=None):
+        file = file or sys.stdout
+        print(f"\n{'account':<40} {'state':<8} {'messages':>8} {'seconds':>8} {'units/s':>8}", file=file)
+        for s in self.report():
+            seconds = s["seconds"] if s["seconds"] is not None else "-"
+            quota = f"{s['quota_units_per_sec']:.0f}" if s["quota_units_per_sec"] else "-"
+            print(f"{s['account']:<40} {s['state']:<8} {s['messages']:>8} {seconds:>8} {quota:>8}", file=file)
+            if s["error"]:
+                print(f"    {s['error']}", file=file)
+
+    def save_report(self):
+        path = self.output_dir / "status.json"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"updated": _now(), "accounts": self.report()}, f, indent=2)
+        return path
+
+
+def main():
+    accounts = sys.argv[1:] or list_accounts()
+    if not accounts:
+        raise SystemExit(f"No accounts to export: no tokens in {TOKENS_DIR} (sign in via oauth_server.py first)")
+    scheduler = ExportScheduler.from_env(accounts)
+    print(f"Exporting {len(accounts)} account(s), up to {scheduler.max_accounts} at a time...\n")
+    status_interval = float(os.environ.get("GMAIL_STATUS_INTERVAL", DEFAULT_STATUS_INTERVAL))
+    scheduler.run(status_interval)
+    scheduler.print_report()
+    failed = [s["account"] for s in scheduler.report() if s["state"] == "failed"]
+    print(f"\nDone: {len(accounts) - len(failed)} exported, {len(failed)} failed. Report: {scheduler.output_dir / 'status.json'}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
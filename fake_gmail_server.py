@@ -0,0 +1,427 @@
+"""
+Local stand-in for the Gmail REST endpoints the exporters use, for benchmarks and tests.
+Serves a synthetic mailbox (a mix of personal threads and newsletters) generated
+deterministically from a seed, with optional per-request latency and 429 injection.
+The mailbox history is scriptable: SyntheticMailbox.deliver/delete/trash/untrash change
+what the list endpoints return and append the matching history.list records.
+
+Endpoints (under /gmail/v1/users/me/):
+  profile, messages, messages/{id}, threads, threads/{id}, history
+and the batch endpoint /batch/gmail/v1 (multipart/mixed). GET /_stats returns request
+counters (HTTP requests, API calls, injected 429s).
+
+Run standalone:
+  python fake_gmail_server.py --messages 5000 --latency-ms 40 --error-rate 0.02
+
+Point googleapiclient at it with
+  build("gmail", "v1", credentials=Credentials(token="fake"),
+        client_options={"api_endpoint": "http://127.0.0.1:8765/"})
+and FetchEngine(..., batch_uri="http://127.0.0.1:8765/batch/gmail/v1").
+"""
+
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_PORT = 8765
+LIST_MAX_RESULTS = 500  # Same cap as the real messages.list / threads.list
+BASE_HISTORY_ID = 1000
+BASE_TIME_MS = 1767225600000  # 2026-01-01T00:00:00Z
+
+PEOPLE = ["alice", "bob", "carol", "dave", "erin", "frank", "grace", "heidi"]
+COMPANIES = ["acme.com", "globex.com", "initech.com", "umbrella.co.uk"]
+NEWSLETTER_SENDERS = ["news@mailchimp.com", "noreply@shop.example", "digest@medium.com"]
+SUBJECTS = ["Director role / Jan plan", "Q3 budget review", "Intro: growth lead",
+            "Contract draft", "Hiring pipeline", "Partnership next steps"]
+NEWSLETTER_SUBJECTS = ["Weekly digest", "50% off this weekend only", "Your March update"]
+
+
+class SyntheticMailbox:
+    """Deterministic synthetic mailbox; messages are rebuilt on demand, not stored."""
+
+    def __init__(self, size=1000, seed=42, body_kb=4, newsletter_ratio=0.6, history_floor=0, undelivered=0):
+        self.size = size
+        self.seed = seed
+        self.body_kb = body_kb
+        self.newsletter_ratio = newsletter_ratio
+        # history.list with a startHistoryId below this returns 404 (checkpoint too old)
+        self.history_floor = history_floor
+        # The newest `undelivered` messages only show up once deliver() is called
+        self.undelivered = undelivered
+        self.deleted = set()
+        self.trashed = set()
+        self.history = []
+        rng = random.Random(seed)
+        # Index 0 is the newest message. Consecutive indexes form a thread.
+        self.thread_of = []
+        self.threads = {}
+        i = 0
+        while i < size:
+            thread_len = min(size - i, rng.choice([1, 1, 1, 2, 3, 5]))
+            thread_id = self.message_id(i)
+            members = list(range(i, i + thread_len))
+            self.threads[thread_id] = members
+            self.thread_of.extend([thread_id] * thread_len)
+            i += thread_len
+        self.thread_ids = list(self.threads)
+        self.index_of_id = {self.message_id(i): i for i in range(size)}
+
+    @staticmethod
+    def message_id(index):
+        return f"{index + 0x18d0000000000000:016x}"
+
+    def history_id(self):
+        return str(BASE_HISTORY_ID + self.size + len(self.history))
+
+    def exists(self, index):
+        return index >= self.undelivered and index not in self.deleted
+
+    def listed(self, index):
+        """messages.list and threads.list leave out trashed messages, like Gmail does."""
+        return self.exists(index) and index not in self.trashed
+
+    def _add_history(self, **changes):
+        self.history.append(dict(changes, id=str(int(self.history_id()) + 1)))
+
+    def _history_message(self, index):
+        msg = self.message(index, "minimal")
+        return {"message": {k: msg[k] for k in ("id", "threadId", "labelIds")}}
+
+    def deliver(self, count=1):
+        """Deliver the next `count` undelivered messages (oldest first); returns their IDs."""
+        delivered = []
+        for _ in range(min(count, self.undelivered)):
+            self.undelivered -= 1
+            self._add_history(messagesAdded=[self._history_message(self.undelivered)])
+            delivered.append(self.message_id(self.undelivered))
+        return delivered
+
+    def delete(self, msg_id):
+        index = self.index_of_id[msg_id]
+        self.deleted.add(index)
+        self._add_history(messagesDeleted=[{"message": {"id": msg_id, "threadId": self.thread_of[index]}}])
+
+    def trash(self, msg_id):
+        index = self.index_of_id[msg_id]
+        self.trashed.add(index)
+        self._add_history(labelsAdded=[dict(self._history_message(index), labelIds=["TRASH"])])
+
+    def untrash(self, msg_id):
+        index = self.index_of_id[msg_id]
+        self.trashed.discard(index)
+        self._add_history(labelsRemoved=[dict(self._history_message(index), labelIds=["TRASH"])])
+
+    def _is_newsletter(self, rng):
+        return rng.random() < self.newsletter_ratio
+
+    def message(self, index, fmt="full", metadata_headers=None):
+        thread_id = self.thread_of[index]
+        rng = random.Random(f"{self.seed}:{thread_id}")
+        newsletter = self._is_newsletter(rng)
+        msg_rng = random.Random(f"{self.seed}:{index}")
+        if newsletter:
+            sender = rng.choice(NEWSLETTER_SENDERS)
+            subject = rng.choice(NEWSLETTER_SUBJECTS)
+            labels = ["INBOX", "UNREAD", "CATEGORY_PROMOTIONS"]
+            text = ("Here is what happened this week. " * 8 + "\n") * max(1, self.body_kb * 4)
+            text += "\nView in browser | Unsubscribe from these emails"
+            recipients = "me@growthandcompany.com"
+        else:
+            sender = f"{msg_rng.choice(PEOPLE)}@{msg_rng.choice(COMPANIES)}"
+            subject = rng.choice(SUBJECTS)
+            if index != self.threads[thread_id][-1]:
+                subject = "Re: " + subject
+            labels = ["INBOX", "IMPORTANT"]
+            text = ("Thanks for the update, let's discuss the plan on Thursday. " * 6 + "\n") * max(1, self.body_kb * 4)
+            recipients = ", ".join(
+                f"{p}@{msg_rng.choice(COMPANIES)}" for p in msg_rng.sample(PEOPLE, msg_rng.randint(1, 3))
+            )
+        if index in self.trashed:
+            labels = [label for label in labels if label != "INBOX"] + ["TRASH"]
+        internal_date = BASE_TIME_MS - index * 3600 * 1000
+        headers = [
+            {"name": "From", "value": sender},
+            {"name": "To", "value": recipients},
+            {"name": "Subject", "value": subject},
+            {"name": "Date", "value": formatdate(internal_date / 1000)},
+            {"name": "Message-ID", "value": f"<{self.message_id(index)}@fake.gmail>"},
+        ]
+        if newsletter:
+            headers.append({"name": "List-Unsubscribe", "value": f"<mailto:unsub@{sender.split('@')[1]}>"})
+            headers.append({"name": "Precedence", "value": "bulk"})
+        html = f"<html><body><p>{text}</p></body></html>"
+        msg = {
+            "id": self.message_id(index),
+            "threadId": thread_id,
+            "labelIds": labels,
+            "snippet": text[:100],
+            "historyId": str(BASE_HISTORY_ID + self.size - index),
+            "internalDate": str(internal_date),
+            "sizeEstimate": len(text) + len(html) + 500,
+        }
+        if fmt == "minimal":
+            return msg
+        if fmt == "metadata":
+            if metadata_headers:
+                wanted = {h.lower() for h in metadata_headers}
+                headers = [h for h in headers if h["name"].lower() in wanted]
+            msg["payload"] = {"mimeType": "multipart/alternative", "headers": headers}
+            return msg
+        msg["payload"] = {
+            "partId": "",
+            "mimeType": "multipart/alternative",
+            "filename": "",
+            "headers": headers,
+            "body": {"size": 0},
+            "parts": [
+                _text_part("0", "text/plain", text),
+                _text_part("1", "text/html", html),
+            ],
+        }
+        return msg
+
+    def thread(self, thread_id, fmt="full", metadata_headers=None):
+        # Gmail returns the messages of a thread oldest first
+        members = sorted((i for i in self.threads[thread_id] if self.exists(i)), reverse=True)
+        return {
+            "id": thread_id,
+            "historyId": self.history_id(),
+            "messages": [self.message(i, fmt, metadata_headers) for i in members],
+        }
+
+
+def _text_part(part_id, mime_type, text):
+    data = base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+    return {
+        "partId": part_id,
+        "mimeType": mime_type,
+        "filename": "",
+        "headers": [{"name": "Content-Type", "value": f"{mime_type}; charset=UTF-8"}],
+        "body": {"size": len(text), "data": data},
+    }
+
+
+def _page(items, query):
+    max_results = min(int(query.get("maxResults", ["100"])[0]), LIST_MAX_RESULTS)
+    start = int(query.get("pageToken", ["0"])[0] or 0)
+    page = items[start:start + max_results]
+    next_token = str(start + max_results) if start + max_results < len(items) else None
+    return page, next_token
+
+
+def _error(status, message):
+    return status, {"error": {"code": status, "message": message, "errors": [{"message": message}]}}
+
+
+class FakeGmail:
+    """Routes Gmail API paths to the synthetic mailbox."""
+
+    def __init__(self, mailbox, latency_ms=0.0, error_rate=0.0, seed=0):
+        self.mailbox = mailbox
+        self.latency = latency_ms / 1000.0
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"http_requests": 0, "api_calls": 0, "injected_429": 0}
+
+    def _inject_429(self):
+        with self._lock:
+            hit = self.error_rate and self._rng.random() < self.error_rate
+            if hit:
+                self.stats["injected_429"] += 1
+        return hit
+
+    def handle(self, method, path_with_query):
+        """Return (status, json_body) for one API call."""
+        with self._lock:
+            self.stats["api_calls"] += 1
+        if self._inject_429():
+            return _error(429, "Rate Limit Exceeded (injected)")
+        parsed = urlparse(path_with_query)
+        query = parse_qs(parsed.query)
+        parts = [p for p in parsed.path.split("/") if p]
+        # Expected: gmail v1 users {userId} <resource> [<id>]
+        if method != "GET" or parts[:3] != ["gmail", "v1", "users"] or len(parts) < 5:
+            return _error(404, f"Not found: {parsed.path}")
+        resource = parts[4]
+        item_id = parts[5] if len(parts) > 5 else None
+        fmt = query.get("format", ["full"])[0]
+        metadata_headers = query.get("metadataHeaders")
+        mailbox = self.mailbox
+
+        if resource == "profile":
+            return 200, {
+                "emailAddress": "me@growthandcompany.com",
+                "messagesTotal": mailbox.size,
+                "threadsTotal": len(mailbox.thread_ids),
+                "historyId": mailbox.history_id(),
+            }
+        if resource == "messages" and item_id is None:
+            ids = [{"id": mailbox.message_id(i), "threadId": mailbox.thread_of[i]}
+                   for i in range(mailbox.size) if mailbox.listed(i)]
+            page, next_token = _page(ids, query)
+            body = {"messages": page, "resultSizeEstimate": len(page)}
+            if next_token:
+                body["nextPageToken"] = next_token
+            return 200, body
+        if resource == "messages":
+            index = mailbox.index_of_id.get(item_id)
+            if index is None or not mailbox.exists(index):
+                return _error(404, "Requested entity was not found.")
+            return 200, mailbox.message(index, fmt, metadata_headers)
+        if resource == "threads" and item_id is None:
+            threads = [{"id": t, "snippet": "", "historyId": mailbox.history_id()} for t in mailbox.thread_ids
+                       if any(mailbox.listed(i) for i in mailbox.threads[t])]
+            page, next_token = _page(threads, query)
+            body = {"threads": page, "resultSizeEstimate": len(page)}
+            if next_token:
+                body["nextPageToken"] = next_token
+            return 200, body
+        if resource == "threads":
+            if item_id not in mailbox.threads or not any(mailbox.exists(i) for i in mailbox.threads[item_id]):
+                return _error(404, "Requested entity was not found.")
+            return 200, mailbox.thread(item_id, fmt, metadata_headers)
+        if resource == "history":
+            start = int(query.get("startHistoryId", ["0"])[0])
+            if start < mailbox.history_floor:
+                return _error(404, "Requested entity was not found.")
+            changes = [h for h in mailbox.history if int(h["id"]) > start]
+            page, next_token = _page(changes, query)
+            body = {"history": page, "historyId": mailbox.history_id()}
+            if next_token:
+                body["nextPageToken"] = next_token
+            return 200, body
+        return _error(404, f"Not found: {parsed.path}")
+
+    def handle_batch(self, content_type, body):
+        """Answer a multipart/mixed batch; returns (boundary, response_bytes)."""
+        message = BytesParser().parsebytes(
+            b"Content-Type: " + content_type.encode("ascii") + b"\r\n\r\n" + body
+        )
+        boundary = f"batch_{self._rng.getrandbits(64):016x}"
+        out = []
+        for part in message.get_payload():
+            inner = part.get_payload()
+            if isinstance(inner, list):  # parsed as message/http; flatten back to text
+                inner = inner[0].as_string()
+            request_line = inner.split("\n", 1)[0].strip()
+            method, path_with_query = request_line.split(" ")[:2]
+            status, payload = self.handle(method, path_with_query)
+            content_id = (part.get("Content-ID") or "<0>").strip()[1:-1]
+            reason = "OK" if status == 200 else "Error"
+            out.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {reason}\r\n"
+                "Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(payload)}\r\n"
+            )
+        out.append(f"--{boundary}--\r\n")
+        return boundary, "".join(out).encode("utf-8")
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, content_type="application/json; charset=UTF-8"):
+            if isinstance(body, (dict, list)):
+                body = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _start(self):
+            with fake._lock:
+                fake.stats["http_requests"] += 1
+            if fake.latency:
+                time.sleep(fake.latency)
+
+        def do_GET(self):
+            if self.path == "/_stats":
+                with fake._lock:
+                    self._send(200, dict(fake.stats))
+                return
+            self._start()
+            status, body = fake.handle("GET", self.path)
+            self._send(status, body)
+
+        def do_POST(self):
+            self._start()
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length)
+            if not urlparse(self.path).path.startswith("/batch"):
+                self._send(*_error(404, f"Not found: {self.path}"))
+                return
+            if fake._inject_429():
+                self._send(*_error(429, "Rate Limit Exceeded (injected)"))
+                return
+            boundary, payload = fake.handle_batch(self.headers.get("Content-Type", ""), body)
+            self._send(200, payload, f"multipart/mixed; boundary={boundary}")
+
+    return Handler
+
+
+def start_server(port=0, host="127.0.0.1", **options):
+    """
+    Start the fake server on a background thread.
+    Returns (server, fake); the endpoint is f"http://{host}:{server.server_port}/".
+    Options: size, seed, body_kb, newsletter_ratio, history_floor, undelivered, latency_ms, error_rate.
+    """
+    mailbox_options = {k: options[k] for k in ("size", "seed", "body_kb", "newsletter_ratio", "history_floor",
+                                               "undelivered") if k in options}
+    fake = FakeGmail(
+        SyntheticMailbox(**mailbox_options),
+        latency_ms=options.get("latency_ms", 0.0),
+        error_rate=options.get("error_rate", 0.0),
+        seed=options.get("seed", 0),
+    )
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake of the Gmail API endpoints used by the exporters")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--messages", type=int, default=1000, help="synthetic mailbox size")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--body-kb", type=int, default=4, help="approximate body size per message")
+    parser.add_argument("--newsletter-ratio", type=float, default=0.6)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added to every HTTP request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of a 429 per call")
+    args = parser.parse_args()
+
+    server, _ = start_server(
+        port=args.port,
+        size=args.messages,
+        seed=args.seed,
+        body_kb=args.body_kb,
+        newsletter_ratio=args.newsletter_ratio,
+        latency_ms=args.latency_ms,
+        error_rate=args.error_rate,
+    )
+    print(f"Fake Gmail API with {args.messages} messages on http://127.0.0.1:{server.server_port}/")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
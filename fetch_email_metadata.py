@@ -14,6 +14,9 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 
+from gmail_fetch import FetchEngine, progress_printer
+from gmail_payload import header_value
+
 # Scope: read-only access to email metadata and headers (no body needed for this demo)
 SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
 CREDENTIALS_FILE = Path(__file__).parent / "credentials.json"
@@ -47,17 +50,9 @@ def get_credentials():
     return creds
 
 
-def header_value(headers, name):
-    """Get a header value by name (case-insensitive)."""
-    name = name.lower()
-    for h in headers or []:
-        if h.get("name", "").lower() == name:
-            return h.get("value", "")
-    return ""
-
-
-def fetch_latest_metadata(service, max_results=MAX_MESSAGES):
+def fetch_latest_metadata(service, max_results=MAX_MESSAGES, engine=None):
     """List latest message IDs, then get metadata (no body) for each."""
+    engine = engine or FetchEngine(lambda: service, workers=1)
     result = (
         service.users()
         .messages()
@@ -70,17 +65,9 @@ def fetch_latest_metadata(service, max_results=MAX_MESSAGES):
 
     ids = [m["id"] for m in messages]
     # Fetch each message with format=metadata (headers + labels, no body)
-    metadatas = []
-    for i, msg_id in enumerate(ids):
-        msg = (
-            service.users()
-            .messages()
-            .get(userId="me", id=msg_id, format="metadata")
-            .execute()
-        )
-        metadatas.append(msg)
-        if (i + 1) % 20 == 0:
-            print(f"  Fetched {i + 1}/{len(ids)}...")
+    metadatas, failed = engine.get_messages(ids, "metadata", progress=progress_printer(20))
+    for msg_id, error in failed.items():
+        print(f"  Skipped {msg_id}: {error}")
 
     return metadatas, result
 
@@ -107,9 +94,10 @@ def main():
     print("Gmail API – latest emails metadata demo\n")
     creds = get_credentials()
     service = build("gmail", "v1", credentials=creds)
+    engine = FetchEngine.from_env(lambda: build("gmail", "v1", credentials=creds))
 
     print(f"Fetching latest {MAX_MESSAGES} messages (metadata only)...")
-    metadatas, list_result = fetch_latest_metadata(service, MAX_MESSAGES)
+    metadatas, list_result = fetch_latest_metadata(service, MAX_MESSAGES, engine)
     print(f"Done. Got {len(metadatas)} messages.\n")
 
     # Show raw structure of list response
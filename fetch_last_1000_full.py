@@ -1,15 +1,43 @@
 """
 Fetch the last ~1,000 emails with full body content.
 Uses pagination (Gmail API max 500 per list call). Saves to last_1000_emails_full.json.
-Takes a few minutes to run.
+Message bodies are fetched in concurrent Gmail batch requests under the per-user quota;
+tune with GMAIL_BATCH_SIZE, GMAIL_FETCH_WORKERS and GMAIL_QUOTA_UNITS_PER_SEC (see gmail_fetch.py).
 
 To pull a *remote* user's emails (someone who signed in via your domain):
   set GMAIL_TOKEN_FILE=token_remote.json
   python fetch_last_1000_full.py
+
+Records are streamed to disk as they arrive. Set GMAIL_OUTPUT_FILE to a *.ndjson or
+*.ndjson.gz path for one record per line (optionally gzip-compressed) instead of a JSON list,
+or to a *.store directory to add the records to an indexed EmailStore (see email_store.py)
+that can later be read one thread or date range at a time.
+
+For long backfills, set GMAIL_RESUMABLE=1: the listed IDs and fetched records are
+checkpointed next to the output file, and re-running after a crash or token expiry
+only fetches the messages that are still missing.
+
+To save bandwidth, set GMAIL_TWO_PHASE=1: headers are fetched first (format=metadata)
+and EmailFilter's header-only rules drop newsletters and notifications before any body
+is downloaded. Records keep the list/bulk headers (List-Unsubscribe, Precedence,
+Auto-Submitted, email service provider headers) under "headers", which decide most
+newsletters on their own. Dropped messages go to filtered-<output file>.
+This saves bytes, not quota: messages.get costs 5 units in metadata format too, so the
+header pass adds 5 units for every message that is kept and then fetched in full.
+
+Set GMAIL_BY_THREAD=1 to export whole conversations with threads.get (one call per
+thread instead of one per message). Records keep the same shape and come out grouped by
+thread in date order, so EmailProcessor.process_emails(..., grouped_by_thread=True) can
+skip regrouping. It cannot be combined with GMAIL_TWO_PHASE or GMAIL_RESUMABLE; with
+GMAIL_INCREMENTAL, the merged export is regrouped the same way.
+
+For daily refreshes, set GMAIL_INCREMENTAL=1: the mailbox historyId is stored next to the
+token file (token_remote.sync.json) and later runs only fetch what changed since then.
+
+Bodies are taken from the first text/plain (else text/html) part anywhere in the MIME
+tree and capped at GMAIL_MAX_BODY_BYTES (see gmail_payload.py).
 """
 
-import base64
-import json
 import os
 from pathlib import Path
 
@@ -18,13 +46,34 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 
+from email_filter import EmailFilter
+from email_io import iter_emails, open_writer, write_emails
+from email_store import EmailStore, is_store
+from export_checkpoint import ExportCheckpoint
+from gmail_fetch import QUOTA_UNITS, FetchEngine, progress_printer
+from gmail_payload import bulk_headers, get_body_from_payload, header_value
+from gmail_sync import (
+    HistoryExpired,
+    current_history_id,
+    group_by_thread,
+    list_history_changes,
+    load_checkpoint,
+    merge_records,
+    save_checkpoint,
+)
+
 SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
 CREDENTIALS_FILE = Path(__file__).parent / "credentials.json"
 _token_file = os.environ.get("GMAIL_TOKEN_FILE", "token_remote.json")
 TOKEN_FILE = Path(_token_file) if os.path.isabs(_token_file) else Path(__file__).parent / _token_file
 MAX_MESSAGES = 1000
-OUTPUT_FILE = Path(__file__).parent / "last_1000_emails_full.json"
+_output_file = os.environ.get("GMAIL_OUTPUT_FILE", "last_1000_emails_full.json")
+OUTPUT_FILE = Path(_output_file) if os.path.isabs(_output_file) else Path(__file__).parent / _output_file
 LIST_PAGE_SIZE = 500  # Gmail API max for messages.list
+INCREMENTAL = os.environ.get("GMAIL_INCREMENTAL", "").lower() in ("1", "true", "yes")
+RESUMABLE = os.environ.get("GMAIL_RESUMABLE", "").lower() in ("1", "true", "yes")
+TWO_PHASE = os.environ.get("GMAIL_TWO_PHASE", "").lower() in ("1", "true", "yes")
+BY_THREAD = os.environ.get("GMAIL_BY_THREAD", "").lower() in ("1", "true", "yes")
 
 
 def get_credentials():
@@ -49,46 +98,7 @@ def get_credentials():
     return creds
 
 
-def header_value(headers, name):
-    name = name.lower()
-    for h in headers or []:
-        if h.get("name", "").lower() == name:
-            return h.get("value", "")
-    return ""
-
-
-def get_body_from_payload(payload):
-    """Extract plain text (or HTML) body from Gmail API message payload."""
-    if not payload:
-        return ""
-
-    body = payload.get("body", {})
-    if body.get("data"):
-        try:
-            return base64.urlsafe_b64decode(body["data"]).decode("utf-8", errors="replace")
-        except Exception:
-            return "[Could not decode body]"
-
-    parts = payload.get("parts", [])
-    plain = None
-    html = None
-    for part in parts:
-        mime = (part.get("mimeType") or "").lower()
-        part_body = part.get("body", {})
-        if not part_body.get("data"):
-            continue
-        try:
-            decoded = base64.urlsafe_b64decode(part_body["data"]).decode("utf-8", errors="replace")
-        except Exception:
-            continue
-        if mime == "text/plain":
-            plain = decoded
-        elif mime == "text/html":
-            html = decoded
-    return plain or html or ""
-
-
-def list_message_ids(service, max_results=MAX_MESSAGES):
+def list_message_ids(service, max_results=MAX_MESSAGES, engine=None):
     """Paginate through messages.list to get up to max_results message IDs."""
     ids = []
     page_token = None
@@ -97,7 +107,11 @@ def list_message_ids(service, max_results=MAX_MESSAGES):
         request = service.users().messages().list(
             userId="me", maxResults=count, pageToken=page_token
         )
-        result = request.execute()
+        if engine:
+            # Goes through the engine's token bucket and 429/5xx retries
+            result = engine.execute(lambda _: request, QUOTA_UNITS["messages.list"])
+        else:
+            result = request.execute()
         messages = result.get("messages", [])
         ids.extend([m["id"] for m in messages])
         page_token = result.get("nextPageToken")
@@ -106,23 +120,113 @@ def list_message_ids(service, max_results=MAX_MESSAGES):
     return ids[:max_results]
 
 
-def fetch_last_n_full(service, n=MAX_MESSAGES):
-    """List last n message IDs (with pagination), then get full message for each."""
+def list_thread_ids(service, max_results=MAX_MESSAGES, engine=None):
+    """Paginate through threads.list to get up to max_results thread IDs (newest first)."""
+    ids = []
+    page_token = None
+    while len(ids) < max_results:
+        count = min(LIST_PAGE_SIZE, max_results - len(ids))
+        request = service.users().threads().list(
+            userId="me", maxResults=count, pageToken=page_token
+        )
+        if engine:
+            result = engine.execute(lambda _: request, QUOTA_UNITS["threads.list"])
+        else:
+            result = request.execute()
+        threads = result.get("threads", [])
+        ids.extend([t["id"] for t in threads])
+        page_token = result.get("nextPageToken")
+        if not page_token or not threads:
+            break
+    return ids[:max_results]
+
+
+def iter_last_n_by_thread(service, n=MAX_MESSAGES, engine=None):
+    """
+    Yield full messages of the most recent threads, one threads.get per conversation,
+    until n messages have been produced. Messages of a thread come out together and in
+    the order Gmail returns them (oldest first).
+    """
+    engine = engine or FetchEngine(lambda: service, workers=1)
+    print(f"  Listing up to {n} thread IDs...")
+    # Every thread has at least one message, so n threads always cover n messages
+    thread_ids = list_thread_ids(service, n, engine)
+    print(f"  Found {len(thread_ids)} threads. Fetching full conversations...")
+    failed = {}
+    produced = 0
+    threads = engine.iter_threads(thread_ids, "full", progress=progress_printer(100), failed=failed)
+    try:
+        for thread in threads:
+            for msg in thread.get("messages", []):
+                yield msg
+                produced += 1
+            if produced >= n:
+                return
+    finally:
+        # Cancels the fetches still queued when n is reached (or the caller stops early)
+        threads.close()
+        for thread_id, error in failed.items():
+            print(f"  Skipped thread {thread_id}: {error}")
+
+
+def prefilter_ids(engine, ids, email_filter, filtered_file):
+    """
+    Phase one of a two-phase export: fetch format=metadata for every ID, run the
+    header-only EmailFilter rules, and return the IDs that still need a full fetch.
+    Dropped messages are written (without body) to filtered_file with their reason.
+    Saves download bytes but not quota: every kept message costs a metadata get on top
+    of its full get, so quota only goes down when most messages are dropped.
+    """
+    print(f"  Phase 1: checking headers of {len(ids)} messages...")
+    keep = []
+    failed = {}
+    bytes_saved = 0
+    with open_writer(filtered_file) as filtered:
+        for msg in engine.iter_messages(ids, "metadata", progress=progress_printer(100), failed=failed):
+            record = to_serializable(msg)
+            result = email_filter.should_filter_headers(record)
+            if result.should_filter:
+                record["_filter_reason"] = result.reason
+                record["_filter_confidence"] = result.confidence
+                filtered.write(record)
+                bytes_saved += int(msg.get("sizeEstimate") or 0)
+            else:
+                keep.append(msg["id"])
+        dropped = filtered.count
+    # Anything whose headers could not be fetched is kept, so phase two gets another try
+    keep_set = set(keep).union(failed)
+    keep = [msg_id for msg_id in ids if msg_id in keep_set]
+    # Net quota change vs a single full pass: metadata gets for all, minus the full gets skipped
+    extra_units = QUOTA_UNITS["messages.get"] * (len(ids) - dropped)
+    print(f"  Phase 1: dropped {dropped} by headers, fetching bodies for {len(keep)}.")
+    print(f"  Phase 1: skipped ~{bytes_saved / 1e6:.1f} MB of message downloads "
+          f"for {extra_units:+d} quota units ({QUOTA_UNITS['messages.get'] * len(ids)} spent on headers).")
+    return keep
+
+
+def iter_last_n_full(service, n=MAX_MESSAGES, engine=None, prefilter=None, filtered_file=None):
+    """List last n message IDs (with pagination), then yield the full message for each
+    as soon as it arrives (in list order).
+
+    The gets run through a FetchEngine (batched, concurrent, quota-limited);
+    without one, a single-worker engine around `service` is used. With a prefilter
+    (EmailFilter), only messages that pass its header-only rules are fetched in full.
+    """
+    engine = engine or FetchEngine(lambda: service, workers=1)
     print(f"  Listing up to {n} message IDs...")
-    ids = list_message_ids(service, n)
+    ids = list_message_ids(service, n, engine)
     print(f"  Found {len(ids)} messages. Fetching full content (this may take a few minutes)...")
-    full_messages = []
-    for i, msg_id in enumerate(ids):
-        msg = (
-            service.users()
-            .messages()
-            .get(userId="me", id=msg_id, format="full")
-            .execute()
-        )
-        full_messages.append(msg)
-        if (i + 1) % 100 == 0 or (i + 1) == len(ids):
-            print(f"  Fetched {i + 1}/{len(ids)}...")
-    return full_messages
+    if prefilter:
+        ids = prefilter_ids(engine, ids, prefilter, filtered_file)
+    failed = {}
+    yield from engine.iter_messages(ids, "full", progress=progress_printer(100), failed=failed)
+    for msg_id, error in failed.items():
+        print(f"  Skipped {msg_id}: {error}")
+
+
+def fetch_last_n_full(service, n=MAX_MESSAGES, engine=None):
+    """List last n message IDs (with pagination), then get full message for each."""
+    return list(iter_last_n_full(service, n, engine))
 
 
 def to_serializable(msg):
@@ -139,24 +243,148 @@ def to_serializable(msg):
         "To": header_value(headers, "To"),
         "Subject": header_value(headers, "Subject"),
         "Date": header_value(headers, "Date"),
+        "headers": bulk_headers(headers),
         "body": get_body_from_payload(payload),
     }
 
 
+def sync_incremental(service, engine, existing, history_id, n=MAX_MESSAGES):
+    """
+    Bring an existing export up to date from history_id, keeping the newest n records
+    (all of them if n is None).
+    Returns (records, new_history_id); raises HistoryExpired if the checkpoint is too old.
+    existing is the list of exported records, or an EmailStore: deleted messages are then
+    removed from the store directly and only the new records are returned.
+    """
+    print(f"  Checking mailbox history since {history_id}...")
+    added_ids, deleted_ids, new_history_id = list_history_changes(service, history_id, engine)
+    known_ids = existing if isinstance(existing, EmailStore) else {r.get("id") for r in existing}
+    to_fetch = [msg_id for msg_id in added_ids if msg_id not in known_ids]
+    print(f"  {len(to_fetch)} new and {len(deleted_ids)} deleted messages since last sync.")
+    new_messages, failed = engine.get_messages(to_fetch, "full", progress=progress_printer(100))
+    for msg_id, error in failed.items():
+        print(f"  Skipped {msg_id}: {error}")
+    new_records = [to_serializable(m) for m in new_messages]
+    if isinstance(existing, EmailStore):
+        existing.delete(deleted_ids)
+        return new_records, new_history_id
+    return merge_records(existing, new_records, deleted_ids, n), new_history_id
+
+
+def export_resumable(service, engine, n=MAX_MESSAGES, output_file=OUTPUT_FILE,
+                     prefilter=None, filtered_file=None):
+    """
+    Full export that survives crashes: progress is checkpointed next to output_file
+    and a restart fetches only the IDs that are still missing. With a prefilter, the
+    checkpointed ID list is the set that survived the header-only phase.
+    Returns (checkpoint, history_id); read the records with checkpoint.iter_records().
+    """
+    checkpoint = ExportCheckpoint(output_file)
+    if checkpoint.exists():
+        ids, done, history_id = checkpoint.load()
+        print(f"  Resuming export: {len(done)}/{len(ids)} messages already fetched.")
+    else:
+        history_id = current_history_id(service, engine) if INCREMENTAL else None
+        print(f"  Listing up to {n} message IDs...")
+        ids = list_message_ids(service, n, engine)
+        print(f"  Found {len(ids)} messages. Fetching full content (this may take a few minutes)...")
+        if prefilter:
+            ids = prefilter_ids(engine, ids, prefilter, filtered_file)
+        checkpoint.start(ids, history_id)
+        done = set()
+
+    missing = [msg_id for msg_id in ids if msg_id not in done]
+    failed = {}
+    with checkpoint:
+        for msg in engine.iter_messages(missing, "full", progress=progress_printer(100), failed=failed):
+            checkpoint.record(to_serializable(msg))
+    for msg_id, error in failed.items():
+        print(f"  Skipped {msg_id}: {error}")
+    return checkpoint, history_id
+
+
+def run_export(service, engine, token_file=TOKEN_FILE, output_file=OUTPUT_FILE, n=MAX_MESSAGES, status=None):
+    """
+    Export one mailbox to output_file using the GMAIL_* mode flags; returns the number
+    of records written. token_file is only used to locate the sync checkpoint. If a
+    status dict is given, status["messages"] is kept up to date while records stream in.
+    Raises ValueError for GMAIL_BY_THREAD combined with GMAIL_TWO_PHASE or GMAIL_RESUMABLE.
+    """
+    if BY_THREAD and (TWO_PHASE or RESUMABLE):
+        # Thread exports have no header-only phase and no per-message checkpoint
+        raise ValueError("GMAIL_BY_THREAD=1 cannot be combined with GMAIL_TWO_PHASE or GMAIL_RESUMABLE")
+    output_file = Path(output_file)
+    records = None
+    checkpoint = load_checkpoint(token_file) if INCREMENTAL else None
+    if checkpoint and output_file.exists():
+        try:
+            if is_store(output_file):
+                with EmailStore(output_file) as store:
+                    records, history_id = sync_incremental(service, engine, store, checkpoint["historyId"], n)
+            else:
+                existing = list(iter_emails(output_file))
+                # Thread exports keep whole threads, so they are trimmed after regrouping
+                limit = None if BY_THREAD else n
+                records, history_id = sync_incremental(service, engine, existing, checkpoint["historyId"], limit)
+                if BY_THREAD:
+                    # merge_records sorts newest first; put the threads back together
+                    records = group_by_thread(records, n)
+        except HistoryExpired:
+            print("  Sync checkpoint is too old for Gmail history; falling back to a full export.")
+
+    export_checkpoint = None
+    prefilter = EmailFilter() if TWO_PHASE else None
+    filtered_file = output_file.with_name("filtered-" + output_file.name)
+    if records is None and BY_THREAD:
+        history_id = current_history_id(service, engine) if INCREMENTAL else None
+        records = (to_serializable(m) for m in iter_last_n_by_thread(service, n, engine))
+    elif records is None and RESUMABLE:
+        export_checkpoint, history_id = export_resumable(
+            service, engine, n, output_file, prefilter, filtered_file
+        )
+        records = export_checkpoint.iter_records()
+    elif records is None:
+        # Taken before listing, so anything arriving mid-export shows up in the next sync
+        history_id = current_history_id(service, engine) if INCREMENTAL else None
+        records = (
+            to_serializable(m)
+            for m in iter_last_n_full(service, n, engine, prefilter, filtered_file)
+        )
+    if status is not None:
+        records = _counted(records, status)
+
+    if is_store(output_file):
+        # Stores are updated in place; a record with a known ID replaces the stored copy
+        count = write_emails(output_file, records)
+    else:
+        # Stream into a side file and swap it in, so a failed run keeps the previous export
+        partial_file = output_file.with_name("partial-" + output_file.name)
+        count = write_emails(partial_file, records)
+        partial_file.replace(output_file)
+    if export_checkpoint:
+        export_checkpoint.clear()
+    if history_id:
+        save_checkpoint(token_file, history_id)
+    return count
+
+
+def _counted(records, status):
+    status["messages"] = 0
+    for record in records:
+        status["messages"] += 1
+        yield record
+
+
 def main():
     print(f"Fetching last {MAX_MESSAGES} emails (full body)...\n")
     creds = get_credentials()
     service = build("gmail", "v1", credentials=creds)
+    engine = FetchEngine.from_env(lambda: build("gmail", "v1", credentials=creds))
 
-    full_messages = fetch_last_n_full(service, MAX_MESSAGES)
-    print(f"\nDone. Got {len(full_messages)} messages.\n")
-
-    out = [to_serializable(m) for m in full_messages]
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(out, f, indent=2, ensure_ascii=False)
-
+    count = run_export(service, engine, TOKEN_FILE, OUTPUT_FILE, MAX_MESSAGES)
+    print(f"\nDone. Got {count} messages.\n")
     print(f"Saved to: {OUTPUT_FILE}")
-    print("Each entry has: id, threadId, labelIds, snippet, From, To, Subject, Date, body (full text).")
+    print("Each entry has: id, threadId, labelIds, snippet, From, To, Subject, Date, headers (list/bulk), body (full text).")
 
 
 if __name__ == "__main__":
@@ -3,7 +3,6 @@ Fetch the last 10 emails with full body content.
 Uses same OAuth as fetch_email_metadata.py; saves to last_10_emails_full.json.
 """
 
-import base64
 import json
 from pathlib import Path
 
@@ -12,6 +11,9 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 
+from gmail_fetch import FetchEngine, progress_printer
+from gmail_payload import bulk_headers, get_body_from_payload, header_value
+
 SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
 CREDENTIALS_FILE = Path(__file__).parent / "credentials.json"
 TOKEN_FILE = Path(__file__).parent / "token.json"
@@ -41,52 +43,9 @@ def get_credentials():
     return creds
 
 
-def header_value(headers, name):
-    name = name.lower()
-    for h in headers or []:
-        if h.get("name", "").lower() == name:
-            return h.get("value", "")
-    return ""
-
-
-def get_body_from_payload(payload):
-    """
-    Extract plain text (or HTML) body from Gmail API message payload.
-    Handles single-part (payload.body) and multipart (payload.parts) messages.
-    """
-    if not payload:
-        return ""
-
-    # Single-part: body is in payload.body
-    body = payload.get("body", {})
-    if body.get("data"):
-        try:
-            return base64.urlsafe_b64decode(body["data"]).decode("utf-8", errors="replace")
-        except Exception:
-            return "[Could not decode body]"
-
-    # Multipart: look for text/plain first, then text/html
-    parts = payload.get("parts", [])
-    plain = None
-    html = None
-    for part in parts:
-        mime = (part.get("mimeType") or "").lower()
-        part_body = part.get("body", {})
-        if not part_body.get("data"):
-            continue
-        try:
-            decoded = base64.urlsafe_b64decode(part_body["data"]).decode("utf-8", errors="replace")
-        except Exception:
-            continue
-        if mime == "text/plain":
-            plain = decoded
-        elif mime == "text/html":
-            html = decoded
-    return plain or html or ""
-
-
-def fetch_last_n_full(service, n=MAX_MESSAGES):
+def fetch_last_n_full(service, n=MAX_MESSAGES, engine=None):
     """List last n message IDs, then get full message (including body) for each."""
+    engine = engine or FetchEngine(lambda: service, workers=1)
     result = (
         service.users()
         .messages()
@@ -97,16 +56,11 @@ def fetch_last_n_full(service, n=MAX_MESSAGES):
     if not messages:
         return []
 
-    full_messages = []
-    for i, m in enumerate(messages):
-        msg = (
-            service.users()
-            .messages()
-            .get(userId="me", id=m["id"], format="full")
-            .execute()
-        )
-        full_messages.append(msg)
-        print(f"  Fetched {i + 1}/{len(messages)}...")
+    full_messages, failed = engine.get_messages(
+        [m["id"] for m in messages], "full", progress=progress_printer(1)
+    )
+    for msg_id, error in failed.items():
+        print(f"  Skipped {msg_id}: {error}")
     return full_messages
 
 
@@ -124,6 +78,7 @@ def to_serializable(msg):
         "To": header_value(headers, "To"),
         "Subject": header_value(headers, "Subject"),
         "Date": header_value(headers, "Date"),
+        "headers": bulk_headers(headers),
         "body": get_body_from_payload(payload),
     }
 
@@ -132,8 +87,9 @@ def main():
     print("Fetching last 10 emails (full body)...\n")
     creds = get_credentials()
     service = build("gmail", "v1", credentials=creds)
+    engine = FetchEngine.from_env(lambda: build("gmail", "v1", credentials=creds))
 
-    full_messages = fetch_last_n_full(service, MAX_MESSAGES)
+    full_messages = fetch_last_n_full(service, MAX_MESSAGES, engine)
     print(f"Done. Got {len(full_messages)} messages.\n")
 
     out = [to_serializable(m) for m in full_messages]
@@ -141,7 +97,7 @@ def main():
         json.dump(out, f, indent=2, ensure_ascii=False)
 
     print(f"Saved to: {OUTPUT_FILE}")
-    print("Each entry has: id, threadId, labelIds, snippet, From, To, Subject, Date, body (full text).")
+    print("Each entry has: id, threadId, labelIds, snippet, From, To, Subject, Date, headers (list/bulk), body (full text).")
 
 
 if __name__ == "__main__":
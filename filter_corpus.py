@@ -0,0 +1,301 @@
+"""
+Synthetic, labelled email corpus for benchmarking and regression-testing EmailFilter.
+
+generate_corpus(n, seed) returns records in the export format (id, threadId,
+labelIds, From, To, Cc, Subject, Date, headers, body, ...) plus two labels:
+- _category: thread, newsletter, receipt, calendar or notification
+- _expected: 'keep' for real conversations, 'filter' for everything else
+
+The same (n, seed, mix) always gives the same corpus. Categories mimic what a mailbox
+actually holds: newsletters with large HTML bodies and (usually) List-Unsubscribe or
+ESP headers, receipts and shipping notices, calendar invitations, product
+notifications, and real threads of varying length with quoted replies, large
+recipient lists and the business vocabulary ('deal', 'offer', 'Thank you for ...')
+that trips naive keyword rules.
+
+  python filter_corpus.py --emails 5000 --seed 1 --out corpus.ndjson.gz
+"""
+
+import argparse
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+EXPECTED = {
+    'thread': 'keep',
+    'newsletter': 'filter',
+    'receipt': 'filter',
+    'calendar': 'filter',
+    'notification': 'filter',
+}
+DEFAULT_MIX = {'thread': 0.45, 'newsletter': 0.3, 'receipt': 0.1, 'calendar': 0.07, 'notification': 0.08}
+THREAD_LENGTHS = [1, 1, 2, 2, 3, 4, 6]
+BASE_TIME = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+FIRST_NAMES = ['alice', 'bob', 'carol', 'dave', 'erin', 'frank', 'grace', 'heidi', 'ivan', 'judy',
+               'mallory', 'niaj', 'olivia', 'peggy', 'rupert', 'sybil', 'trent', 'victor', 'wendy', 'yusuf']
+COMPANIES = ['acme.com', 'globex.com', 'initech.com', 'umbrella.co.uk', 'hooli.io', 'vandelay.com',
+             'wonka.de', 'stark.industries', 'cyberdyne.ai', 'soylent.fr']
+THREAD_TOPICS = [
+    'Q3 budget review', 'Contract draft v2', 'Hiring pipeline for the data team', 'Partnership next steps',
+    'Intro: growth lead at {company}', 'Board deck comments', 'Pricing for the enterprise deal',
+    'Thank you for the intro', 'Follow-up on our offer', 'Your thoughts on the proposal?',
+    'Offsite agenda', 'Customer escalation: {company}', 'Term sheet questions', 'Re-org announcement',
+    'Lunch next week?', 'Sales pipeline update', 'Design review notes', 'Invoice dispute with {company}',
+]
+THREAD_SENTENCES = [
+    'Thanks for sending this over, I had a look this morning.',
+    'Can we move the call to Thursday afternoon?',
+    'I think the numbers work if we push the launch by two weeks.',
+    'Legal is still reviewing the indemnity clause in section 7.',
+    'The deal is close, they want a 10% discount on the first year.',
+    'Could you share the latest version of the deck before Friday?',
+    'Our offer to the candidate went out yesterday; she will reply by Monday.',
+    'I looped in {name} who owns the integration work.',
+    'Happy to jump on a call if that is easier.',
+    'The sale of the old office closes at the end of the month.',
+    'We agreed on the milestones, the remaining question is payment terms.',
+    'Let me know if anything in the attached draft looks off.',
+    'The customer is frustrated about the outage and wants a written postmortem.',
+    'I will send the updated forecast after the finance sync.',
+]
+SHORT_REPLIES = ['Thanks!', 'Sounds good.', 'Works for me.', 'Approved.', 'See you then.', 'Great, thank you']
+
+NEWSLETTER_BRANDS = ['shopnow.com', 'techweekly.io', 'medium.com', 'substack.com', 'travelz.com',
+                     'fashionhub.co.uk', 'gadgetdeals.com', 'foodie.net', 'cloudvendor.com', 'fintechdaily.com']
+ESP_DOMAINS = ['mailchimp.com', 'sendgrid.com', 'hubspot.com', 'mailgun.com', 'customer.io']
+NEWSLETTER_SUBJECTS = [
+    'Weekly digest: top stories', '50% off this weekend only', 'Your March update', 'New arrivals just for you',
+    "This week's must-reads", 'Last chance: summer sale ends tonight', 'Product roundup #{n}', 'Issue #{n}',
+    'Flash sale: free shipping', 'The best of {brand} this month',
+]
+NEWSLETTER_PARAGRAPHS = [
+    'Discover the latest trends and our hand-picked selection of products for the season.',
+    'Our editors reviewed dozens of tools so you do not have to. Here are the winners.',
+    'Members get early access to new collections and exclusive discounts.',
+    'Read the full story on our blog and join the conversation with thousands of readers.',
+    'Limited stock available. Prices valid while supplies last.',
+    'Catch up on the most popular articles from the past week.',
+]
+NEWSLETTER_FOOTERS = [
+    'You received this email because you subscribed to our newsletter. Unsubscribe here.',
+    'To stop receiving these emails, click here to unsubscribe.',
+    'Manage your subscription preferences here.',
+    'View this email in your browser.',
+    'Follow us on Instagram, Facebook and LinkedIn.',
+    'This email was sent to {to} because you opted in.',
+]
+RECEIPT_SENDERS = ['orders@shopnow.com', 'receipts@rideshare.com', 'billing@cloudvendor.com',
+                   'no-reply@airline.com', 'store@gadgetdeals.com', 'payments@saasapp.io']
+RECEIPT_SUBJECTS = ['Your receipt from {brand}', 'Order #{n} confirmed', 'Your order has shipped',
+                    'Payment received - thank you', 'Invoice INV-{n}', 'Your trip with {brand}']
+NOTIFICATION_SENDERS = ['notifications@github.com', 'no-reply@slack.com', 'jira@atlassian.net',
+                        'noreply@linear.app', 'alerts@datadoghq.com', 'drive-shares-noreply@google.com']
+NOTIFICATION_SUBJECTS = ['[{brand}] New comment on issue #{n}', 'You have been mentioned in #general',
+                         'Alert: CPU above 90% on web-{n}', '{name} shared a document with you',
+                         'Build #{n} failed', 'New sign-in to your account']
+CALENDAR_SENDERS = ['calendar-notification@google.com', '{name}@{company}', 'calendar@outlook.example']
+CALENDAR_SUBJECTS = ['Invitation: {topic} @ Tue 10am', 'Updated invitation: {topic}',
+                     'Accepted: {topic}', 'Reminder: {topic} starts in 10 minutes']
+
+
+def _person(rng: random.Random, company: Optional[str] = None) -> str:
+    return f"{rng.choice(FIRST_NAMES)}@{company or rng.choice(COMPANIES)}"
+
+
+def _display(address: str) -> str:
+    name = address.split('@')[0].capitalize()
+    return f"{name} <{address}>"
+
+
+def _fill(template: str, rng: random.Random, **values) -> str:
+    defaults = {
+        'company': rng.choice(COMPANIES).split('.')[0].capitalize(),
+        'name': rng.choice(FIRST_NAMES).capitalize(),
+        'brand': rng.choice(NEWSLETTER_BRANDS).split('.')[0].capitalize(),
+        'n': rng.randint(100, 99999),
+    }
+    defaults.update(values)
+    return template.format(**defaults)
+
+
+def _html(paragraphs: List[str], rng: random.Random) -> str:
+    """A table-based marketing HTML body"""
+    rows = ''.join(
+        f'<tr><td style="padding:12px;font-family:Arial,sans-serif;font-size:14px;color:#333">'
+        f'<img src="https://cdn.example.com/img/{rng.randint(1, 10 ** 6)}.png" width="560" alt="">'
+        f'<p>{p}</p><a href="https://t.example.com/c/{rng.getrandbits(64):x}">Read more</a></td></tr>'
+        for p in paragraphs
+    )
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><style>td{{border:0}}</style></head>'
+            f'<body><table width="600" align="center">{rows}</table></body></html>')
+
+
+def _thread_body(rng: random.Random, to: str, depth: int) -> str:
+    if rng.random() < 0.15:
+        body = rng.choice(SHORT_REPLIES)
+    else:
+        count = max(1, int(rng.lognormvariate(1.2, 0.6)))
+        body = ' '.join(_fill(rng.choice(THREAD_SENTENCES), rng) for _ in range(count))
+        body = f"Hi {to.split('@')[0].capitalize()},\n\n{body}\n\nBest,\n{rng.choice(FIRST_NAMES).capitalize()}"
+    # Replies quote the earlier messages
+    for level in range(depth):
+        quoted = ' '.join(_fill(rng.choice(THREAD_SENTENCES), rng) for _ in range(rng.randint(2, 6)))
+        body += f"\n\nOn Mon, {rng.randint(1, 28)} Jan 2026, someone wrote:\n" + '> ' * (level + 1) + quoted
+    return body
+
+
+def _record(rng: random.Random, index: int, thread_id: str, category: str, when: datetime,
+            sender: str, to: List[str], subject: str, body: str,
+            labels: List[str], headers: Dict[str, str], cc: Optional[List[str]] = None) -> Dict:
+    return {
+        'id': f"{0x19a0000000000000 + index:016x}",
+        'threadId': thread_id,
+        'labelIds': labels,
+        'snippet': ' '.join(body.split())[:100],
+        'internalDate': str(int(when.timestamp() * 1000)),
+        'From': _display(sender) if rng.random() < 0.7 else sender,
+        'To': ', '.join(to),
+        'Cc': ', '.join(cc or []),
+        'Subject': subject,
+        'Date': when.strftime('%a, %d %b %Y %H:%M:%S +0000'),
+        'headers': headers,
+        'body': body,
+        '_category': category,
+        '_expected': EXPECTED[category],
+    }
+
+
+def _thread(rng: random.Random, start: int, when: datetime, me: str) -> List[Dict]:
+    company = rng.choice(COMPANIES)
+    people = [_person(rng, company) for _ in range(rng.randint(1, 3))] + [_person(rng)]
+    subject = _fill(rng.choice(THREAD_TOPICS), rng)
+    # A few threads are announcements or project threads with long recipient lists
+    extra = [_person(rng, company) for _ in range(rng.randint(9, 18))] if rng.random() < 0.06 else []
+    labels = ['INBOX'] + (['IMPORTANT'] if rng.random() < 0.4 else [])
+    if rng.random() < 0.02:
+        labels.append('CATEGORY_UPDATES')  # Gmail's tabs are wrong now and then
+    length = rng.choice(THREAD_LENGTHS)
+    thread_id = f"{0x19a0000000000000 + start:016x}"
+    records = []
+    for depth in range(length):
+        sender = rng.choice(people)
+        to = [me] + [p for p in people if p != sender][:2] + extra
+        records.append(_record(
+            rng, start + depth, thread_id, 'thread', when + timedelta(minutes=37 * depth),
+            sender, to, subject if depth == 0 else f"Re: {subject}", _thread_body(rng, me, depth),
+            labels, {}, cc=[_person(rng, company)] if rng.random() < 0.3 else None
+        ))
+    return records
+
+
+def _newsletter(rng: random.Random, index: int, when: datetime, me: str) -> Dict:
+    brand = rng.choice(NEWSLETTER_BRANDS)
+    via_esp = rng.random() < 0.35
+    sender = f"{rng.choice(['news', 'hello', 'team', 'editors', 'deals'])}@{rng.choice(ESP_DOMAINS) if via_esp else brand}"
+    paragraphs = [rng.choice(NEWSLETTER_PARAGRAPHS) for _ in range(max(3, int(rng.lognormvariate(3.0, 0.7))))]
+    footer = _fill(rng.choice(NEWSLETTER_FOOTERS), rng, to=me)
+    body = _html(paragraphs + [footer], rng) if rng.random() < 0.6 else '\n\n'.join(paragraphs + [footer])
+    headers = {}
+    if rng.random() < 0.75:
+        headers['List-Unsubscribe'] = f"<mailto:unsubscribe@{brand}>, <https://{brand}/u/{rng.getrandbits(48):x}>"
+    if rng.random() < 0.3:
+        headers['Precedence'] = 'bulk'
+    if via_esp and rng.random() < 0.6:
+        headers['X-SG-EID'] = f"{rng.getrandbits(96):x}"
+    labels = ['CATEGORY_PROMOTIONS'] if rng.random() < 0.6 else ['INBOX']
+    subject = _fill(rng.choice(NEWSLETTER_SUBJECTS), rng, brand=brand.split('.')[0].capitalize())
+    return _record(rng, index, f"{0x19a0000000000000 + index:016x}", 'newsletter', when,
+                   sender, [me], subject, body, labels, headers)
+
+
+def _receipt(rng: random.Random, index: int, when: datetime, me: str) -> Dict:
+    sender = rng.choice(RECEIPT_SENDERS)
+    brand = sender.split('@')[1].split('.')[0].capitalize()
+    items = '\n'.join(f"{rng.choice(['Widget', 'Subscription', 'Ride', 'Seat', 'Plan'])} x{rng.randint(1, 3)}"
+                      f"    ${rng.randint(5, 500)}.{rng.randint(0, 99):02d}" for _ in range(rng.randint(1, 12)))
+    body = (f"Thanks for your purchase.\n\nOrder #{rng.randint(10000, 99999)}\n{items}\n\n"
+            f"Questions? Visit our help center. Terms and conditions apply. Privacy policy.")
+    if rng.random() < 0.5:
+        body = _html(body.split('\n\n'), rng)
+    headers = {'Auto-Submitted': 'auto-generated'} if rng.random() < 0.3 else {}
+    labels = ['CATEGORY_UPDATES'] if rng.random() < 0.5 else ['INBOX']
+    return _record(rng, index, f"{0x19a0000000000000 + index:016x}", 'receipt', when,
+                   sender, [me], _fill(rng.choice(RECEIPT_SUBJECTS), rng, brand=brand), body, labels, headers)
+
+
+def _calendar(rng: random.Random, index: int, when: datetime, me: str) -> Dict:
+    topic = _fill(rng.choice(THREAD_TOPICS), rng)
+    sender = _fill(rng.choice(CALENDAR_SENDERS), rng, name=rng.choice(FIRST_NAMES), company=rng.choice(COMPANIES))
+    body = (f"{topic}\nWhen: Tuesday 10:00 - 10:30 (UTC)\nJoining info: https://meet.example.com/{rng.getrandbits(32):x}\n"
+            f"Guests: {', '.join(_person(rng) for _ in range(rng.randint(2, 8)))}\n"
+            f"Invitation from Google Calendar. You are receiving this email because you are an attendee of the event.")
+    headers = {'Auto-Submitted': 'auto-generated'} if rng.random() < 0.5 else {}
+    return _record(rng, index, f"{0x19a0000000000000 + index:016x}", 'calendar', when,
+                   sender, [me], _fill(rng.choice(CALENDAR_SUBJECTS), rng, topic=topic), body, ['INBOX'], headers)
+
+
+def _notification(rng: random.Random, index: int, when: datetime, me: str) -> Dict:
+    sender = rng.choice(NOTIFICATION_SENDERS)
+    brand = sender.split('@')[1].split('.')[0].capitalize()
+    body = _fill(rng.choice([
+        '{name} commented: "Looks good to me, merging after CI passes."',
+        '{name} mentioned you in #general: can you take a look?',
+        'Monitor triggered at 03:12 UTC. View the dashboard for details.',
+        '{name} shared "Q3 plan" with you. Open in Docs.',
+        'A new sign-in was detected. If this was you, you can ignore this email.',
+    ]), rng)
+    body += '\n\nYou are receiving this because you are subscribed to this thread. Manage your notification settings.'
+    labels = ['CATEGORY_UPDATES'] if rng.random() < 0.4 else ['INBOX']
+    headers = {'Auto-Submitted': 'auto-generated'} if rng.random() < 0.4 else {}
+    return _record(rng, index, f"{0x19a0000000000000 + index:016x}", 'notification', when,
+                   sender, [me], _fill(rng.choice(NOTIFICATION_SUBJECTS), rng, brand=brand), body, labels, headers)
+
+
+def generate_corpus(n: int, seed: int = 0, mix: Optional[Dict[str, float]] = None,
+                    me: str = 'me@growthandcompany.com') -> List[Dict]:
+    """
+    n labelled synthetic emails, newest first
+
+    Args:
+        n: Number of emails
+        seed: Random seed; the same seed always gives the same corpus
+        mix: Share of emails in each category (see DEFAULT_MIX); normalized
+        me: Address of the mailbox owner
+
+    Returns:
+        Records in the export format plus _category and _expected
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    categories = sorted(mix)
+    # A thread draw yields several emails
+    mean_length = sum(THREAD_LENGTHS) / len(THREAD_LENGTHS)
+    weights = [mix[c] / mean_length if c == 'thread' else mix[c] for c in categories]
+    makers = {'newsletter': _newsletter, 'receipt': _receipt, 'calendar': _calendar, 'notification': _notification}
+    records: List[Dict] = []
+    when = BASE_TIME
+    while len(records) < n:
+        when -= timedelta(minutes=rng.randint(1, 180))
+        category = rng.choices(categories, weights)[0]
+        if category == 'thread':
+            records.extend(_thread(rng, len(records), when, me)[:n - len(records)])
+        else:
+            records.append(makers[category](rng, len(records), when, me))
+    return records
+
+
+def main():
+    from email_io import write_emails
+
+    parser = argparse.ArgumentParser(description='Write a synthetic labelled email corpus')
+    parser.add_argument('--emails', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='filter_corpus.ndjson.gz', help='Output file (.json, .ndjson[.gz], .store)')
+    args = parser.parse_args()
+    count = write_emails(args.out, generate_corpus(args.emails, args.seed))
+    print(f"Wrote {count} emails to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+Instrumentation for EmailFilter: which rules fire and what they cost.
+
+EmailFilter(profile=True) records, for every rule in its rule table:
+- evaluations: how many times the rule was actually tried on an email
+- hits: how many emails the rule decided (the rule named in the FilterResult)
+- seconds: cumulative time spent evaluating it
+plus the time of each check stage and the time to decide each email.
+
+Pattern rules are timed one pattern at a time, so a profiled filter runs a little
+slower than an unprofiled one; the decisions are the same. Patterns skipped by the
+literal prefilter count as evaluated (the prefilter check is their cost), patterns
+after the first match are not evaluated, and sender decisions served from the sender
+cache evaluate nothing. Stages that are a single rule (recipients, labels,
+notification sender) are timed as that rule.
+
+Profile an export file and print the report, most expensive rules first:
+
+  python filter_profile.py exports/emails.json
+  python filter_profile.py exports/emails.ndjson.gz --sort hits --json profile.json
+"""
+
+import argparse
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+SORT_KEYS = ('seconds', 'hits', 'evaluations', 'us_per_evaluation', 'hit_rate', 'rule_id')
+
+
+class FilterProfiler:
+    """Per-rule counters and per-email decision times for one EmailFilter"""
+
+    def __init__(self, rules: List[Tuple[str, float]]):
+        self.rules = rules
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            size = len(self.rules)
+            self.evaluations = [0] * size
+            self.hits = [0] * size
+            self.seconds = [0.0] * size
+            self.stage_calls: Dict[str, int] = {}
+            self.stage_seconds: Dict[str, float] = {}
+            self.decision_seconds: List[float] = []
+
+    def rule(self, rule_id: int, seconds: float):
+        """One evaluation of a rule"""
+        with self._lock:
+            self.evaluations[rule_id] += 1
+            self.seconds[rule_id] += seconds
+
+    def stage(self, name: str, seconds: float):
+        """One run of a check stage (e.g. 'sender', 'body')"""
+        with self._lock:
+            self.stage_calls[name] = self.stage_calls.get(name, 0) + 1
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+
+    def decision(self, rule_id: int, seconds: float):
+        """One email decided by rule_id (0 = kept) after seconds"""
+        with self._lock:
+            self.hits[rule_id] += 1
+            self.decision_seconds.append(seconds)
+
+    def rule_stats(self, sort_by: str = 'seconds') -> List[Dict[str, Any]]:
+        """
+        One dict per rule, ranked by sort_by (descending; ascending for rule_id)
+
+        Args:
+            sort_by: One of SORT_KEYS
+
+        Returns:
+            Dicts with rule_id, reason, evaluations, hits, seconds, us_per_evaluation
+            and hit_rate (hits per evaluation); the no-match entry is left out
+        """
+        if sort_by not in SORT_KEYS:
+            raise ValueError(f"sort_by must be one of {', '.join(SORT_KEYS)}")
+        with self._lock:
+            stats = [
+                {
+                    'rule_id': rule_id,
+                    'reason': reason,
+                    'evaluations': self.evaluations[rule_id],
+                    'hits': self.hits[rule_id],
+                    'seconds': self.seconds[rule_id],
+                    'us_per_evaluation': (self.seconds[rule_id] / self.evaluations[rule_id] * 1e6
+                                          if self.evaluations[rule_id] else 0.0),
+                    'hit_rate': self.hits[rule_id] / self.evaluations[rule_id] if self.evaluations[rule_id] else 0.0,
+                }
+                for rule_id, (reason, _) in enumerate(self.rules) if rule_id
+            ]
+        return sorted(stats, key=lambda s: s[sort_by], reverse=sort_by != 'rule_id')
+
+    def decision_stats(self) -> Dict[str, float]:
+        """Count, total and mean/p50/p95/p99/max milliseconds of the per-email decision times"""
+        import numpy as np  # Only needed for the report; EmailFilter imports this module without numpy
+        with self._lock:
+            times = np.array(self.decision_seconds, dtype=np.float64) * 1000
+        if not len(times):
+            return {'emails': 0, 'total_seconds': 0.0, 'mean_ms': 0.0, 'p50_ms': 0.0,
+                    'p95_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+        p50, p95, p99 = np.percentile(times, [50, 95, 99])
+        return {
+            'emails': len(times),
+            'total_seconds': float(times.sum()) / 1000,
+            'mean_ms': float(times.mean()),
+            'p50_ms': float(p50),
+            'p95_ms': float(p95),
+            'p99_ms': float(p99),
+            'max_ms': float(times.max()),
+        }
+
+    def dead_rules(self) -> List[Dict[str, Any]]:
+        """Rules that decided no email so far"""
+        return [s for s in self.rule_stats('rule_id') if not s['hits']]
+
+    def as_dict(self, sort_by: str = 'seconds') -> Dict[str, Any]:
+        with self._lock:
+            stages = {
+                name: {'calls': self.stage_calls[name], 'seconds': self.stage_seconds[name]}
+                for name in self.stage_calls
+            }
+        return {
+            'decisions': self.decision_stats(),
+            'kept': self.hits[0] if self.hits else 0,
+            'stages': stages,
+            'rules': self.rule_stats(sort_by),
+            'dead_rules': [s['rule_id'] for s in self.dead_rules()],
+        }
+
+    def dump(self, path: Union[str, Path], sort_by: str = 'seconds') -> Path:
+        """Write as_dict() to a JSON file"""
+        path = Path(path)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.as_dict(sort_by), f, indent=2)
+        return path
+
+    def report(self, sort_by: str = 'seconds', top: Optional[int] = None) -> str:
+        """Human-readable ranked report"""
+        data = self.as_dict(sort_by)
+        d = data['decisions']
+        lines = [
+            f"Emails: {d['emails']} decided in {d['total_seconds']:.3f}s, {data['kept']} kept "
+            f"(per email ms: mean {d['mean_ms']:.3f}, p50 {d['p50_ms']:.3f}, p95 {d['p95_ms']:.3f}, "
+            f"p99 {d['p99_ms']:.3f}, max {d['max_ms']:.3f})",
+            '',
+            f"{'stage':<22} {'calls':>9} {'seconds':>10}",
+        ]
+        for name, stage in sorted(data['stages'].items(), key=lambda item: -item[1]['seconds']):
+            lines.append(f"{name:<22} {stage['calls']:>9} {stage['seconds']:>10.4f}")
+        lines += ['', f"{'rule':>4} {'evals':>9} {'hits':>7} {'hit %':>6} {'seconds':>9} {'us/eval':>8}  reason"]
+        rules = data['rules'][:top] if top else data['rules']
+        for s in rules:
+            lines.append(
+                f"{s['rule_id']:>4} {s['evaluations']:>9} {s['hits']:>7} {s['hit_rate'] * 100:>6.1f} "
+                f"{s['seconds']:>9.4f} {s['us_per_evaluation']:>8.2f}  {s['reason']}"
+            )
+        dead = self.dead_rules()
+        lines += ['', f"Rules that decided no email: {len(dead)}"]
+        lines += [f"{s['rule_id']:>4} {s['evaluations']:>9}  {s['reason']}" for s in dead]
+        return '\n'.join(lines)
+
+
+def main():
+    from email_filter import EmailFilter
+    from email_io import iter_emails
+
+    parser = argparse.ArgumentParser(description='Profile EmailFilter rules on an email export')
+    parser.add_argument('source', help='Export file or store (.json, .ndjson[.gz], .store)')
+    parser.add_argument('--sort', default='seconds', choices=SORT_KEYS, help='Rank rules by this column')
+    parser.add_argument('--top', type=int, default=None, help='Show only the first N rules')
+    parser.add_argument('--json', default=None, help='Also write the full report to this JSON file')
+    args = parser.parse_args()
+
+    email_filter = EmailFilter(profile=True)
+    email_filter.filter_batch(list(iter_emails(args.source)))
+    print(email_filter.profiler.report(args.sort, args.top))
+    if args.json:
+        print(f"\nSaved {email_filter.profiler.dump(args.json, args.sort)}")
+
+
+if __name__ == '__main__':
+    main()
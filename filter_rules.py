@@ -0,0 +1,305 @@
+"""
+Compiled pattern sets for EmailFilter.
+
+A PatternSet answers "which is the first pattern in this list that matches the text"
+(the same answer as calling .search on each compiled pattern in order) without running
+every regex. Each pattern is reduced to the literal substrings any match must contain
+(e.g. 'unsubscribe.*here' needs 'unsubscribe' and 'here'). Patterns whose literals
+are missing from the text are skipped with plain substring checks (each distinct
+literal is looked up at most once per text), and a regex only runs for a candidate
+that is not itself a plain literal. Patterns without a usable literal, and non-ASCII
+text (where case folding can make a literal check disagree with re.IGNORECASE), fall
+back to the regexes.
+
+A Ruleset is everything EmailFilter matches against, compiled from the rules config
+(filter_rules.json): the pattern lists, sender domains and notification senders, Gmail
+labels, the recipient limit and the rule table (rule_id -> reason, confidence) with the
+rule ID ranges of each check. It is never modified after it is built; a changed config
+file becomes a new Ruleset with a new version. load_ruleset compiles each version of a
+file once per process, so every EmailFilter reading that file shares it.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+LITERAL = sre_parse.LITERAL
+# Opcodes whose result depends on text outside the match (anchors, \\b, lookarounds)
+CONTEXT_OPS = {sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT, sre_parse.GROUPREF,
+               sre_parse.GROUPREF_EXISTS}
+
+
+def required_literals(pattern: str) -> Tuple[List[str], bool]:
+    """
+    Literal runs every match of a case-insensitive pattern must contain, lower-cased.
+
+    Only top-level literal characters count; anything else (wildcards, classes, groups,
+    anchors) ends the current run. Returns (literals, is_plain) where is_plain means the
+    pattern is exactly one literal, so finding it in the text is the whole match.
+    Non-ASCII literals are dropped, since IGNORECASE folds them differently from lower().
+    """
+    runs, current = [], []
+    parsed = list(sre_parse.parse(pattern))
+    for op, arg in parsed:
+        if op is LITERAL:
+            current.append(chr(arg))
+        elif current:
+            runs.append(''.join(current))
+            current = []
+    if current:
+        runs.append(''.join(current))
+    literals = [run.lower() for run in runs if run.isascii()]
+    is_plain = len(runs) == 1 and len(literals) == 1 and all(op is LITERAL for op, _ in parsed)
+    return literals, is_plain
+
+
+def _uses_context(items) -> bool:
+    for op, arg in items:
+        if op in CONTEXT_OPS:
+            return True
+        for value in (arg if isinstance(arg, (list, tuple)) else [arg]):
+            if isinstance(value, sre_parse.SubPattern) and _uses_context(value):
+                return True
+            if isinstance(value, (list, tuple)) and any(
+                isinstance(v, sre_parse.SubPattern) and _uses_context(v) for v in value
+            ):
+                return True
+    return False
+
+
+def is_window_safe(pattern: str) -> bool:
+    """
+    True if a match inside any slice of a text is also a match in the whole text,
+    i.e. the pattern has no anchors, word boundaries, lookarounds or backreferences.
+    """
+    return not _uses_context(sre_parse.parse(pattern))
+
+
+class PatternSet:
+    """An ordered list of case-insensitive patterns matched as one unit"""
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = list(patterns)
+        self.regexes = [re.compile(pattern, re.IGNORECASE) for pattern in self.patterns]
+        self._literals = []
+        self._plain = []
+        for pattern in self.patterns:
+            literals, is_plain = required_literals(pattern)
+            # Longest literal first: it is the one least likely to be present
+            self._literals.append(sorted(set(literals), key=len, reverse=True))
+            self._plain.append(is_plain)
+        # Whether first_match may be run on slices of a text (see is_window_safe)
+        self.window_safe = all(is_window_safe(pattern) for pattern in self.patterns)
+
+    def first_match(self, text: str, profiler=None, first_rule: int = 0) -> Optional[int]:
+        """
+        Index of the first pattern that matches anywhere in text, or None.
+
+        text must already be lower-cased (EmailFilter lower-cases every field). With a
+        FilterProfiler, each pattern tried is recorded as rule first_rule + index.
+        """
+        if profiler is not None:
+            return self._first_match_profiled(text, profiler, first_rule)
+        if not text.isascii():
+            return self._first_match_regex(text)
+        present: Dict[str, bool] = {}
+        for index, literals in enumerate(self._literals):
+            candidate = True
+            for literal in literals:
+                found = present.get(literal)
+                if found is None:
+                    found = present[literal] = literal in text
+                if not found:
+                    candidate = False
+                    break
+            if not candidate:
+                continue
+            if (self._plain[index] and literals) or self.regexes[index].search(text):
+                return index
+        return None
+
+    def _matches(self, index: int, text: str, present: Dict[str, bool]) -> bool:
+        """One step of first_match: does pattern index match the (ASCII) text"""
+        literals = self._literals[index]
+        for literal in literals:
+            found = present.get(literal)
+            if found is None:
+                found = present[literal] = literal in text
+            if not found:
+                return False
+        return bool((self._plain[index] and literals) or self.regexes[index].search(text))
+
+    def _first_match_profiled(self, text: str, profiler, first_rule: int) -> Optional[int]:
+        ascii_text = text.isascii()
+        present: Dict[str, bool] = {}
+        for index, regex in enumerate(self.regexes):
+            start = time.perf_counter()
+            matched = self._matches(index, text, present) if ascii_text else regex.search(text)
+            profiler.rule(first_rule + index, time.perf_counter() - start)
+            if matched:
+                return index
+        return None
+
+    def _first_match_regex(self, text: str) -> Optional[int]:
+        for index, regex in enumerate(self.regexes):
+            if regex.search(text):
+                return index
+        return None
+
+
+RULES_FILE = Path(__file__).parent / 'filter_rules.json'
+DEFAULT_CONFIDENCE = {
+    'automated_sender': 0.9,
+    'domain': 0.8,
+    'subject': 0.7,
+    'body': 0.6,
+    'short_body': 0.5,
+    'recipients': 0.6,
+    'labels': 0.7,
+    'notification_sender': 0.9,
+    'auto_submitted': 0.9,
+    'precedence': 0.9,
+    'list_unsubscribe': 0.85,
+    'esp': 0.8,
+}
+PATTERN_KEYS = ('automated_patterns', 'subject_filter_patterns', 'body_filter_patterns')
+LIST_KEYS = PATTERN_KEYS + ('filter_domains', 'notification_senders', 'filter_labels')
+# May be left out of the config; no rule matches on newsletter_patterns
+OPTIONAL_PATTERN_KEYS = ('newsletter_patterns',)
+
+logger = logging.getLogger(__name__)
+
+
+def _is_number(value: Any) -> bool:
+    # JSON true/false load as bool, a subclass of int
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class Ruleset:
+    """Compiled, read-only filter rules from one version of the rules config"""
+
+    def __init__(self, config: Dict[str, Any], version: str):
+        """
+        Args:
+            config: Parsed rules config (see filter_rules.json)
+            version: Identifies this config; stamped on every FilterResult it decides
+
+        Raises:
+            ValueError: For a missing list, a non-string entry, a pattern that does not
+                compile, or a max_recipients or confidence value of the wrong type
+        """
+        self.version = version
+        for key in LIST_KEYS + OPTIONAL_PATTERN_KEYS:
+            values = config.get(key, [] if key in OPTIONAL_PATTERN_KEYS else None)
+            if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+                raise ValueError(f"Rules config: '{key}' must be a list of strings")
+        for key in PATTERN_KEYS + OPTIONAL_PATTERN_KEYS:
+            for pattern in config.get(key, []):
+                try:
+                    re.compile(pattern)
+                except re.error as e:
+                    raise ValueError(f"Rules config: bad pattern {pattern!r} in '{key}': {e}") from None
+        max_recipients = config.get('max_recipients', 10)
+        if not isinstance(max_recipients, int) or isinstance(max_recipients, bool):
+            raise ValueError("Rules config: 'max_recipients' must be an integer")
+        confidence = config.get('confidence', {})
+        if not isinstance(confidence, dict) or not all(_is_number(v) for v in confidence.values()):
+            raise ValueError("Rules config: 'confidence' must be an object of numbers")
+        confidence = dict(DEFAULT_CONFIDENCE, **confidence)
+
+        self.newsletter_patterns = tuple(config.get('newsletter_patterns', []))
+        self.automated_patterns = tuple(config['automated_patterns'])
+        self.subject_filter_patterns = tuple(config['subject_filter_patterns'])
+        self.body_filter_patterns = tuple(config['body_filter_patterns'])
+        self.filter_domains = frozenset(d.lower() for d in config['filter_domains'])
+        # Matched against the whole lower-cased From header
+        self.notification_senders = frozenset(s.lower() for s in config['notification_senders'])
+        self.filter_labels = tuple(config['filter_labels'])
+        self.max_recipients = max_recipients
+
+        # Per-field pattern sets: one literal prefilter pass instead of a search per regex
+        self.automated_matcher = PatternSet(self.automated_patterns)
+        self.subject_matcher = PatternSet(self.subject_filter_patterns)
+        self.body_matcher = PatternSet(self.body_filter_patterns)
+
+        # Rule table: rule_id -> (reason, confidence). Rules whose reason names a detail
+        # of the email (domain, count, labels, sender, header) store the prefix; see
+        # EmailFilter.describe().
+        rules: List[Tuple[str, float]] = [('No filtering criteria matched', 0.0)]
+
+        def add(reasons: List[str], key: Optional[str]) -> int:
+            first = len(rules)
+            rules.extend((reason, float(confidence[key]) if key else 0.0) for reason in reasons)
+            return first
+
+        self.automated_rule = add([f"Automated sender pattern: {p}" for p in self.automated_patterns], 'automated_sender')
+        self.domain_rule = add(['Known email marketing domain'], 'domain')
+        self.subject_rule = add([f"Subject filter pattern: {p}" for p in self.subject_filter_patterns], 'subject')
+        self.body_rule = add([f"Body filter pattern: {p}" for p in self.body_filter_patterns], 'body')
+        self.short_body_rule = add(['Very short or empty body content'], 'short_body')
+        self.recipients_rule = add(['High recipient count'], 'recipients')
+        self.labels_rule = add(['Gmail category indicates automated content'], 'labels')
+        self.notification_sender_rule = add(['Known notification sender'], 'notification_sender')
+        # Confidence of a classifier decision is the email's score
+        self.classifier_rule = add(['Newsletter classifier score'], None)
+        # Bulk-mail headers (email['headers'], see gmail_payload.bulk_headers)
+        self.auto_submitted_rule = add(['Auto-Submitted header'], 'auto_submitted')
+        self.precedence_rule = add(['Precedence header'], 'precedence')
+        self.list_unsubscribe_rule = add(['List-Unsubscribe header'], 'list_unsubscribe')
+        self.esp_rule = add(['Email service provider header'], 'esp')
+        self.header_rules = (self.auto_submitted_rule, self.precedence_rule, self.list_unsubscribe_rule,
+                             self.esp_rule)
+        self.rules = tuple(rules)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, source: str = 'rules config') -> 'Ruleset':
+        """Parse and compile a JSON rules config; the version is its 'version' plus a content hash"""
+        try:
+            config = json.loads(data)
+        except ValueError as e:
+            raise ValueError(f"{source}: invalid JSON: {e}") from None
+        if not isinstance(config, dict):
+            raise ValueError(f"{source}: expected a JSON object")
+        digest = hashlib.sha256(data).hexdigest()[:10]
+        return cls(config, f"{config.get('version', 0)}@{digest}")
+
+
+_rulesets: Dict[Tuple[str, int, int], Ruleset] = {}
+_rulesets_lock = threading.Lock()
+
+
+def rules_file_key(path: Union[str, Path]) -> Tuple[str, int, int]:
+    """(path, mtime, size) of a rules file; changes whenever the file is replaced or edited"""
+    stat = Path(path).stat()
+    return str(Path(path).resolve()), stat.st_mtime_ns, stat.st_size
+
+
+def load_ruleset(path: Union[str, Path] = RULES_FILE) -> Ruleset:
+    """
+    The Ruleset of a rules file, compiled once per file version and shared in the process
+
+    Raises:
+        OSError: If the file cannot be read
+        ValueError: If the file is not a valid rules config
+    """
+    key = rules_file_key(path)
+    with _rulesets_lock:
+        ruleset = _rulesets.get(key)
+        if ruleset is None:
+            ruleset = Ruleset.from_bytes(Path(path).read_bytes(), str(path))
+            # Only the newest version of each file stays cached
+            for old in [k for k in _rulesets if k[0] == key[0]]:
+                del _rulesets[old]
+            _rulesets[key] = ruleset
+            logger.info(f"Loaded filter rules {ruleset.version} from {path}")
+    return ruleset
@@ -0,0 +1,336 @@
+"""
+Shared Gmail fetch engine used by the export scripts.
+Groups messages.get / threads.get calls into Gmail HTTP batch requests and runs the batches on a
+bounded thread pool. A token bucket keeps the run under the per-user Gmail quota,
+and 429/5xx responses and transport errors (no HTTP status) are retried with jittered
+exponential backoff.
+
+Options (environment variables read by FetchEngine.from_env):
+  GMAIL_BATCH_SIZE           messages per batch request (0 = one request per message)
+  GMAIL_FETCH_WORKERS        concurrent batch requests
+  GMAIL_QUOTA_UNITS_PER_SEC  quota budget in Gmail quota units per second
+"""
+
+import contextlib
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import httplib2
+from googleapiclient.http import BatchHttpRequest
+
+BATCH_SIZE = 50  # Gmail accepts up to 100 per batch but recommends <= 50 to avoid rate limiting
+MAX_BATCH_SIZE = 100  # Hard per-batch limit of the Gmail API
+DEFAULT_WORKERS = 4
+DEFAULT_QUOTA_UNITS_PER_SECOND = 250  # Gmail per-user limit (15,000 units per minute)
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 32.0
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Quota cost of each Gmail API method (https://developers.google.com/gmail/api/reference/quota)
+QUOTA_UNITS = {
+    "messages.list": 5,
+    "messages.get": 5,
+    "threads.list": 10,
+    "threads.get": 10,
+    "history.list": 2,
+    "getProfile": 1,
+}
+
+
+class TokenBucket:
+    """Thread-safe token bucket: refills at `rate` units per second up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, units=1):
+        """Block until `units` tokens can be taken.
+
+        Requests larger than the bucket wait for a full bucket and then go into
+        debt, so one oversized batch cannot stall forever.
+        """
+        while True:
+            with self._lock:
+                if self.rate <= 0:
+                    return
+                needed = min(float(units), self.capacity)
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= needed:
+                    self._tokens -= units
+                    return
+                wait = (needed - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def set_rate(self, rate):
+        """Change the refill rate (and capacity) in place, e.g. to rebalance a shared quota."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.rate = float(rate)
+            self.capacity = self.rate
+            self._tokens = min(self._tokens, self.capacity)
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _error_status(exception):
+    """HTTP status of a googleapiclient HttpError (None for other errors)."""
+    resp = getattr(exception, "resp", None)
+    status = getattr(resp, "status", None)
+    return int(status) if status is not None else None
+
+
+def _is_transport_error(exception):
+    """Network failure with no HTTP response (socket timeout, connection reset, httplib2 errors)."""
+    return isinstance(exception, (OSError, TimeoutError, httplib2.HttpLib2Error))
+
+
+def _is_retryable(exception):
+    """429/5xx, or a transport error. Anything else without an HTTP status is a bug, not retried."""
+    status = _error_status(exception)
+    if status is None:
+        return _is_transport_error(exception)
+    return status in RETRYABLE_STATUSES
+
+
+def _raise_if_bug(exception):
+    """Re-raise an exception that is neither an HTTP error nor a transport error."""
+    if _error_status(exception) is None and not _is_transport_error(exception):
+        raise exception
+
+
+def _retry_after(exception):
+    """Seconds from a Retry-After header on an HttpError, if the server sent one."""
+    resp = getattr(exception, "resp", None)
+    try:
+        return float(resp.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, exception=None):
+    """Full-jitter exponential backoff, honouring Retry-After when present."""
+    retry_after = _retry_after(exception) if exception is not None else None
+    if retry_after is not None:
+        # A huge Retry-After (misbehaving proxy or server) must not park a worker for good
+        return min(retry_after, BACKOFF_MAX_SECONDS)
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _get_request(service, resource, item_id, fmt):
+    """users.messages.get or users.threads.get request for one ID."""
+    collection = service.users().threads() if resource == "threads" else service.users().messages()
+    return collection.get(userId="me", id=item_id, format=fmt)
+
+
+def _execute_batch(service, resource, chunk, fmt, results, failed, retry, batch_uri=None):
+    """Run one batch request and sort each response into results / failed / retry."""
+
+    def callback(request_id, response, exception):
+        if exception is None:
+            results[request_id] = response
+            failed.pop(request_id, None)
+            return
+        failed[request_id] = exception
+        if _is_retryable(exception):
+            retry.append(request_id)
+
+    if batch_uri:
+        batch = BatchHttpRequest(callback=callback, batch_uri=batch_uri)
+    else:
+        batch = service.new_batch_http_request(callback=callback)
+    for item_id in chunk:
+        batch.add(_get_request(service, resource, item_id, fmt), request_id=item_id)
+    try:
+        batch.execute()
+    except Exception as e:
+        _raise_if_bug(e)
+        # The whole batch round trip failed (network blip, 5xx on the batch endpoint):
+        # every ID in it that has no response yet is retried in the next round.
+        for item_id in chunk:
+            if item_id not in results:
+                failed[item_id] = e
+                if item_id not in retry:
+                    retry.append(item_id)
+
+
+def _execute_single(service, resource, item_id, fmt, results, failed, retry):
+    """Fetch one message/thread with its own request (used when batching is turned off)."""
+    try:
+        results[item_id] = _get_request(service, resource, item_id, fmt).execute()
+        failed.pop(item_id, None)
+    except Exception as e:
+        _raise_if_bug(e)
+        failed[item_id] = e
+        if _is_retryable(e):
+            retry.append(item_id)
+
+
+class FetchEngine:
+    """
+    Concurrent, quota-aware messages.get / threads.get runner.
+
+    service_factory is called once per worker thread to build that thread's Gmail
+    service (googleapiclient services are not thread-safe), e.g.
+    lambda: build("gmail", "v1", credentials=creds).
+
+    batch_uri overrides the batch endpoint; googleapiclient always derives it from the
+    discovery document, so it is needed when the service points at another api_endpoint
+    (e.g. fake_gmail_server.py).
+
+    slots is an optional semaphore shared between engines (e.g. one per account) that
+    caps the number of HTTP requests in flight across all of them.
+    """
+
+    def __init__(self, service_factory, workers=DEFAULT_WORKERS,
+                 quota_units_per_second=DEFAULT_QUOTA_UNITS_PER_SECOND,
+                 batch_size=BATCH_SIZE, max_retries=MAX_RETRIES, batch_uri=None, slots=None):
+        self.service_factory = service_factory
+        self.batch_uri = batch_uri
+        self.slots = slots or contextlib.nullcontext()
+        self.workers = max(1, int(workers))
+        self.batch_size = max(0, min(int(batch_size), MAX_BATCH_SIZE))
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(quota_units_per_second)
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls, service_factory):
+        """Build an engine with options taken from the GMAIL_* environment variables."""
+        return cls(
+            service_factory,
+            workers=int(os.environ.get("GMAIL_FETCH_WORKERS", DEFAULT_WORKERS)),
+            quota_units_per_second=float(
+                os.environ.get("GMAIL_QUOTA_UNITS_PER_SEC", DEFAULT_QUOTA_UNITS_PER_SECOND)
+            ),
+            batch_size=int(os.environ.get("GMAIL_BATCH_SIZE", BATCH_SIZE)),
+        )
+
+    def service(self):
+        """Gmail service owned by the calling thread."""
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = self.service_factory()
+            self._local.service = service
+        return service
+
+    def execute(self, make_request, units):
+        """
+        Execute a single API call built by make_request(service), charging `units`
+        quota units and retrying 429/5xx and transport errors with jittered backoff.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire(units)
+            try:
+                with self.slots:
+                    return make_request(self.service()).execute()
+            except Exception as e:
+                if not _is_retryable(e) or attempt == self.max_retries:
+                    raise
+                time.sleep(backoff_delay(attempt, e))
+
+    def _fetch_chunk(self, resource, chunk, fmt):
+        results = {}
+        failed = {}
+        pending = chunk
+        for attempt in range(self.max_retries + 1):
+            retry = []
+            self.bucket.acquire(QUOTA_UNITS[f"{resource}.get"] * len(pending))
+            service = self.service()
+            with self.slots:
+                if self.batch_size:
+                    _execute_batch(service, resource, pending, fmt, results, failed, retry, self.batch_uri)
+                else:
+                    for item_id in pending:
+                        _execute_single(service, resource, item_id, fmt, results, failed, retry)
+            if not retry or attempt == self.max_retries:
+                break
+            pending = retry
+            time.sleep(backoff_delay(attempt, failed.get(retry[0])))
+        return results, failed
+
+    def iter_messages(self, ids, fmt="full", progress=None, failed=None):
+        """
+        Yield messages.get(format=fmt) results in the order of ids as soon as each
+        chunk arrives. At most 2 * workers chunks are in flight, so memory stays flat
+        however many IDs there are. IDs that could not be fetched are recorded in
+        `failed` (message ID -> last exception) when a dict is passed.
+        """
+        return self._iter_resource("messages", ids, fmt, progress, failed)
+
+    def iter_threads(self, ids, fmt="full", progress=None, failed=None):
+        """Same as iter_messages, for threads.get (one result holds a whole conversation)."""
+        return self._iter_resource("threads", ids, fmt, progress, failed)
+
+    def _iter_resource(self, resource, ids, fmt, progress, failed):
+        # Each ID is fetched and yielded once; a repeated request_id would also make
+        # BatchHttpRequest.add raise and fail the whole chunk
+        ids = list(dict.fromkeys(ids))
+        chunk_size = self.batch_size or 1
+        chunks = _chunks(ids, chunk_size)
+        in_flight = deque()
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for chunk in chunks:
+                in_flight.append((chunk, pool.submit(self._fetch_chunk, resource, chunk, fmt)))
+                if len(in_flight) >= 2 * self.workers:
+                    break
+            try:
+                while in_flight:
+                    chunk, future = in_flight.popleft()
+                    next_chunk = next(chunks, None)
+                    if next_chunk is not None:
+                        in_flight.append(
+                            (next_chunk, pool.submit(self._fetch_chunk, resource, next_chunk, fmt))
+                        )
+                    chunk_results, chunk_failed = future.result()
+                    if failed is not None:
+                        failed.update(chunk_failed)
+                    done += len(chunk_results)
+                    if progress:
+                        progress(done, len(ids))
+                    for item_id in chunk:
+                        if item_id in chunk_results:
+                            yield chunk_results[item_id]
+            finally:
+                # A caller that stops early (generator closed) doesn't wait for chunks not yet started
+                for _, future in in_flight:
+                    future.cancel()
+
+    def get_messages(self, ids, fmt="full", progress=None):
+        """
+        Fetch messages.get(format=fmt) for every ID.
+
+        Returns (messages, failed): messages in the same order as ids (a repeated ID
+        once), and a dict of message ID -> last exception for IDs that could not be fetched.
+        """
+        failed = {}
+        messages = list(self.iter_messages(ids, fmt, progress, failed))
+        return messages, failed
+
+
+def progress_printer(every=100):
+    """Progress callback that prints each time another `every` messages are fetched."""
+    state = {"next": every}
+
+    def progress(done, total):
+        if done >= state["next"] or done == total:
+            print(f"  Fetched {done}/{total}...")
+            state["next"] = (done // every + 1) * every
+
+    return progress
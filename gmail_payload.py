@@ -0,0 +1,144 @@
+"""
+Header and body extraction for Gmail API message payloads, shared by the fetch scripts.
+
+get_body_from_payload walks the whole MIME tree (nested multipart/alternative,
+multipart/related inside multipart/mixed, ...) without decoding anything, picks the
+first text/plain part (else the first text/html part), and base64-decodes only that
+part. Attachment parts are skipped undecoded, and the decoded body is capped at
+GMAIL_MAX_BODY_BYTES bytes (default 1 MiB, 0 = no cap) by decoding only the base64
+prefix that is needed.
+
+bulk_headers keeps the headers that mark list, bulk and automated mail (List-Unsubscribe,
+Precedence, Auto-Submitted, ...) and those that name the email service provider that
+sent it, for EmailFilter's constant-time header checks.
+"""
+
+import base64
+import codecs
+import os
+
+MAX_BODY_BYTES = int(os.environ.get("GMAIL_MAX_BODY_BYTES", 1024 * 1024))
+DECODE_ERROR_BODY = "[Could not decode body]"
+
+# Standard list/bulk/automation headers (RFC 2369, RFC 8058, RFC 2076, RFC 3834)
+LIST_HEADERS = ["List-Unsubscribe", "List-Unsubscribe-Post", "List-Id", "Precedence", "Auto-Submitted"]
+# Headers that only a bulk email service provider adds, and the provider they name
+ESP_HEADERS = {
+    "X-Mailgun-Sid": "Mailgun",
+    "X-SG-EID": "SendGrid",
+    "X-SES-Outgoing": "Amazon SES",
+    "X-MC-User": "Mailchimp",
+    "X-Mandrill-User": "Mandrill",
+    "X-PM-Message-Id": "Postmark",
+    "X-Campaign-Id": "Campaign Monitor",
+    "X-Mailjet-Campaign": "Mailjet",
+    "X-Sib-Id": "Brevo",
+    "X-HubSpot-Message-Id": "HubSpot",
+    "X-Marketo-Id": "Marketo",
+    "X-CSA-Complaints": "Certified Senders Alliance member",
+}
+BULK_HEADERS = LIST_HEADERS + list(ESP_HEADERS)
+
+
+def header_value(headers, name):
+    """Get a header value by name (case-insensitive)."""
+    name = name.lower()
+    for h in headers or []:
+        if h.get("name", "").lower() == name:
+            return h.get("value", "")
+    return ""
+
+
+def bulk_headers(headers):
+    """
+    The BULK_HEADERS present in a payload's header list, as {canonical name: value}.
+    Names are matched case-insensitively; the first occurrence of a header wins.
+    """
+    wanted = {name.lower(): name for name in BULK_HEADERS}
+    found = {}
+    for h in headers or []:
+        name = wanted.get(h.get("name", "").lower())
+        if name and name not in found:
+            found[name] = h.get("value", "")
+    return found
+
+
+def is_attachment(part):
+    """True for parts that are files rather than message text (checked without decoding)."""
+    if part.get("filename") or part.get("body", {}).get("attachmentId"):
+        return True
+    disposition = header_value(part.get("headers"), "Content-Disposition")
+    return disposition.strip().lower().startswith("attachment")
+
+
+def iter_text_parts(payload):
+    """
+    Depth-first search of the MIME tree for body parts to show, best first.
+    Yields the inline text/plain parts in document order, then the inline text/html parts.
+    """
+    html = []
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        children = part.get("parts")
+        if children:
+            # Reversed so parts are visited in document order
+            stack.extend(reversed(children))
+            continue
+        if not part.get("body", {}).get("data") or is_attachment(part):
+            continue
+        mime = (part.get("mimeType") or "").lower()
+        if mime == "text/plain":
+            yield part
+        elif mime == "text/html":
+            html.append(part)
+    yield from html
+
+
+def find_text_part(payload):
+    """The first inline text/plain part, else the first inline text/html part, else None."""
+    return next(iter_text_parts(payload), None)
+
+
+def decode_body_data(data, max_bytes=MAX_BODY_BYTES):
+    """
+    Decode base64url body data as UTF-8, decoding at most max_bytes bytes (0 = all).
+    A multi-byte character cut by the cap is dropped rather than replaced.
+    """
+    truncated = False
+    if max_bytes and len(data) > (max_bytes + 2) // 3 * 4:
+        # Every 4 base64 characters hold 3 bytes
+        data = data[:(max_bytes + 2) // 3 * 4]
+        truncated = True
+    raw = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    if truncated:
+        raw = raw[:max_bytes]
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    return decoder.decode(raw, final=not truncated)
+
+
+def get_body_from_payload(payload, max_bytes=MAX_BODY_BYTES):
+    """
+    Extract plain text (or HTML) body from Gmail API message payload.
+    Handles single-part (payload.body) and arbitrarily nested multipart (payload.parts) messages.
+    """
+    if not payload:
+        return ""
+
+    # Single-part: body is in payload.body
+    data = payload.get("body", {}).get("data")
+    if data and not payload.get("parts"):
+        try:
+            return decode_body_data(data, max_bytes)
+        except Exception:
+            return DECODE_ERROR_BODY
+
+    # A part that fails to decode falls through to the next candidate
+    found = False
+    for part in iter_text_parts(payload):
+        found = True
+        try:
+            return decode_body_data(part["body"]["data"], max_bytes)
+        except Exception:
+            continue
+    return DECODE_ERROR_BODY if found else ""
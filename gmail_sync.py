@@ -0,0 +1,153 @@
+"""
+Incremental mailbox sync for the export scripts.
+Stores the mailbox historyId next to each token file and uses history.list to pick
+up only the messages added or deleted since the previous run. When the stored
+historyId is too old for Gmail to answer (HTTP 404), callers fall back to a full list.
+"""
+
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+
+from gmail_fetch import QUOTA_UNITS
+
+CHECKPOINT_SUFFIX = ".sync.json"
+HISTORY_PAGE_SIZE = 500  # Gmail API max for history.list
+HISTORY_TYPES = ["messageAdded", "messageDeleted", "labelAdded", "labelRemoved"]
+# Messages carrying these labels are left out of messages.list, so treat them as deleted
+HIDDEN_LABELS = {"SPAM", "TRASH"}
+
+
+class HistoryExpired(Exception):
+    """The stored historyId is older than the history Gmail keeps (history.list 404)."""
+
+
+def checkpoint_path(token_file):
+    """Checkpoint file for a token file: token_remote.json -> token_remote.sync.json."""
+    token_file = Path(token_file)
+    return token_file.with_name(token_file.stem + CHECKPOINT_SUFFIX)
+
+
+def load_checkpoint(token_file):
+    """Return the saved checkpoint dict ({"historyId", "updated"}) or None."""
+    path = checkpoint_path(token_file)
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return checkpoint if checkpoint.get("historyId") else None
+
+
+def save_checkpoint(token_file, history_id):
+    path = checkpoint_path(token_file)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"historyId": str(history_id), "updated": datetime.now(timezone.utc).isoformat()},
+            f,
+            indent=2,
+        )
+    tmp_path.replace(path)
+
+
+def _execute(engine, request, units):
+    if engine:
+        return engine.execute(lambda _: request, units)
+    return request.execute()
+
+
+def current_history_id(service, engine=None):
+    """Mailbox historyId right now (take it *before* a full list so nothing is missed)."""
+    profile = _execute(engine, service.users().getProfile(userId="me"), QUOTA_UNITS["getProfile"])
+    return profile["historyId"]
+
+
+def list_history_changes(service, start_history_id, engine=None):
+    """
+    Walk history.list from start_history_id.
+
+    Returns (added_ids, deleted_ids, latest_history_id). A message added and then
+    deleted inside the window only appears in deleted_ids. Raises HistoryExpired when
+    Gmail no longer has history that far back.
+    """
+    added = {}
+    deleted = set()
+    latest_history_id = start_history_id
+    page_token = None
+    while True:
+        request = service.users().history().list(
+            userId="me",
+            startHistoryId=start_history_id,
+            historyTypes=HISTORY_TYPES,
+            maxResults=HISTORY_PAGE_SIZE,
+            pageToken=page_token,
+        )
+        try:
+            result = _execute(engine, request, QUOTA_UNITS["history.list"])
+        except Exception as e:
+            if getattr(getattr(e, "resp", None), "status", None) == 404:
+                raise HistoryExpired(start_history_id) from e
+            raise
+
+        for record in result.get("history", []):
+            for item in record.get("messagesAdded", []):
+                msg = item.get("message", {})
+                if HIDDEN_LABELS.intersection(msg.get("labelIds", [])):
+                    continue
+                added[msg["id"]] = True
+                deleted.discard(msg["id"])
+            for item in record.get("messagesDeleted", []):
+                msg_id = item.get("message", {}).get("id")
+                added.pop(msg_id, None)
+                deleted.add(msg_id)
+            for item in record.get("labelsAdded", []):
+                if HIDDEN_LABELS.intersection(item.get("labelIds", [])):
+                    msg_id = item.get("message", {}).get("id")
+                    added.pop(msg_id, None)
+                    deleted.add(msg_id)
+            for item in record.get("labelsRemoved", []):
+                msg = item.get("message", {})
+                if (HIDDEN_LABELS.intersection(item.get("labelIds", []))
+                        and not HIDDEN_LABELS.intersection(msg.get("labelIds", []))):
+                    added[msg["id"]] = True
+                    deleted.discard(msg["id"])
+
+        latest_history_id = result.get("historyId", latest_history_id)
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            break
+
+    deleted.discard(None)
+    return list(added), deleted, latest_history_id
+
+
+def merge_records(existing, new_records, deleted_ids, limit=None):
+    """
+    Apply a history delta to a list of exported records: drop deleted IDs, replace or
+    add new records, keep newest first (by internalDate) and trim to `limit`.
+    """
+    by_id = {r.get("id"): r for r in existing if r.get("id") not in deleted_ids}
+    for record in new_records:
+        by_id[record.get("id")] = record
+    merged = sorted(by_id.values(), key=lambda r: int(r.get("internalDate") or 0), reverse=True)
+    return merged[:limit] if limit else merged
+
+
+def group_by_thread(records, limit=None):
+    """
+    Reorder newest-first records into the GMAIL_BY_THREAD layout: whole threads, most
+    recently active first, with the messages of each thread oldest first. With a limit,
+    whole threads are kept until at least `limit` records are covered.
+    """
+    threads = {}
+    for record in records:
+        threads.setdefault(record.get("threadId") or record.get("id"), []).append(record)
+    grouped = []
+    for thread in threads.values():
+        if limit and len(grouped) >= limit:
+            break
+        grouped.extend(sorted(thread, key=lambda r: int(r.get("internalDate") or 0)))
+    return grouped
@@ -0,0 +1,86 @@
+"""
+Async LLM execution for EmailProcessor.aprocess_emails: bounded in-flight requests and
+a per-provider request rate limit.
+
+A client implements either
+- async agenerate(prompt) -> str  (native async SDKs, e.g. openai.AsyncOpenAI)
+- generate(prompt) -> str         (sync clients; run on a thread pool of max_concurrency threads)
+and may set a `provider` attribute (default: the class name) that selects its rate limit.
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+DEFAULT_MAX_CONCURRENCY = 8
+
+
+class AsyncRateLimiter:
+    """Token bucket for coroutines: `rate` requests per second, bursts of up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a request may be sent"""
+        if self.rate <= 0:
+            return
+        # Waiters queue on the lock, so requests go out in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def provider_of(client) -> str:
+    """Rate-limit key of an LLM client"""
+    return getattr(client, 'provider', None) or type(client).__name__
+
+
+class LLMExecutor:
+    """Runs LLM calls for one event loop under a concurrency cap and the client's provider rate limit"""
+
+    def __init__(self, client, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 rate_limits: Optional[Dict[str, float]] = None):
+        """
+        Args:
+            client: LLM client with agenerate() or generate()
+            max_concurrency: Most requests in flight at once
+            rate_limits: Requests per second by provider name (see provider_of); unlisted
+                providers are not rate limited
+        """
+        self.client = client
+        self.max_concurrency = max(1, max_concurrency)
+        self.provider = provider_of(client)
+        rate = (rate_limits or {}).get(self.provider)
+        self.rate_limiter = AsyncRateLimiter(rate) if rate else None
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self.calls = 0
+
+    async def generate(self, prompt: str) -> str:
+        async with self._semaphore:
+            if self.rate_limiter:
+                await self.rate_limiter.acquire()
+            self.calls += 1
+            agenerate = getattr(self.client, 'agenerate', None)
+            if agenerate is not None:
+                return await agenerate(prompt)
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.max_concurrency, thread_name_prefix='llm')
+            return await asyncio.get_running_loop().run_in_executor(self._pool, self.client.generate, prompt)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
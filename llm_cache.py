@@ -0,0 +1,213 @@
+"""
+Content-addressed cache of LLM responses for EmailProcessor.
+
+A response is keyed by the SHA-256 of the model ID, the prompt template version
+(LLMPromptTemplates.VERSION) and the rendered prompt, so a re-run over an overlapping
+mailbox only pays for prompts it has not seen. Two tiers:
+- an in-process LRU of the most recently used responses
+- an optional SQLite file that persists across runs, evicted by age (ttl_seconds)
+  and, least recently used first, by total entries and bytes
+Responses older than ttl_seconds are misses in both tiers.
+
+EmailProcessor only stores responses that parse as a JSON object without an 'error'
+key, so failed or truncated calls are retried on the next run.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+DEFAULT_MEMORY_ENTRIES = 1024
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+EVICT_EVERY = 64  # Check the disk tier's limits every N stores
+ACCESS_FLUSH_EVERY = 256  # Write disk hits' access times every N hits (and on store, evict and close)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed);
+'''
+
+
+def cache_key(prompt: str, model_id: str, template_version: str) -> str:
+    """Content address of a prompt for one model and template version"""
+    digest = hashlib.sha256()
+    for part in (model_id, template_version, prompt):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class LLMCache:
+    """Two-tier (memory LRU + SQLite) LLM response cache with hit/miss counters"""
+
+    def __init__(self, path: Optional[Union[str, Path]] = None, memory_entries: int = DEFAULT_MEMORY_ENTRIES,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES,
+                 ttl_seconds: Optional[float] = DEFAULT_TTL_SECONDS):
+        """
+        Args:
+            path: SQLite file of the persistent tier (None = memory only)
+            memory_entries: Size of the in-process LRU (0 = disk only)
+            max_entries: Most responses kept on disk
+            max_bytes: Most response bytes kept on disk
+            ttl_seconds: Responses older than this are dropped (None = never)
+        """
+        self.path = Path(path) if path is not None else None
+        self.memory_entries = max(0, memory_entries)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._memory: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()  # key -> (response, created)
+        self._accessed: Dict[str, float] = {}  # Disk hits whose access time is not written yet
+        self._lock = threading.Lock()
+        self._db = None
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._db.executescript(SCHEMA)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        if self._db is not None:
+            self.evict()
+
+    def get(self, key: str) -> Optional[str]:
+        """The cached response for key, or None"""
+        with self._lock:
+            now = time.time()
+            entry = self._memory.get(key)
+            if entry is not None:
+                if self._fresh(entry[1], now):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[0]
+                del self._memory[key]
+            if self._db is not None:
+                row = self._db.execute('SELECT response, created FROM responses WHERE key = ?', (key,)).fetchone()
+                if row and self._fresh(row[1], now):
+                    # Access times only order LRU eviction, so they are written in batches
+                    self._accessed[key] = now
+                    if len(self._accessed) >= ACCESS_FLUSH_EVERY:
+                        self._flush_accessed()
+                        self._db.commit()
+                    self._remember(key, row[0], row[1])
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def _fresh(self, created: float, now: float) -> bool:
+        return self.ttl_seconds is None or now - created <= self.ttl_seconds
+
+    def _flush_accessed(self):
+        """Write pending access times (caller holds the lock and commits)"""
+        if self._accessed:
+            self._db.executemany('UPDATE responses SET accessed = ? WHERE key = ?',
+                                 [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed.clear()
+
+    def put(self, key: str, response: str):
+        with self._lock:
+            now = time.time()
+            self._remember(key, response, now)
+            self.stores += 1
+            if self._db is not None:
+                self._accessed.pop(key, None)
+                self._flush_accessed()
+                self._db.execute(
+                    'INSERT OR REPLACE INTO responses (key, response, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                    (key, response, len(response.encode('utf-8')), now, now)
+                )
+                self._db.commit()
+        if self._db is not None and self.stores % EVICT_EVERY == 0:
+            self.evict()
+
+    def _remember(self, key: str, response: str, created: float):
+        if not self.memory_entries:
+            return
+        self._memory[key] = (response, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def evict(self) -> int:
+        """Drop expired responses, then least recently used ones over the limits; returns the count"""
+        if self._db is None:
+            return 0
+        with self._lock:
+            self._flush_accessed()
+            removed = 0
+            if self.ttl_seconds is not None:
+                removed += self._db.execute(
+                    'DELETE FROM responses WHERE created < ?', (time.time() - self.ttl_seconds,)
+                ).rowcount
+            entries, total = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+            if entries > self.max_entries or total > self.max_bytes:
+                drop = max(entries - self.max_entries, 0)
+                excess = total - self.max_bytes
+                for key, size in self._db.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall():
+                    if drop <= 0 and excess <= 0:
+                        break
+                    self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                    self._memory.pop(key, None)
+                    drop -= 1
+                    excess -= size
+                    removed += 1
+            self._db.commit()
+            self.evictions += removed
+            return removed
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._accessed.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM responses')
+                self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            if self._db is not None:
+                return self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            return len(self._memory)
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters since the cache was opened"""
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'entries': len(self),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._flush_accessed()
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -4,9 +4,35 @@ LLM prompt templates for extracting relationships, expertise, and interactions f
 
 from typing import Dict, List, Any
 import json
+import re
+
+# Transcript budget of the thread-level prompt
+THREAD_MESSAGE_CHARS = 1500
+THREAD_TRANSCRIPT_CHARS = 12000
+
+_QUOTE_HEADER = re.compile(r'^(On .{0,200}wrote:|-+ ?Original Message ?-+|From: .+\nSent: .+)\s*$', re.MULTILINE)
+_HTML_TAG = re.compile(r'<(style|script)[^>]*>.*?</\1>|<[^>]+>', re.DOTALL | re.IGNORECASE)
+
+def compact_body(body: str, max_chars: int = THREAD_MESSAGE_CHARS) -> str:
+    """
+    The new text of a message: HTML tags, quoted replies and extra whitespace removed,
+    cut to max_chars
+    """
+    if '<' in body and '>' in body:
+        body = _HTML_TAG.sub(' ', body)
+    match = _QUOTE_HEADER.search(body)
+    if match:
+        body = body[:match.start()]
+    lines = [line for line in body.splitlines() if not line.lstrip().startswith('>')]
+    text = ' '.join(' '.join(lines).split())
+    return text if len(text) <= max_chars else text[:max_chars].rsplit(' ', 1)[0] + ' [...]'
+
 
 class LLMPromptTemplates:
     
+    # Part of the LLM response cache key; bump when a template's output format changes
+    VERSION = '1'
+    
     @staticmethod
     def extract_people_and_companies(email_content: Dict) -> str:
         """
@@ -168,6 +194,107 @@ Guidelines:
 3. Consider both explicit statements and implied expertise
 4. Only assign expertise with confidence > 0.6
 5. Focus on professional/business expertise, not general knowledge
+"""
+
+    @staticmethod
+    def extract_email_analysis(email_content: Dict, known_people: List[Dict] = None) -> str:
+        """
+        Extract people, companies, interaction summary, expertise and participant roles
+        in one response (replaces the four separate per-email prompts)
+        """
+        known_context = ""
+        if known_people:
+            known_context = "\n\nPEOPLE ALREADY IDENTIFIED IN THIS THREAD:\n" + "\n".join([
+                f"- {p.get('name', '')} ({p.get('email', '')})" for p in known_people
+            ])
+        
+        return f"""
+You are an expert at analyzing business emails to identify the people and companies involved, the interaction itself, the expertise demonstrated and each participant's role.
+
+Analyze the following email:
+
+EMAIL DETAILS:
+From: {email_content.get('From', '')}
+To: {email_content.get('To', '')}
+Cc: {email_content.get('Cc', '')}
+Subject: {email_content.get('Subject', '')}
+Date: {email_content.get('Date', '')}
+
+EMAIL BODY:
+{email_content.get('body', '')}{known_context}
+
+Please provide the complete analysis as a single JSON object:
+
+{{
+    "people": [
+        {{
+            "name": "Full name of person",
+            "email": "email address if available",
+            "role": "job title or role if mentioned",
+            "company": "company they work for if mentioned",
+            "confidence": 0.9,
+            "context": "brief context of how they were mentioned"
+        }}
+    ],
+    "companies": [
+        {{
+            "name": "Company name",
+            "domain": "company domain if inferable from email",
+            "confidence": 0.8,
+            "context": "brief context of how company was mentioned"
+        }}
+    ],
+    "interaction": {{
+        "interaction_summary": "Concise summary of what this email is about (1-2 sentences)",
+        "key_topics": [
+            {{
+                "topic": "main topic discussed",
+                "importance": "high/medium/low",
+                "context": "brief context of how this topic was discussed"
+            }}
+        ],
+        "interaction_type": "email/meeting/call/decision/inquiry/update/other",
+        "action_items": [
+            {{
+                "action": "description of action item",
+                "assigned_to": "person responsible if mentioned",
+                "deadline": "deadline if mentioned"
+            }}
+        ],
+        "business_context": "brief description of the business context (hiring, sales, partnership, etc.)",
+        "sentiment": "positive/neutral/negative",
+        "urgency": "high/medium/low"
+    }},
+    "expertise_instances": [
+        {{
+            "person_name": "name of person demonstrating expertise",
+            "expertise_area": "hiring/growth/strategy/technology/marketing/finance/operations/sales/product/leadership",
+            "confidence": 0.8,
+            "evidence": "specific text or behavior that demonstrates this expertise",
+            "context": "how this expertise was applied in the interaction"
+        }}
+    ],
+    "participant_roles": [
+        {{
+            "person_name": "name of person",
+            "role_in_interaction": "sender/recipient/expert/requester/decision_maker/informed/cc/bcc",
+            "is_expert": true/false,
+            "expertise_area": "area of expertise if they are the expert",
+            "contribution": "brief description of their contribution to the interaction",
+            "influence_level": "high/medium/low",
+            "confidence": 0.9
+        }}
+    ]
+}}
+
+Guidelines:
+1. People: include the sender, all recipients and people mentioned in the body; only confidence > 0.5
+2. Companies: extract from email domains and mentions in the text; only confidence > 0.5
+3. Interaction: focus on business-relevant content, concrete action items, urgency and sentiment
+4. Expertise: people providing advice, insights or guidance; only confidence > 0.6
+5. Roles: who drives the conversation, requests, decides or is only informed; only confidence > 0.7
+6. Use the same person names across people, expertise_instances and participant_roles
+7. Return empty lists for sections with nothing to report
 """
 
     @staticmethod
@@ -281,6 +408,118 @@ Guidelines:
 3. Assess each person's influence on the outcome
 4. Consider both explicit and implicit roles
 5. Only assign roles with confidence > 0.7
+"""
+
+    @staticmethod
+    def extract_thread_analysis(thread_emails: List[Dict], participants: List[Dict],
+                                max_message_chars: int = THREAD_MESSAGE_CHARS,
+                                max_chars: int = THREAD_TRANSCRIPT_CHARS) -> str:
+        """
+        Extract people, companies, expertise, participant roles and per-message summaries
+        once for a whole thread, from a compacted transcript (quotes stripped, messages cut
+        to max_message_chars; middle messages dropped to stay within max_chars)
+        """
+        messages = [
+            f"MESSAGE {i}:\nFrom: {email.get('From', '')}\nTo: {email.get('To', '')}\nCc: {email.get('Cc', '')}\n"
+            f"Date: {email.get('Date', '')}\n{compact_body(email.get('body', ''), max_message_chars)}"
+            for i, email in enumerate(thread_emails, 1)
+        ]
+        # Keep the opening message and as many of the latest as fit
+        kept = messages[-1:]
+        for message in reversed(messages[1:-1]):
+            if len(messages[0]) + sum(len(m) for m in kept) + len(message) > max_chars:
+                break
+            kept.insert(0, message)
+        if len(messages) > 1:
+            omitted = len(messages) - 1 - len(kept)
+            kept.insert(0, messages[0] + (f"\n\n[{omitted} messages omitted]" if omitted else ''))
+        transcript = "\n\n".join(kept)
+        participants_list = "\n".join([f"- {p.get('name', '')} ({p.get('email', '')})" for p in participants])
+        
+        return f"""
+You are an expert at analyzing business email threads to identify the people and companies involved, the expertise demonstrated and each participant's role.
+
+Analyze the following email thread (quoted replies removed, long messages shortened):
+
+SUBJECT: {thread_emails[0].get('Subject', '') if thread_emails else ''}
+
+PARTICIPANTS (from the email headers):
+{participants_list}
+
+EMAIL THREAD:
+{transcript}
+
+Please provide the analysis of the whole thread as a single JSON object:
+
+{{
+    "people": [
+        {{
+            "name": "Full name of person",
+            "email": "email address if available",
+            "role": "job title or role if mentioned",
+            "company": "company they work for if mentioned",
+            "confidence": 0.9,
+            "context": "brief context of how they were mentioned"
+        }}
+    ],
+    "companies": [
+        {{
+            "name": "Company name",
+            "domain": "company domain if inferable from email",
+            "confidence": 0.8,
+            "context": "brief context of how company was mentioned"
+        }}
+    ],
+    "message_summaries": [
+        {{
+            "message": 1,
+            "summary": "what this message says (1 sentence)",
+            "interaction_type": "email/meeting/call/decision/inquiry/update/other"
+        }}
+    ],
+    "expertise_instances": [
+        {{
+            "person_name": "name of person demonstrating expertise",
+            "expertise_area": "hiring/growth/strategy/technology/marketing/finance/operations/sales/product/leadership",
+            "confidence": 0.8,
+            "evidence": "specific text or behavior that demonstrates this expertise",
+            "context": "how this expertise was applied in the thread"
+        }}
+    ],
+    "participant_roles": [
+        {{
+            "person_name": "name of person",
+            "role_in_interaction": "sender/recipient/expert/requester/decision_maker/informed/cc/bcc",
+            "is_expert": true/false,
+            "expertise_area": "area of expertise if they are the expert",
+            "contribution": "brief description of their contribution to the thread",
+            "influence_level": "high/medium/low",
+            "confidence": 0.9
+        }}
+    ],
+    "thread_summary": "Comprehensive summary of the entire thread (2-3 sentences)",
+    "key_topics": [
+        {{
+            "topic": "main topic",
+            "resolution": "how the topic was resolved or current status"
+        }}
+    ],
+    "action_items": [
+        {{
+            "action": "description of action item",
+            "assigned_to": "person responsible",
+            "deadline": "deadline if mentioned"
+        }}
+    ]
+}}
+
+Guidelines:
+1. People: include every participant plus people mentioned in the messages; only confidence > 0.5
+2. Companies: extract from email domains and mentions in the text; only confidence > 0.5
+3. Message summaries: one entry per message shown, numbered as in the transcript
+4. Expertise: people providing advice, insights or guidance anywhere in the thread; only confidence > 0.6
+5. Roles: one entry per person for the thread as a whole; only confidence > 0.7
+6. Use the same person names across people, expertise_instances and participant_roles
 """
 
     @staticmethod
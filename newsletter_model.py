@@ -0,0 +1,293 @@
+"""
+Trainable newsletter classifier used as an optional EmailFilter stage.
+
+Each email becomes a set of hashed token features from four fields: the From header,
+the subject, a body window (the first and last few KB, where unsubscribe footers and
+"view in browser" banners live) and the Gmail labels. A token is a run of ASCII
+letters/digits or non-ASCII bytes of the lower-cased UTF-8 text, and its feature is a
+hash of (field, token) modulo n_features, so there is no vocabulary to store.
+Tokenizing and hashing run in NumPy over a whole batch at once.
+
+The model is multinomial naive Bayes over binary features, calibrated to probabilities
+with Platt scaling, which makes it one linear layer: weights per feature plus a bias.
+It is trained on labelled history: records with a _filter_reason (written by
+EmailFilter.filter_emails) count as newsletters, other records as mail to keep, and
+an explicit _label ('filter'/'keep' or True/False) overrides that, e.g. for records
+a person has corrected. Models are saved as uncompressed .npz files.
+
+  python newsletter_model.py train history.json --out newsletter_model.npz
+  python newsletter_model.py evaluate newsletter_model.npz held_out.ndjson.gz
+"""
+
+import argparse
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+DEFAULT_N_FEATURES = 1 << 18
+DEFAULT_FILTER_THRESHOLD = 0.95
+DEFAULT_KEEP_THRESHOLD = 0.05
+BODY_HEAD_CHARS = 2048
+BODY_TAIL_CHARS = 1024
+MODEL_FIELDS = ('From', 'Subject', 'body', 'labelIds')
+MAX_TOKEN_BYTES = 32  # Later bytes of a longer token all share the last position's multiplier
+FORMAT_VERSION = 1
+
+# Bytes that belong to a token: a-z, 0-9 and every byte of a multi-byte UTF-8 character
+_TOKEN_BYTE = np.zeros(256, dtype=bool)
+_TOKEN_BYTE[ord('a'):ord('z') + 1] = True
+_TOKEN_BYTE[ord('0'):ord('9') + 1] = True
+_TOKEN_BYTE[0x80:] = True
+_POWERS = np.array([pow(1099511628211, i, 1 << 64) for i in range(MAX_TOKEN_BYTES)], dtype=np.uint64)
+_FIELD_SALT = np.uint64(0x9E3779B97F4A7C15)
+_MIX = np.uint64(0xFF51AFD7ED558CCD)
+
+
+def _field_text(email: Dict, field: str, head: int, tail: int) -> str:
+    value = email.get(field) or ''
+    if field == 'labelIds':
+        return ' '.join(value)
+    if field == 'body' and len(value) > head + tail:
+        return value[:head] + ' ' + value[-tail:]
+    return value
+
+
+def hashed_features(emails: Sequence[Dict], n_features: int = DEFAULT_N_FEATURES,
+                    body_head_chars: int = BODY_HEAD_CHARS,
+                    body_tail_chars: int = BODY_TAIL_CHARS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Distinct (row, feature) pairs of a batch of emails
+
+    Args:
+        emails: Email dictionaries (fields in MODEL_FIELDS are read; missing ones are empty)
+        n_features: Size of the hashed feature space (a power of two)
+
+    Returns:
+        (rows, features): equal-length int64 arrays, rows indexing into emails
+    """
+    segments = [
+        _field_text(email, field, body_head_chars, body_tail_chars).lower().encode('utf-8')
+        for email in emails for field in MODEL_FIELDS
+    ]
+    # One buffer for the whole batch; the separator keeps tokens from running across fields
+    buf = np.frombuffer(b' '.join(segments) + b' ', dtype=np.uint8)
+    segment_starts = np.cumsum([0] + [len(s) + 1 for s in segments[:-1]])
+
+    in_token = _TOKEN_BYTE[buf]
+    token_bytes = np.flatnonzero(in_token)
+    if not len(token_bytes):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+    starts = np.flatnonzero(in_token & ~np.concatenate(([False], in_token[:-1])))
+    token_of_byte = np.searchsorted(starts, token_bytes, side='right') - 1
+    position = np.minimum(token_bytes - starts[token_of_byte], MAX_TOKEN_BYTES - 1)
+    products = buf[token_bytes].astype(np.uint64) * _POWERS[position]
+    first_byte = np.flatnonzero(np.diff(token_of_byte, prepend=-1))
+    hashes = np.add.reduceat(products, first_byte)
+
+    segment = np.searchsorted(segment_starts, starts, side='right') - 1
+    field = (segment % len(MODEL_FIELDS)).astype(np.uint64)
+    keys = (hashes ^ (field * _FIELD_SALT)) * _MIX
+    keys ^= keys >> np.uint64(33)
+    features = (keys & np.uint64(n_features - 1)).astype(np.int64)
+    rows = segment // len(MODEL_FIELDS)
+
+    # Binary features: each (row, feature) pair once
+    pairs = np.unique(rows * n_features + features)
+    return pairs // n_features, pairs % n_features
+
+
+def label_of(email: Dict) -> bool:
+    """Training label: True for mail to filter"""
+    label = email.get('_label')
+    if label is not None:
+        return label in (True, 1, 'filter', 'filtered', 'newsletter')
+    return bool(email.get('_filter_reason'))
+
+
+def _platt(scores: np.ndarray, labels: np.ndarray, iterations: int = 50) -> Tuple[float, float]:
+    """(a, b) such that sigmoid(a * score + b) fits labels, by Newton's method"""
+    positives = labels.sum()
+    negatives = len(labels) - positives
+    # Platt's smoothed targets keep a, b finite on separable data
+    targets = np.where(labels, (positives + 1) / (positives + 2), 1 / (negatives + 2))
+    spread = scores.std() or 1.0
+    a, b = 1.0 / spread, 0.0
+    for _ in range(iterations):
+        p = 1 / (1 + np.exp(-np.clip(a * scores + b, -50, 50)))
+        weight = np.maximum(p * (1 - p), 1e-12)
+        residual = p - targets
+        gradient = np.array([(residual * scores).sum(), residual.sum()])
+        hessian = np.array([
+            [(weight * scores * scores).sum(), (weight * scores).sum()],
+            [(weight * scores).sum(), weight.sum()]
+        ]) + np.eye(2) * 1e-9
+        step = np.linalg.solve(hessian, gradient)
+        a, b = a - step[0], b - step[1]
+        if np.abs(step).max() < 1e-9:
+            break
+    return float(a), float(b)
+
+
+class NewsletterModel:
+    """Linear model over hashed features; score() gives P(newsletter) per email"""
+
+    def __init__(self, weights: np.ndarray, bias: float,
+                 filter_threshold: float = DEFAULT_FILTER_THRESHOLD,
+                 keep_threshold: float = DEFAULT_KEEP_THRESHOLD,
+                 body_head_chars: int = BODY_HEAD_CHARS, body_tail_chars: int = BODY_TAIL_CHARS):
+        """
+        Args:
+            weights: float32 array, one weight per hashed feature (length a power of two)
+            bias: Added to every email's weight sum
+            filter_threshold: EmailFilter filters emails scoring at or above this
+            keep_threshold: EmailFilter keeps emails scoring at or below this without
+                running its subject and body patterns
+            body_head_chars: Leading body characters turned into features
+            body_tail_chars: Trailing body characters turned into features
+        """
+        n_features = len(weights)
+        if n_features & (n_features - 1):
+            raise ValueError("The number of weights must be a power of two")
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = float(bias)
+        self.filter_threshold = filter_threshold
+        self.keep_threshold = keep_threshold
+        self.body_head_chars = body_head_chars
+        self.body_tail_chars = body_tail_chars
+
+    @property
+    def n_features(self) -> int:
+        return len(self.weights)
+
+    def features(self, emails: Sequence[Dict]) -> Tuple[np.ndarray, np.ndarray]:
+        return hashed_features(emails, self.n_features, self.body_head_chars, self.body_tail_chars)
+
+    def decision_function(self, emails: Sequence[Dict]) -> np.ndarray:
+        """Log-odds of being a newsletter, one float64 per email"""
+        rows, features = self.features(emails)
+        totals = np.bincount(rows, weights=self.weights[features], minlength=len(emails))
+        return totals + self.bias
+
+    def score(self, emails: Sequence[Dict]) -> np.ndarray:
+        """Probability of being a newsletter, one float64 per email"""
+        return 1 / (1 + np.exp(-np.clip(self.decision_function(emails), -50, 50)))
+
+    @classmethod
+    def train(cls, emails: Sequence[Dict], labels: Optional[Sequence[bool]] = None,
+              n_features: int = DEFAULT_N_FEATURES, alpha: float = 1.0, **options) -> 'NewsletterModel':
+        """
+        Fit a model on labelled emails
+
+        Args:
+            emails: Training emails
+            labels: True for mail to filter; defaults to label_of(email) for each email
+            n_features: Size of the hashed feature space (a power of two)
+            alpha: Additive (Laplace) smoothing of the per-class feature counts
+            **options: Thresholds and body window sizes for the model (see __init__)
+
+        Returns:
+            The trained NewsletterModel
+        """
+        y = np.array([label_of(e) for e in emails] if labels is None else list(labels), dtype=bool)
+        if y.all() or not y.any():
+            raise ValueError("Training data needs both emails to filter and emails to keep")
+        model = cls(np.zeros(n_features, dtype=np.float32), 0.0, **options)
+        rows, features = model.features(emails)
+
+        # Naive Bayes log-likelihood ratio per feature
+        positive = y[rows]
+        counts_filter = np.bincount(features[positive], minlength=n_features) + alpha
+        counts_keep = np.bincount(features[~positive], minlength=n_features) + alpha
+        weights = np.log(counts_filter / counts_filter.sum()) - np.log(counts_keep / counts_keep.sum())
+        bias = np.log(y.sum() / (~y).sum())
+
+        # Calibrate the (over-confident) naive Bayes log-odds into probabilities
+        raw = np.bincount(rows, weights=weights[features], minlength=len(emails)) + bias
+        a, b = _platt(raw, y)
+        model.weights = (weights * a).astype(np.float32)
+        model.bias = float(bias * a + b)
+        return model
+
+    def save(self, path: Union[str, Path]) -> Path:
+        """Write the model as an uncompressed .npz file (fast to load)"""
+        path = Path(path)
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                format_version=FORMAT_VERSION,
+                weights=self.weights,
+                bias=self.bias,
+                filter_threshold=self.filter_threshold,
+                keep_threshold=self.keep_threshold,
+                body_head_chars=self.body_head_chars,
+                body_tail_chars=self.body_tail_chars,
+            )
+        return path
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'NewsletterModel':
+        with np.load(path) as data:
+            if int(data['format_version']) != FORMAT_VERSION:
+                raise ValueError(f"Unsupported newsletter model format in {path}")
+            return cls(
+                data['weights'],
+                float(data['bias']),
+                filter_threshold=float(data['filter_threshold']),
+                keep_threshold=float(data['keep_threshold']),
+                body_head_chars=int(data['body_head_chars']),
+                body_tail_chars=int(data['body_tail_chars']),
+            )
+
+    def evaluate(self, emails: Sequence[Dict], labels: Optional[Sequence[bool]] = None) -> Dict[str, float]:
+        """Accuracy, precision/recall of the filter threshold and the share of emails left undecided"""
+        y = np.array([label_of(e) for e in emails] if labels is None else list(labels), dtype=bool)
+        start = time.perf_counter()
+        scores = self.score(emails)
+        seconds = time.perf_counter() - start
+        filtered = scores >= self.filter_threshold
+        kept = scores <= self.keep_threshold
+        return {
+            'emails': len(y),
+            'accuracy': float(((scores >= 0.5) == y).mean()) if len(y) else 0.0,
+            'filter_precision': float(y[filtered].mean()) if filtered.any() else 0.0,
+            'filter_recall': float(filtered[y].mean()) if y.any() else 0.0,
+            'keep_precision': float((~y[kept]).mean()) if kept.any() else 0.0,
+            'undecided': float((~filtered & ~kept).mean()) if len(y) else 0.0,
+            'emails_per_second': len(y) / seconds if seconds else 0.0,
+        }
+
+
+def main():
+    from email_io import iter_emails
+
+    parser = argparse.ArgumentParser(description='Train or evaluate the newsletter classifier')
+    commands = parser.add_subparsers(dest='command', required=True)
+    train = commands.add_parser('train', help='Train on labelled export files')
+    train.add_argument('sources', nargs='+', help='Export files or stores with labelled records')
+    train.add_argument('--out', default='newsletter_model.npz', help='Model file to write')
+    train.add_argument('--features', type=int, default=DEFAULT_N_FEATURES, help='Hashed feature space size')
+    train.add_argument('--filter-threshold', type=float, default=DEFAULT_FILTER_THRESHOLD)
+    train.add_argument('--keep-threshold', type=float, default=DEFAULT_KEEP_THRESHOLD)
+    evaluate = commands.add_parser('evaluate', help='Score labelled export files with a model')
+    evaluate.add_argument('model', help='Model file')
+    evaluate.add_argument('sources', nargs='+', help='Export files or stores with labelled records')
+    args = parser.parse_args()
+
+    emails: List[Dict] = [email for source in args.sources for email in iter_emails(source)]
+    if args.command == 'train':
+        model = NewsletterModel.train(
+            emails, n_features=args.features,
+            filter_threshold=args.filter_threshold, keep_threshold=args.keep_threshold
+        )
+        print(f"Trained on {len(emails)} emails; saved {model.save(args.out)}")
+    else:
+        model = NewsletterModel.load(args.model)
+        for name, value in model.evaluate(emails).items():
+            print(f"{name:<18} {value:.4f}" if isinstance(value, float) else f"{name:<18} {value}")
+
+
+if __name__ == '__main__':
+    main()
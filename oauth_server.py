@@ -1,8 +1,9 @@
 """
 OAuth server so someone can sign in with their Gmail from a link (e.g. your domain).
 You run this on your PC and expose it via your domain or a tunnel (ngrok, Cloudflare Tunnel).
-After they sign in, their token is saved to token_remote.json; you run the export script
-with that token to pull their emails.
+After they sign in, their token is saved to tokens/<their email>.json (see token_store.py)
+and, as before, to token_remote.json; run export_scheduler.py to export every signed-in
+account, or the export script with GMAIL_TOKEN_FILE to pull one mailbox.
 
 Set REDIRECT_URI to the full URL of /callback (e.g. https://export.yourdomain.com/callback).
 Add that exact URL in Google Cloud Console → APIs & Services → Credentials → your OAuth client
@@ -14,6 +15,9 @@ from pathlib import Path
 
 from flask import Flask, redirect, request
 from google_auth_oauthlib.flow import Flow
+from googleapiclient.discovery import build
+
+from token_store import save_token
 
 SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
 CREDENTIALS_FILE = Path(__file__).parent / "credentials.json"
@@ -78,6 +82,13 @@ def callback():
             f'<p><a href="{BASE_URL}/">Try again</a></p>',
             500,
         )
+    try:
+        # Key the token by mailbox so the next sign-in doesn't overwrite this one
+        profile = build("gmail", "v1", credentials=creds).users().getProfile(userId="me").execute()
+        save_token(profile["emailAddress"], creds)
+    except Exception:
+        # The sign-in itself worked and token_remote.json has it
+        app.logger.exception("Could not save the per-account token; only %s was written", TOKEN_REMOTE_FILE)
     return """
     <!DOCTYPE html>
     <html>
@@ -2,16 +2,153 @@
 Test script for the email relationship analysis system
 """
 
+import asyncio
 import json
 import logging
+import os
+import tempfile
+from contextlib import contextmanager
 from datetime import datetime
+from functools import lru_cache
+from itertools import islice
 from email_processor import EmailProcessor
 from database_manager import DatabaseManager
+from email_io import iter_emails, write_emails
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Shared by the email filter tests
+FILTER_TEST_EMAILS = [
+    {
+        'From': 'newsletter@company.com',
+        'To': 'user@example.com',
+        'Subject': '[Newsletter] Weekly Update - Click here to unsubscribe',
+        'body': 'This is our weekly newsletter with updates and promotions.'
+    },
+    {
+        'From': 'colleague@company.com',
+        'To': 'user@example.com',
+        'Subject': 'Re: Project Discussion',
+        'body': 'Hi, I wanted to follow up on our discussion about the project.'
+    },
+    {
+        'From': 'noreply@google.com',
+        'To': 'user@example.com',
+        'Subject': 'Calendar invitation: Meeting tomorrow',
+        'body': 'You have been invited to a meeting.'
+    }
+]
+
+@lru_cache(maxsize=None)
+def default_filter():
+    """EmailFilter with the shipped rules, built once and shared by the filter tests"""
+    from email_filter import EmailFilter
+    return EmailFilter()
+
+# Shared by the LLM tests
+SAMPLE_EMAIL = {
+    'From': 'joseph@growthandcompany.com',
+    'To': 'luca@flashpack.com',
+    'Cc': 'stefania@growthandcompany.com',
+    'Subject': 'Re: Director role / Jan plan',
+    'Date': 'Tue, 10 Feb 2026 15:32:00 +0000',
+    'body': '''
+        Hi Luca,
+        
+        I wanted to follow up on our discussion about the Director role. Based on our conversation, 
+        I think we should focus on candidates with strong growth experience in the UK market.
+        
+        Let me know if you'd like to discuss this further.
+        
+        Best regards,
+        Joseph
+        '''
+}
+
+SAMPLE_PEOPLE = [
+    {'name': 'Joseph Fitzgibbon', 'email': 'joseph@growthandcompany.com', 'context': 'Sender discussing hiring'},
+    {'name': 'Luca Grant-Snow', 'email': 'luca@flashpack.com', 'context': 'Recipient discussing role'}
+]
+
+class FakeLLM:
+    """Sync client that records its prompts and answers every one with the same combined analysis"""
+    
+    def __init__(self):
+        self.prompts = []
+    
+    def generate(self, prompt):
+        self.prompts.append(prompt)
+        return json.dumps({
+            'people': SAMPLE_PEOPLE,
+            'companies': [{'name': 'Flash Pack', 'domain': 'flashpack.com', 'confidence': 0.9}],
+            'interaction': {'interaction_summary': 'Director role follow-up', 'interaction_type': 'update'},
+            'expertise_instances': [{'person_name': 'Joseph Fitzgibbon', 'expertise_area': 'hiring',
+                                     'confidence': 0.8}],
+            'participant_roles': [{'person_name': 'Luca Grant-Snow', 'role_in_interaction': 'recipient'}],
+        })
+
+class AsyncFakeLLM(FakeLLM):
+    """FakeLLM with a native agenerate that records the most calls it had in flight"""
+    
+    def __init__(self):
+        super().__init__()
+        self.in_flight = self.peak = 0
+    
+    async def agenerate(self, prompt):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(0.001)
+        self.in_flight -= 1
+        return self.generate(prompt)
+
+# Four two-email threads
+SAMPLE_THREAD_EMAILS = [dict(SAMPLE_EMAIL, id=f'm{i}', threadId=f't{i // 2}', Subject=f'Director role {i}')
+                        for i in range(8)]
+
+# Shared by the Gmail export tests
+def fake_gmail_client(server, **engine_options):
+    """(service, FetchEngine) pointed at a fake_gmail_server started with start_server"""
+    
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import build
+    from gmail_fetch import FetchEngine
+    
+    endpoint = f"http://127.0.0.1:{server.server_port}/"
+    
+    def make_service():
+        return build('gmail', 'v1', credentials=Credentials(token='fake'),
+                     client_options={'api_endpoint': endpoint}, static_discovery=True)
+    
+    options = dict({'workers': 2, 'batch_size': 10}, **engine_options)
+    return make_service(), FetchEngine(make_service, batch_uri=endpoint + 'batch/gmail/v1', **options)
+
+@contextmanager
+def export_flags(**flags):
+    """Temporarily set the GMAIL_* mode flags of fetch_last_1000_full (e.g. BY_THREAD=True)"""
+    
+    import fetch_last_1000_full
+    saved = {name: getattr(fetch_last_1000_full, name) for name in flags}
+    try:
+        for name, value in flags.items():
+            setattr(fetch_last_1000_full, name, value)
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(fetch_last_1000_full, name, value)
+
+def assert_thread_layout(records):
+    """Each thread's records are contiguous and oldest first"""
+    
+    seen = set()
+    for previous, record in zip([None] + records, records):
+        if previous is not None and previous['threadId'] == record['threadId']:
+            assert int(previous['internalDate']) < int(record['internalDate'])
+        else:
+            assert record['threadId'] not in seen, f"thread {record['threadId']} is split"
+            seen.add(record['threadId'])
+
 def test_email_processing():
     """Test the email processing system with sample data"""
     
@@ -26,16 +163,13 @@ def test_email_processing():
         logger.error("Failed to initialize database")
         return False
     
-    # Load sample emails
+    # Load the first 10 sample emails for testing
     try:
-        with open('last_1000_emails_full.json', 'r', encoding='utf-8') as f:
-            emails = json.load(f)
+        sample_emails = list(islice(iter_emails('last_1000_emails_full.json'), 10))
     except FileNotFoundError:
         logger.error("Sample emails file not found")
         return False
     
-    # Process first 10 emails for testing
-    sample_emails = emails[:10]
     user_email = 'joseph@growthandcompany.com'
     
     logger.info(f"Processing {len(sample_emails)} emails for user {user_email}")
@@ -181,6 +315,228 @@ def test_email_filtering():
     
     logger.info("Email filtering test completed!")
 
+def test_filter_batch():
+    """Test that batch decisions, in-process and on a process pool, agree with the per-email API"""
+    
+    logger.info("Testing filter batches...")
+    
+    filter = default_filter()
+    
+    results = [filter.should_filter_email(email) for email in FILTER_TEST_EMAILS]
+    columns = {field: [email.get(field) for email in FILTER_TEST_EMAILS] for field in ('From', 'To', 'Subject', 'body')}
+    for decisions in (filter.filter_batch(FILTER_TEST_EMAILS), filter.filter_batch(columns=columns, workers=2, chunk_size=1)):
+        assert list(decisions.keep) == [not r.should_filter for r in results]
+        assert list(decisions.rule_id) == [r.rule_id for r in results]
+        assert [filter.describe(rule_id, email) for rule_id, email in zip(decisions.rule_id, FILTER_TEST_EMAILS)] == [r.reason for r in results]
+    
+    # Without numpy only the columnar API is unavailable; filter_emails decides the same way
+    import email_filter
+    saved_np, email_filter.np = email_filter.np, None
+    try:
+        kept, filtered = filter.filter_emails([dict(email) for email in FILTER_TEST_EMAILS])
+        assert len(kept) == sum(not r.should_filter for r in results)
+        assert [e['_filter_reason'] for e in filtered] == [r.reason for r in results if r.should_filter]
+        try:
+            filter.filter_batch(FILTER_TEST_EMAILS)
+            assert False, 'expected filter_batch to need numpy'
+        except ImportError:
+            pass
+    finally:
+        email_filter.np = saved_np
+    
+    logger.info("Filter batches test completed!")
+
+def test_sender_cache():
+    """Test that repeat senders are decided once and served from the bounded sender cache"""
+    
+    logger.info("Testing sender cache...")
+    
+    from email_filter import EmailFilter, SenderDecisionCache
+    
+    filter = default_filter()
+    
+    cached_filter = EmailFilter(sender_cache_size=2)
+    bulk_emails = [dict(FILTER_TEST_EMAILS[2], Subject=f'Reminder {i}') for i in range(5)]
+    decisions = cached_filter.filter_batch(bulk_emails + FILTER_TEST_EMAILS)
+    assert list(decisions.rule_id) == [filter.should_filter_email(e).rule_id for e in bulk_emails + FILTER_TEST_EMAILS]
+    for _ in range(2):
+        cached_filter.should_filter_email(FILTER_TEST_EMAILS[1])
+    assert cached_filter.sender_cache.hits > 0 and len(cached_filter.sender_cache) <= 2
+    cache = SenderDecisionCache(max_size=2)
+    for sender in ['a@x.com', 'b@x.com', 'a@x.com', 'c@x.com']:
+        cache.put(sender, None)
+    assert cache.get('b@x.com', 'evicted') == 'evicted' and cache.get('a@x.com', 'evicted') is None
+    
+    logger.info("Sender cache test completed!")
+
+def test_windowed_body_scan():
+    """Test that windowed body scanning makes the same decisions as the legacy full lower-cased scan"""
+    
+    logger.info("Testing windowed body scan...")
+    
+    from email_filter import EmailFilter
+    
+    filter = default_filter()
+    
+    legacy_filter = EmailFilter(legacy_body_scan=True)
+    filler = 'Notes from our planning call on Thursday. ' * 500
+    bodies = [filler + 'View in browser', 'Click here to unsubscribe. ' + filler, filler,
+              '   short body   ' + ' ' * 100, ' ' * 30 + 'x' * 49 + '\n' * 30, 'x' * 50]
+    for body in bodies:
+        email = dict(FILTER_TEST_EMAILS[1], body=body)
+        windowed, legacy = filter.should_filter_email(email), legacy_filter.should_filter_email(email)
+        assert (windowed.should_filter, windowed.confidence) == (legacy.should_filter, legacy.confidence)
+    
+    logger.info("Windowed body scan test completed!")
+
+def test_filter_profiling():
+    """Test that profiling records evaluations, hits and timings without changing any decision"""
+    
+    logger.info("Testing filter profiling...")
+    
+    from email_filter import EmailFilter
+    
+    filter = default_filter()
+    
+    bulk_emails = [dict(FILTER_TEST_EMAILS[2], Subject=f'Reminder {i}') for i in range(5)]
+    profiled_filter = EmailFilter(profile=True)
+    decisions = profiled_filter.filter_batch(FILTER_TEST_EMAILS + bulk_emails)
+    assert list(decisions.rule_id) == [filter.should_filter_email(e).rule_id for e in FILTER_TEST_EMAILS + bulk_emails]
+    profiler = profiled_filter.profiler
+    assert profiler.decision_stats()['emails'] == len(FILTER_TEST_EMAILS) + len(bulk_emails)
+    assert sum(profiler.hits) == len(FILTER_TEST_EMAILS) + len(bulk_emails)
+    stats = profiler.rule_stats('seconds')
+    assert [s['seconds'] for s in stats] == sorted((s['seconds'] for s in stats), reverse=True)
+    assert all(s['evaluations'] >= 1 for s in stats if s['hits'])
+    assert 'Rules that decided no email' in profiler.report(top=5)
+    
+    logger.info("Filter profiling test completed!")
+
+def test_newsletter_classifier():
+    """Test the newsletter classifier stage: trained on filter-labelled history, saved and loaded, scoring batches exactly like single emails"""
+    
+    logger.info("Testing newsletter classifier...")
+    
+    from email_filter import EmailFilter
+    from newsletter_model import NewsletterModel
+    
+    filter = default_filter()
+    
+    history = []
+    for i in range(40):
+        history.append({'From': f'deals{i % 3}@shop.example', 'Subject': f'Weekend sale {i}: 30% off',
+                        'body': 'Huge savings this weekend only. View in browser. Unsubscribe from these offers.',
+                        '_filter_reason': 'Body filter pattern: view in browser'})
+        history.append({'From': f'partner{i}@client.example', 'Subject': f'Contract review {i}',
+                        'body': 'Thanks for the call, I have attached the revised draft of the contract for review.'})
+    model = NewsletterModel.train(history, n_features=1 << 12)
+    with tempfile.TemporaryDirectory() as tmp:
+        model = NewsletterModel.load(model.save(os.path.join(tmp, 'model.npz')))
+        classifier_filter = EmailFilter(classifier=os.path.join(tmp, 'model.npz'))
+    business = {'From': 'partner99@client.example', 'To': 'user@example.com',
+                'Subject': 'Action required: contract review',
+                'body': 'Thanks for the call, I have attached the revised draft of the contract for review.'}
+    promo = dict(history[0], Subject='Weekend sale: 50% off')
+    scores = model.score([business, promo])
+    assert scores[0] <= model.keep_threshold and scores[1] >= model.filter_threshold
+    assert list(model.score([promo])) == [scores[1]]
+    # A subject pattern false positive is kept; header rules still run first
+    assert filter.should_filter_email(business).should_filter
+    assert not classifier_filter.should_filter_email(business).should_filter
+    assert classifier_filter.should_filter_email(promo).rule_id == classifier_filter.classifier_rule
+    assert classifier_filter.should_filter_email(FILTER_TEST_EMAILS[2]).rule_id == filter.should_filter_email(FILTER_TEST_EMAILS[2]).rule_id
+    batch = FILTER_TEST_EMAILS + [business, promo]
+    decisions = classifier_filter.filter_batch(batch)
+    assert list(decisions.rule_id) == [classifier_filter.should_filter_email(e).rule_id for e in batch]
+    
+    logger.info("Newsletter classifier test completed!")
+
+def test_bulk_header_rules():
+    """Test the bulk-mail header rules in the per-email, header-only and batch APIs"""
+    
+    logger.info("Testing bulk header rules...")
+    
+    from email_filter import NO_MATCH_RULE
+    
+    filter = default_filter()
+    
+    results = [filter.should_filter_email(email) for email in FILTER_TEST_EMAILS]
+    header_emails = [
+        dict(FILTER_TEST_EMAILS[1], headers={'List-Unsubscribe': '<mailto:u@company.com>'}),
+        dict(FILTER_TEST_EMAILS[1], headers={'Precedence': 'Bulk'}),
+        dict(FILTER_TEST_EMAILS[1], headers={'Auto-Submitted': 'no'}),
+        dict(FILTER_TEST_EMAILS[2], headers={'Auto-Submitted': 'auto-generated'}),
+        dict(FILTER_TEST_EMAILS[1], headers={'X-Mailgun-Sid': 'abc', 'List-Unsubscribe': '<mailto:u@company.com>'}),
+        # A Google Groups thread and a personal reply relayed through Amazon SES are kept
+        dict(FILTER_TEST_EMAILS[1], headers={'List-Id': '<team.googlegroups.com>', 'Precedence': 'list',
+                                             'List-Unsubscribe': '<mailto:team+unsubscribe@googlegroups.com>'}),
+        dict(FILTER_TEST_EMAILS[1], headers={'X-SES-Outgoing': '2026.02.10-54.240.8.1'}),
+    ]
+    expected = [filter.list_unsubscribe_rule, filter.precedence_rule, NO_MATCH_RULE, filter.auto_submitted_rule,
+                filter.esp_rule, NO_MATCH_RULE, NO_MATCH_RULE]
+    assert [filter.should_filter_email(e).rule_id for e in header_emails] == expected
+    assert [filter.should_filter_headers(e).rule_id for e in header_emails] == expected
+    decisions = filter.filter_batch(header_emails + FILTER_TEST_EMAILS)
+    assert list(decisions.rule_id) == expected + [r.rule_id for r in results]
+    assert filter.describe(decisions.rule_id[1], header_emails[1]) == filter.should_filter_email(header_emails[1]).reason == 'Precedence header: bulk'
+    # The weak signals follow the sender rules
+    assert filter.should_filter_email(dict(FILTER_TEST_EMAILS[2], headers={'X-SG-EID': 'abc', 'List-Unsubscribe': '<x>'})).rule_id == results[2].rule_id
+    
+    logger.info("Bulk header rules test completed!")
+
+def test_filter_rules_reload():
+    """Test config-file rules: edits are picked up without a restart, decisions name the ruleset version, and a broken file leaves the last good rules in place"""
+    
+    logger.info("Testing filter rules reload...")
+    
+    from email_filter import EmailFilter
+    from filter_rules import RULES_FILE
+    
+    filter = default_filter()
+    
+    with open(RULES_FILE, encoding='utf-8') as f:
+        config = json.load(f)
+    with tempfile.TemporaryDirectory() as tmp:
+        rules_path = os.path.join(tmp, 'filter_rules.json')
+        with open(rules_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+        reloading_filter = EmailFilter(rules=rules_path, reload_interval=0)
+        first = reloading_filter.should_filter_email(FILTER_TEST_EMAILS[1])
+        assert not first.should_filter and first.ruleset_version == reloading_filter.ruleset.version
+        old_batch = reloading_filter.filter_batch([FILTER_TEST_EMAILS[0]])
+        with open(rules_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(config, version=2, subject_filter_patterns=config['subject_filter_patterns'] + ['project discussion']), f)
+        second = reloading_filter.should_filter_email(FILTER_TEST_EMAILS[1])
+        assert second.should_filter and second.ruleset_version != first.ruleset_version
+        assert reloading_filter.describe(old_batch.rule_id[0], FILTER_TEST_EMAILS[0], old_batch.ruleset_version) == filter.should_filter_email(FILTER_TEST_EMAILS[0]).reason
+        with open(rules_path, 'w', encoding='utf-8') as f:
+            f.write('{"version": 3, "subject_filter_patterns": ["(unclosed"]}')
+        assert reloading_filter.should_filter_email(FILTER_TEST_EMAILS[1]).ruleset_version == second.ruleset_version
+        # Values of the wrong type are rejected like any other broken file
+        for broken in (dict(config, version=4, max_recipients=None), dict(config, version=5, confidence=[0.9])):
+            with open(rules_path, 'w', encoding='utf-8') as f:
+                json.dump(broken, f)
+            assert reloading_filter.should_filter_email(FILTER_TEST_EMAILS[1]).ruleset_version == second.ruleset_version
+            assert list(reloading_filter.filter_batch([FILTER_TEST_EMAILS[1]]).keep) == [False]
+    
+    logger.info("Filter rules reload test completed!")
+
+def test_filter_pattern_sets():
+    """Test that compiled pattern sets report the same first match as searching each regex in order"""
+    
+    logger.info("Testing filter pattern sets...")
+    
+    filter = default_filter()
+    
+    texts = [email[field].lower() for email in FILTER_TEST_EMAILS for field in ('From', 'Subject', 'body')]
+    texts += ['unsubscribe from the list here', 'view this email in café mode', 'nothing to see']
+    for matcher in (filter.automated_matcher, filter.subject_matcher, filter.body_matcher):
+        for text in texts:
+            expected = next((i for i, regex in enumerate(matcher.regexes) if regex.search(text)), None)
+            assert matcher.first_match(text) == expected
+    
+    logger.info("Filter pattern sets test completed!")
+
 def test_llm_prompts():
     """Test the LLM prompt templates"""
     
@@ -231,12 +587,823 @@ def test_llm_prompts():
     
     logger.info("LLM prompt templates test completed!")
 
+def test_combined_extraction():
+    """Test that combined extraction makes one call per email and splits it back into the per-prompt result shapes"""
+    
+    logger.info("Testing combined extraction...")
+    
+    llm = FakeLLM()
+    processor = EmailProcessor(llm_client=llm, combined_extraction=True)
+    email = dict(SAMPLE_EMAIL, id='m1', threadId='t1')
+    result = processor._process_single_email(email, 'joseph@growthandcompany.com')
+    assert len(llm.prompts) == 1 and 'participant_roles' in llm.prompts[0]
+    assert [p['email'] for p in result['people']] == ['joseph@growthandcompany.com', 'luca@flashpack.com']
+    assert result['interactions'][0]['email_id'] == 'm1'
+    assert result['interactions'][0]['interaction_date'] == '2026-02-10'
+    assert result['expertise_instances'][0]['expertise_area'] == 'hiring'
+    assert result['participant_roles'][0]['role_in_interaction'] == 'recipient'
+    
+    thread = [email, dict(SAMPLE_EMAIL, id='m2', threadId='t1', Subject='Re: Director role')]
+    result = processor._process_multi_email_thread(thread, 'joseph@growthandcompany.com')
+    # One call per email plus the thread summary
+    assert len(llm.prompts) == 4 and 'PEOPLE ALREADY IDENTIFIED' in llm.prompts[-1]
+    assert len(result['interactions']) == 2 and len(result['participant_roles']) == 2
+    
+    logger.info("Combined extraction test completed!")
+
+def test_async_processing():
+    """Test that async mode bounds concurrent calls and returns the same result as the sequential run"""
+    
+    logger.info("Testing async processing...")
+    
+    expected = EmailProcessor(llm_client=FakeLLM()).process_emails([dict(e) for e in SAMPLE_THREAD_EMAILS], 'joseph@growthandcompany.com')
+    async_llm = AsyncFakeLLM()
+    processor = EmailProcessor(llm_client=async_llm, max_concurrency=3, llm_rate_limits={'AsyncFakeLLM': 1000})
+    result = asyncio.run(processor.aprocess_emails([dict(e) for e in SAMPLE_THREAD_EMAILS], 'joseph@growthandcompany.com'))
+    assert result == expected
+    assert async_llm.peak == 3 and len(async_llm.prompts) == 4 * 8 + 4
+    
+    logger.info("Async processing test completed!")
+
+def test_llm_cache():
+    """Test that a re-run over the same emails is served from the response cache and failed calls are not cached"""
+    
+    logger.info("Testing LLM response cache...")
+    
+    import sqlite3
+    import threading
+    import time
+    from llm_cache import LLMCache
+    
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache_path = os.path.join(cache_dir, 'llm_cache.sqlite')
+        with LLMCache(cache_path) as cache:
+            first = EmailProcessor(llm_client=FakeLLM(), llm_cache=cache, model_id='fake-1').process_emails(
+                [dict(e) for e in SAMPLE_THREAD_EMAILS], 'joseph@growthandcompany.com')
+            assert cache.stats()['misses'] == 36 and cache.stats()['stores'] == len(cache)
+        rerun_llm = FakeLLM()
+        with LLMCache(cache_path, memory_entries=0) as cache:
+            rerun = EmailProcessor(llm_client=rerun_llm, llm_cache=cache, model_id='fake-1').process_emails(
+                [dict(e) for e in SAMPLE_THREAD_EMAILS], 'joseph@growthandcompany.com')
+            assert rerun == first and rerun_llm.prompts == [] and cache.stats()['hit_rate'] == 1.0
+        
+        # In async mode the SQLite tier is read off the event loop thread
+        class ThreadRecordingCache(LLMCache):
+            threads = set()
+            
+            def get(self, key):
+                self.threads.add(threading.get_ident())
+                return super().get(key)
+        
+        async def rerun_async():
+            with ThreadRecordingCache(cache_path, memory_entries=0) as cache:
+                processor = EmailProcessor(llm_client=AsyncFakeLLM(), llm_cache=cache, model_id='fake-1')
+                result = await processor.aprocess_emails([dict(e) for e in SAMPLE_THREAD_EMAILS], 'joseph@growthandcompany.com')
+                return result, threading.get_ident()
+        
+        async_rerun, loop_thread = asyncio.run(rerun_async())
+        assert async_rerun == first and ThreadRecordingCache.threads and loop_thread not in ThreadRecordingCache.threads
+        
+        class FailingLLM:
+            def generate(self, prompt):
+                return 'not json'
+        
+        with LLMCache(cache_path) as cache:
+            processor = EmailProcessor(llm_client=FailingLLM(), llm_cache=cache, model_id='fake-1')
+            before = len(cache)
+            processor._call_llm('a prompt nobody has sent')
+            assert len(cache) == before and cache.stats()['stores'] == 0
+        with LLMCache(cache_path, max_entries=5) as cache:
+            assert len(cache) == 5 and cache.stats()['evictions'] > 0
+        
+        # Disk hits' access times are written in batches, at the latest on close
+        with sqlite3.connect(cache_path) as db:
+            key, accessed = db.execute('SELECT key, accessed FROM responses LIMIT 1').fetchone()
+        with LLMCache(cache_path) as cache:
+            assert cache.get(key) is not None
+        with sqlite3.connect(cache_path) as db:
+            assert db.execute('SELECT accessed FROM responses WHERE key = ?', (key,)).fetchone()[0] > accessed
+    
+    # The TTL applies to the memory tier too
+    cache = LLMCache(ttl_seconds=0.05)
+    cache.put('k', '{}')
+    assert cache.get('k') == '{}'
+    time.sleep(0.1)
+    assert cache.get('k') is None
+    
+    # Cache keys name the model, so a client without one needs model_id
+    try:
+        EmailProcessor(llm_client=FakeLLM(), llm_cache=LLMCache())
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+    
+    logger.info("LLM response cache test completed!")
+
+def test_thread_extraction():
+    """Test that thread-level extraction makes one call per multi-email thread over a compacted transcript"""
+    
+    logger.info("Testing thread-level extraction...")
+    
+    from llm_prompts import compact_body
+    
+    assert compact_body('Sounds good.\n\nOn Mon, 9 Feb 2026, Luca wrote:\n> earlier text') == 'Sounds good.'
+    long_thread = [dict(SAMPLE_EMAIL, id=f'r{i}', threadId='long', From=f'person{i % 5}@flashpack.com',
+                        body=SAMPLE_EMAIL['body'] * 20) for i in range(30)]
+    thread_llm = FakeLLM()
+    processor = EmailProcessor(llm_client=thread_llm, thread_extraction=True)
+    result = processor.process_emails([dict(e) for e in long_thread], 'joseph@growthandcompany.com')
+    assert len(thread_llm.prompts) == 1 and len(thread_llm.prompts[0]) < 20000
+    assert 'messages omitted' in thread_llm.prompts[0]
+    assert len(result['interactions']) == 30 and result['expertise_instances'][0]['expertise_area'] == 'hiring'
+    people = {person['email'] for person in result['people']}
+    assert {'luca@flashpack.com', 'person3@flashpack.com', 'stefania@growthandcompany.com'} <= people
+    async_result = asyncio.run(EmailProcessor(llm_client=FakeLLM(), thread_extraction=True).aprocess_emails(
+        [dict(e) for e in long_thread], 'joseph@growthandcompany.com'))
+    assert async_result == result
+    
+    logger.info("Thread-level extraction test completed!")
+
+def test_streaming_processing():
+    """Test that streaming yields per-thread results as threads complete, with the same content as the full run"""
+    
+    logger.info("Testing streaming processing...")
+    
+    expected = EmailProcessor(llm_client=FakeLLM()).process_emails([dict(e) for e in SAMPLE_THREAD_EMAILS], 'joseph@growthandcompany.com')
+    
+    stream_input = [dict(e) for e in SAMPLE_THREAD_EMAILS] + [dict(SAMPLE_EMAIL, id='n1', threadId='n1', From='news@mailchimp.com')]
+    stats = {}
+    streamed = list(EmailProcessor(llm_client=FakeLLM()).iter_process_emails(
+        iter(stream_input), 'joseph@growthandcompany.com', batch_size=3, stats=stats))
+    assert [r['thread_id'] for r in streamed if r['thread_id']] == ['t0', 't1', 't2', 't3']
+    assert [i for r in streamed for i in r['processed_emails']] == expected['processed_emails']
+    assert [i for r in streamed for i in r['interactions']] == expected['interactions']
+    filtered = [f for r in streamed for f in r['filtered_emails']]
+    assert [f['id'] for f in filtered] == ['n1'] and 'body' not in filtered[0] and filtered[0]['_filter_reason']
+    assert stats == {'total_emails': 9, 'kept_emails': 8, 'filtered_emails': 1, 'threads_processed': 4,
+                     'partial_threads': 0}
+    assert all(r['thread_complete'] for r in streamed)
+    
+    # Interleaved threads: over the open-thread limit they are split and marked, without a limit they stay whole
+    interleaved = [dict(SAMPLE_THREAD_EMAILS[i]) for i in (0, 2, 1, 3)]
+    split = list(EmailProcessor(llm_client=FakeLLM()).iter_process_emails(
+        iter(interleaved), 'joseph@growthandcompany.com', max_open_threads=1))
+    assert [(r['thread_id'], r['thread_complete']) for r in split] == [('t0', False), ('t1', False), ('t0', False), ('t1', False)]
+    whole = list(EmailProcessor(llm_client=FakeLLM()).iter_process_emails(
+        interleaved, 'joseph@growthandcompany.com', max_open_threads=None))
+    assert [(r['thread_id'], r['thread_complete']) for r in whole] == [('t0', True), ('t1', True)]
+    
+    async def stream_async():
+        processor = EmailProcessor(llm_client=AsyncFakeLLM(), max_concurrency=2)
+        return [r async for r in processor.aiter_process_emails([dict(e) for e in stream_input],
+                                                                'joseph@growthandcompany.com', batch_size=3)]
+    
+    assert asyncio.run(stream_async()) == streamed
+    
+    # A consumer that stops after the first thread closes the input reader
+    closed = []
+    
+    def reader():
+        try:
+            yield from (dict(e) for e in SAMPLE_THREAD_EMAILS)
+        finally:
+            closed.append(True)
+    
+    async def first_thread():
+        stream = EmailProcessor(llm_client=AsyncFakeLLM()).aiter_process_emails(
+            reader(), 'joseph@growthandcompany.com', grouped_by_thread=True, batch_size=1, window=1)
+        try:
+            return await stream.__anext__()
+        finally:
+            await stream.aclose()
+    
+    assert asyncio.run(first_thread())['thread_id'] == 't0' and closed == [True]
+    
+    logger.info("Streaming processing test completed!")
+
+def test_email_export_formats():
+    """Test that streamed exports read back the same records in every format"""
+    
+    logger.info("Testing email export formats...")
+    
+    records = [
+        {'id': f'msg{i}', 'threadId': 't1', 'From': 'a@example.com', 'Subject': f'Hello {i}', 'body': 'Hi é'}
+        for i in range(3)
+    ]
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in ['emails.json', 'emails.ndjson', 'emails.ndjson.gz']:
+            path = os.path.join(tmp_dir, name)
+            count = write_emails(path, iter(records))
+            assert count == len(records)
+            assert list(iter_emails(path)) == records
+            logger.info(f"{name}: wrote and read back {count} records")
+        
+        # Legacy JSON exports must stay loadable with json.load
+        with open(os.path.join(tmp_dir, 'emails.json'), 'r', encoding='utf-8') as f:
+            assert json.load(f) == records
+        
+        # Uploads are spooled to a w+b file that must stay open after parsing (even a partial read)
+        from email_io import iter_ndjson_stream
+        with open(os.path.join(tmp_dir, 'emails.ndjson.gz'), 'rb') as f:
+            data = f.read()
+        with tempfile.SpooledTemporaryFile(mode='w+b') as upload:
+            upload.write(data)
+            upload.seek(0)
+            assert list(iter_ndjson_stream(upload, gzipped=True)) == records
+            upload.seek(0)
+            stream = iter_ndjson_stream(upload, gzipped=True)
+            assert next(stream) == records[0]
+            stream.close()
+            assert not upload.closed
+    
+    logger.info("Email export formats test completed!")
+
+def test_export_checkpoint_resume():
+    """Test that a resumable export picks up after a crash without duplicates"""
+    
+    logger.info("Testing export checkpoint resume...")
+    
+    from export_checkpoint import ExportCheckpoint
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_file = os.path.join(tmp_dir, 'export.json')
+        ids = [f'msg{i}' for i in range(5)]
+        
+        # First run fetches two messages (msg1 fails), then dies halfway through writing a third
+        checkpoint = ExportCheckpoint(output_file)
+        checkpoint.start(ids, history_id='123')
+        with checkpoint:
+            for msg_id in ('msg0', 'msg2'):
+                checkpoint.record({'id': msg_id, 'body': 'first run'})
+        with open(checkpoint.spool_path, 'a', encoding='utf-8') as f:
+            f.write('{"id": "msg3", "bo')
+        
+        # Restart: only the missing IDs are fetched, and records still come out in list order
+        checkpoint = ExportCheckpoint(output_file)
+        assert checkpoint.exists()
+        saved_ids, done, history_id = checkpoint.load()
+        missing = [msg_id for msg_id in saved_ids if msg_id not in done]
+        assert missing == ['msg1', 'msg3', 'msg4'] and history_id == '123'
+        with checkpoint:
+            for msg_id in missing:
+                checkpoint.record({'id': msg_id, 'body': 'second run'})
+        
+        records = list(checkpoint.iter_records())
+        assert [r['id'] for r in records] == ids
+        checkpoint.clear()
+        assert not checkpoint.exists()
+        logger.info(f"Resumed export: fetched {len(missing)} of {len(ids)} on restart")
+    
+    logger.info("Export checkpoint resume test completed!")
+
+def test_email_store():
+    """Test the chunked email store's thread, date-range and replace/delete behaviour"""
+    
+    logger.info("Testing email store...")
+    
+    from email_store import EmailStore
+    
+    records = [
+        {'id': f'msg{i}', 'threadId': f't{i % 3}', 'internalDate': str(1000 + i), 'body': f'Body {i}'}
+        for i in range(10)
+    ]
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'emails.store')
+        assert write_emails(path, reversed(records)) == len(records)
+        
+        with EmailStore(path, chunk_records=4) as store:
+            assert len(store) == len(records)
+            assert [r['id'] for r in store.iter_thread('t1')] == ['msg1', 'msg4', 'msg7']
+            assert [r['id'] for r in store.iter_range(1003, 1006, newest_first=False)] == ['msg3', 'msg4', 'msg5']
+            assert store.thread_ids() == ['t0', 't2', 't1']
+            
+            store.write({**records[4], 'body': 'Edited'})
+            assert store.delete(['msg7', 'missing']) == 1
+            assert store.get('msg4')['body'] == 'Edited' and store.get('msg7') is None
+            store.compact()
+            assert [r['id'] for r in store.iter_thread('t1')] == ['msg1', 'msg4']
+        
+        assert [r['id'] for r in iter_emails(path)] == [f'msg{i}' for i in range(9, -1, -1) if i != 7]
+    
+    logger.info("Email store test completed!")
+
+def test_email_store_compaction_recovery():
+    """Test that a compaction interrupted before or after its index commit leaves a readable store"""
+    
+    logger.info("Testing email store compaction recovery...")
+    
+    import sqlite3
+    from email_store import COMPACT_FILE, DATA_FILE, EmailStore
+    
+    class CrashingStore(EmailStore):
+        """Dies right after the index switch commits, before the new file is moved into place"""
+        
+        crash = False
+        
+        def _finish_compaction(self):
+            if self.crash:
+                raise RuntimeError('crash')
+            super()._finish_compaction()
+    
+    records = [
+        {'id': f'msg{i}', 'threadId': f't{i % 3}', 'internalDate': str(1000 + i), 'body': f'Body {i}'}
+        for i in range(10)
+    ]
+    expected = [dict(r, body='Edited') if r['id'] == 'msg4' else r for r in reversed(records) if r['id'] != 'msg7']
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'emails.store')
+        with EmailStore(path, chunk_records=4) as store:
+            for record in records:
+                store.write(record)
+            store.write({**records[4], 'body': 'Edited'})
+            store.delete(['msg7'])
+        data_size = os.path.getsize(os.path.join(path, DATA_FILE))
+        
+        # The index transaction fails: it rolls back and the old file stays in use
+        with EmailStore(path, chunk_records=4) as store:
+            store._db.execute("CREATE TRIGGER fail BEFORE INSERT ON meta BEGIN SELECT RAISE(ABORT, 'disk full'); END")
+            try:
+                store.compact()
+                assert False, 'expected the index commit to fail'
+            except sqlite3.IntegrityError:
+                pass
+            assert list(store.iter_emails()) == expected
+            store._db.execute('DROP TRIGGER fail')
+        assert not os.path.exists(os.path.join(path, COMPACT_FILE))
+        assert os.path.getsize(os.path.join(path, DATA_FILE)) == data_size
+        
+        # A crash after the commit: the next open moves the compacted file into place
+        store = CrashingStore(path, chunk_records=4)
+        store.crash = True
+        try:
+            store.compact()
+            assert False, 'expected the simulated crash'
+        except RuntimeError:
+            pass
+        store.close()
+        assert os.path.exists(os.path.join(path, COMPACT_FILE))
+        with EmailStore(path) as store:
+            assert list(store.iter_emails()) == expected
+            assert [r['id'] for r in store.iter_thread('t1')] == ['msg1', 'msg4']
+        assert not os.path.exists(os.path.join(path, COMPACT_FILE))
+        assert os.path.getsize(os.path.join(path, DATA_FILE)) < data_size
+    
+    logger.info("Email store compaction recovery test completed!")
+
+def test_email_store_line_separators():
+    """Test that bodies containing Unicode line separators do not shift later records"""
+    
+    logger.info("Testing email store line separators...")
+    
+    from email_store import EmailStore
+    
+    records = [
+        {'id': 'a', 'threadId': 't', 'internalDate': '1000', 'body': 'one\u2028two\u2029three\x85four'},
+        {'id': 'b', 'threadId': 't', 'internalDate': '1001', 'body': 'after'},
+    ]
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with EmailStore(os.path.join(tmp_dir, 'emails.store')) as store:
+            for record in records:
+                store.write(record)
+            assert store.get('b') == records[1]
+            assert list(store.iter_thread('t')) == records
+            store.compact()
+            assert list(store.iter_range(newest_first=False)) == records
+    
+    logger.info("Email store line separators test completed!")
+
+def test_payload_body_extraction():
+    """Test MIME body extraction from nested Gmail payloads"""
+    
+    logger.info("Testing payload body extraction...")
+    
+    import base64
+    from gmail_payload import get_body_from_payload
+    
+    def part(mime_type, text, **extra):
+        data = base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')
+        return {'mimeType': mime_type, 'body': {'data': data}, **extra}
+    
+    # multipart/mixed > (attachment, multipart/alternative > (html, plain))
+    payload = {
+        'mimeType': 'multipart/mixed',
+        'parts': [
+            part('text/plain', 'attachment text', filename='notes.txt'),
+            {'mimeType': 'multipart/alternative', 'parts': [
+                part('text/html', '<p>Hello</p>'),
+                part('text/plain', 'Hello café'),
+            ]},
+        ],
+    }
+    assert get_body_from_payload(payload) == 'Hello café'
+    # 'é' is two bytes; a cap that splits it drops the partial character
+    assert get_body_from_payload(payload, max_bytes=9) == 'Hello caf'
+    assert get_body_from_payload({'parts': [part('text/html', '<p>Hi</p>')]}) == '<p>Hi</p>'
+    assert get_body_from_payload(part('text/plain', 'single part')) == 'single part'
+    
+    # A part that does not decode falls back to the next one; only when none decode is it an error
+    from gmail_payload import DECODE_ERROR_BODY
+    corrupt = {'mimeType': 'text/plain', 'body': {'data': 'A'}}
+    assert get_body_from_payload({'parts': [corrupt, part('text/html', '<p>Hi</p>')]}) == '<p>Hi</p>'
+    assert get_body_from_payload({'parts': [corrupt]}) == DECODE_ERROR_BODY
+    
+    # Bulk-mail headers are kept under their canonical names
+    from gmail_payload import bulk_headers
+    headers = [{'name': 'list-unsubscribe', 'value': '<mailto:u@x.com>'}, {'name': 'Subject', 'value': 'Hi'},
+               {'name': 'X-SG-EID', 'value': 'abc'}, {'name': 'Precedence', 'value': 'bulk'}]
+    assert bulk_headers(headers) == {'List-Unsubscribe': '<mailto:u@x.com>', 'X-SG-EID': 'abc', 'Precedence': 'bulk'}
+    
+    logger.info("Payload body extraction test completed!")
+
+def test_fetch_engine():
+    """Smoke test FetchEngine against the fake Gmail server on a random port"""
+    
+    logger.info("Testing fetch engine...")
+    
+    from fake_gmail_server import start_server
+    from fetch_last_1000_full import iter_last_n_by_thread, list_message_ids
+    from gmail_fetch import FetchEngine
+    
+    server, fake = start_server(port=0, size=60)
+    try:
+        service, engine = fake_gmail_client(server)
+        ids = list_message_ids(service, 45, engine)
+        messages, failed = engine.get_messages(ids)
+        assert len(ids) == 45 and not failed
+        assert [m['id'] for m in messages] == ids and all(m['payload'] for m in messages)
+        # Whole conversations, stopping once enough messages are produced
+        thread_messages = list(iter_last_n_by_thread(service, 10, engine))
+        assert len(thread_messages) >= 10 and fake.stats['api_calls'] > 45
+        # A repeated ID is fetched and returned once instead of failing the whole batch
+        messages, failed = engine.get_messages([ids[0], ids[1], ids[0]])
+        assert [m['id'] for m in messages] == [ids[0], ids[1]] and not failed
+    finally:
+        server.shutdown()
+    
+    # Transport errors carry no HTTP status and are retried like 429/5xx
+    import gmail_fetch
+    
+    class FlakyRequest:
+        calls = 0
+        
+        def execute(self):
+            FlakyRequest.calls += 1
+            if FlakyRequest.calls < 3:
+                raise TimeoutError('timed out')
+            return {'historyId': '1'}
+    
+    backoff = gmail_fetch.BACKOFF_BASE_SECONDS
+    gmail_fetch.BACKOFF_BASE_SECONDS = 0.001
+    try:
+        engine = FetchEngine(lambda: None, quota_units_per_second=0)
+        assert engine.execute(lambda _: FlakyRequest(), 1) == {'historyId': '1'} and FlakyRequest.calls == 3
+        
+        # Other errors without an HTTP status are bugs: raised at once, not retried
+        calls = []
+        
+        def broken_request(service):
+            calls.append(service)
+            return {}['missing']
+        
+        try:
+            engine.execute(broken_request, 1)
+            assert False, 'expected KeyError'
+        except KeyError:
+            pass
+        assert len(calls) == 1
+    finally:
+        gmail_fetch.BACKOFF_BASE_SECONDS = backoff
+    
+    # Retry-After is honoured up to BACKOFF_MAX_SECONDS
+    class RateLimited(Exception):
+        def __init__(self, retry_after):
+            self.resp = {'retry-after': retry_after}
+    
+    assert gmail_fetch.backoff_delay(0, RateLimited('2')) == 2.0
+    assert gmail_fetch.backoff_delay(0, RateLimited('86400')) == gmail_fetch.BACKOFF_MAX_SECONDS
+    
+    logger.info("Fetch engine test completed!")
+
+def test_incremental_thread_export():
+    """Test that an incremental sync of a thread export keeps threads together and oldest first"""
+    
+    logger.info("Testing incremental thread export...")
+    
+    from fake_gmail_server import start_server
+    from fetch_last_1000_full import run_export
+    
+    server, fake = start_server(port=0, size=40, undelivered=2)
+    try:
+        service, engine = fake_gmail_client(server)
+        with tempfile.TemporaryDirectory() as tmp_dir, export_flags(BY_THREAD=True, INCREMENTAL=True):
+            token_file = os.path.join(tmp_dir, 'token.json')
+            output_file = os.path.join(tmp_dir, 'export.json')
+            count = run_export(service, engine, token_file, output_file, 20)
+            exported = list(iter_emails(output_file))
+            assert count == len(exported) >= 20
+            assert_thread_layout(exported)
+            
+            # The second run merges the history delta, which sorts newest first before regrouping
+            assert run_export(service, engine, token_file, output_file, 20) == count
+            assert list(iter_emails(output_file)) == exported
+            
+            # After new mail the merged export matches a fresh one: whole threads, at least n messages
+            fake.mailbox.deliver(2)
+            run_export(service, engine, token_file, output_file, 20)
+            fresh_file = os.path.join(tmp_dir, 'fresh.json')
+            with export_flags(INCREMENTAL=False):
+                run_export(service, engine, token_file, fresh_file, 20)
+            assert list(iter_emails(output_file)) == list(iter_emails(fresh_file)) != exported
+    finally:
+        server.shutdown()
+    
+    logger.info("Incremental thread export test completed!")
+
+def test_two_phase_export():
+    """Test that the header pass drops bulk mail before the full fetch and reports its quota cost"""
+    
+    logger.info("Testing two-phase export...")
+    
+    import io
+    from contextlib import redirect_stdout
+    from fake_gmail_server import start_server
+    from fetch_last_1000_full import run_export
+    
+    # Header-only decisions (made before bodies are downloaded) never drop an email
+    # that the full filter would keep
+    filter = default_filter()
+    for email in FILTER_TEST_EMAILS:
+        header_result = filter.should_filter_headers({k: v for k, v in email.items() if k != 'body'})
+        assert not header_result.should_filter or filter.should_filter_email(email).should_filter
+    
+    server, fake = start_server(port=0, size=40)
+    try:
+        service, engine = fake_gmail_client(server)
+        with tempfile.TemporaryDirectory() as tmp_dir, export_flags(TWO_PHASE=True):
+            output_file = os.path.join(tmp_dir, 'export.json')
+            out = io.StringIO()
+            with redirect_stdout(out):
+                count = run_export(service, engine, os.path.join(tmp_dir, 'token.json'), output_file, 30)
+            kept = list(iter_emails(output_file))
+            filtered = list(iter_emails(os.path.join(tmp_dir, 'filtered-export.json')))
+            assert count == len(kept) and kept and filtered and count + len(filtered) == 30
+            assert all(r['headers'].get('Precedence') != 'bulk' and r['body'] for r in kept)
+            assert all(r['_filter_reason'] and not r['body'] for r in filtered)
+            # 30 metadata gets, minus the full gets that were skipped
+            assert f"for {5 * count:+d} quota units (150 spent on headers)" in out.getvalue()
+    finally:
+        server.shutdown()
+    
+    logger.info("Two-phase export test completed!")
+
+def test_history_changes():
+    """Test history.list bookkeeping for added, deleted, trashed and untrashed messages"""
+    
+    logger.info("Testing history changes...")
+    
+    from fake_gmail_server import start_server
+    from gmail_sync import HistoryExpired, current_history_id, list_history_changes, merge_records
+    
+    server, fake = start_server(port=0, size=30, undelivered=3)
+    mailbox = fake.mailbox
+    try:
+        service, engine = fake_gmail_client(server)
+        start = current_history_id(service, engine)
+        assert list_history_changes(service, start, engine) == ([], set(), start)
+        
+        new_ids = mailbox.deliver(3)
+        old_ids = [mailbox.message_id(i) for i in (10, 11, 12)]
+        mailbox.delete(old_ids[0])
+        mailbox.trash(old_ids[1])
+        mailbox.trash(old_ids[2])
+        mailbox.untrash(old_ids[2])
+        # Added and deleted inside the same window: only reported as deleted
+        mailbox.delete(new_ids[2])
+        added, deleted, latest = list_history_changes(service, start, engine)
+        assert added == [new_ids[0], new_ids[1], old_ids[2]]
+        assert deleted == {old_ids[0], old_ids[1], new_ids[2]}
+        assert latest == mailbox.history_id()
+        assert list_history_changes(service, latest, engine) == ([], set(), latest)
+        
+        mailbox.history_floor = int(latest)
+        try:
+            list_history_changes(service, start, engine)
+            assert False, 'expected HistoryExpired'
+        except HistoryExpired:
+            pass
+    finally:
+        server.shutdown()
+    
+    # Deleted records go, new ones replace or join, and the newest `limit` are kept
+    existing = [{'id': f'm{i}', 'internalDate': str(100 - i)} for i in range(5)]
+    new_records = [{'id': 'new', 'internalDate': '200'}, {'id': 'm1', 'internalDate': '99', 'body': 'edited'}]
+    merged = merge_records(existing, new_records, {'m0'}, limit=3)
+    assert [r['id'] for r in merged] == ['new', 'm1', 'm2'] and merged[1]['body'] == 'edited'
+    assert len(merge_records(existing, new_records, set())) == 6
+    
+    logger.info("History changes test completed!")
+
+def test_incremental_export():
+    """Test incremental exports against a changing mailbox, and the fallback when history expired"""
+    
+    logger.info("Testing incremental export...")
+    
+    from fake_gmail_server import start_server
+    from fetch_last_1000_full import run_export
+    from gmail_sync import load_checkpoint
+    
+    server, fake = start_server(port=0, size=30, undelivered=4)
+    mailbox = fake.mailbox
+    
+    def listed_ids(n):
+        return [mailbox.message_id(i) for i in range(mailbox.size) if mailbox.listed(i)][:n]
+    
+    try:
+        service, engine = fake_gmail_client(server)
+        with tempfile.TemporaryDirectory() as tmp_dir, export_flags(INCREMENTAL=True):
+            token_file = os.path.join(tmp_dir, 'token.json')
+            output_file = os.path.join(tmp_dir, 'export.json')
+            assert run_export(service, engine, token_file, output_file, 10) == 10
+            assert [r['id'] for r in iter_emails(output_file)] == listed_ids(10)
+            
+            new_ids = mailbox.deliver(3)
+            mailbox.delete(mailbox.message_id(4))
+            mailbox.trash(mailbox.message_id(5))
+            mailbox.delete(new_ids[2])
+            calls = fake.stats['api_calls']
+            assert run_export(service, engine, token_file, output_file, 10) == 10
+            synced = [r['id'] for r in iter_emails(output_file)]
+            assert synced == listed_ids(10) and new_ids[2] not in synced
+            # profile is not read again; one history.list and two messages.get
+            assert fake.stats['api_calls'] - calls == 3
+            assert load_checkpoint(token_file)['historyId'] == mailbox.history_id()
+            
+            # New mail pushes the oldest records out instead of growing past n
+            mailbox.deliver(1)
+            assert run_export(service, engine, token_file, output_file, 10) == 10
+            assert [r['id'] for r in iter_emails(output_file)] == listed_ids(10)
+            
+            # A checkpoint older than the history Gmail keeps falls back to a full export
+            mailbox.untrash(mailbox.message_id(5))
+            mailbox.history_floor = int(mailbox.history_id()) + 1
+            assert run_export(service, engine, token_file, output_file, 10) == 10
+            assert [r['id'] for r in iter_emails(output_file)] == listed_ids(10)
+            assert load_checkpoint(token_file)['historyId'] == mailbox.history_id()
+    finally:
+        server.shutdown()
+    
+    logger.info("Incremental export test completed!")
+
+def test_multi_account_scheduling():
+    """Test per-account token storage and fair quota sharing between accounts"""
+    
+    logger.info("Testing multi-account scheduling...")
+    
+    from datetime import timedelta
+    from google.oauth2.credentials import Credentials
+    from export_scheduler import ExportScheduler
+    from token_store import list_accounts, load_credentials, save_token
+    
+    with tempfile.TemporaryDirectory() as tokens_dir:
+        expiry = datetime.utcnow() + timedelta(hours=1)
+        for email in ['Alice@Example.com', 'bob@example.com']:
+            creds = Credentials(token=f'token-{email}', refresh_token='refresh', client_id='id',
+                                client_secret='secret', expiry=expiry)
+            save_token(email, creds, tokens_dir)
+        accounts = list_accounts(tokens_dir)
+        assert accounts == ['alice@example.com', 'bob@example.com']
+        assert load_credentials('ALICE@example.com', tokens_dir).token == 'token-Alice@Example.com'
+    
+    scheduler = ExportScheduler(accounts, project_quota_units_per_second=1000, user_quota_units_per_second=250)
+    assert scheduler.fair_share(1) == 250
+    assert scheduler.fair_share(8) == 125
+    
+    logger.info("Multi-account scheduling test completed!")
+
+def test_scheduler_export():
+    """Test concurrent per-account exports against the fake Gmail server, with quota rebalancing"""
+    
+    logger.info("Testing scheduler export...")
+    
+    from datetime import timedelta
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import build
+    from export_scheduler import ExportScheduler
+    from fake_gmail_server import start_server
+    from token_store import save_token
+    
+    class RecordingScheduler(ExportScheduler):
+        """Keeps the per-account rates after every rebalance"""
+        
+        def _rebalance(self):
+            super()._rebalance()
+            self.rates.append({account: engine.bucket.rate for account, engine in self._engines.items()})
+    
+    server, fake = start_server(port=0, size=60, latency_ms=10)
+    endpoint = f"http://127.0.0.1:{server.server_port}/"
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tokens_dir = os.path.join(tmp_dir, 'tokens')
+            expiry = datetime.utcnow() + timedelta(hours=1)
+            for email in ['alice@example.com', 'bob@example.com']:
+                save_token(email, Credentials(token='fake', refresh_token='refresh', client_id='id',
+                                              client_secret='secret', expiry=expiry), tokens_dir)
+            
+            scheduler = RecordingScheduler(
+                ['alice@example.com', 'bob@example.com', 'carol@example.com'],
+                output_dir=os.path.join(tmp_dir, 'exports'), tokens_dir=tokens_dir, max_accounts=2,
+                project_quota_units_per_second=300, user_quota_units_per_second=250,
+                workers=2, batch_size=10, n=20, batch_uri=endpoint + 'batch/gmail/v1',
+                service_factory=lambda creds: build('gmail', 'v1', credentials=creds, static_discovery=True,
+                                                    client_options={'api_endpoint': endpoint}),
+            )
+            scheduler.rates = []
+            report = scheduler.run(status_interval=0)
+            
+            assert [s['state'] for s in report] == ['done', 'done', 'failed']
+            assert 'FileNotFoundError' in report[2]['error']
+            for status in report[:2]:
+                assert status['messages'] == 20 and status['seconds'] is not None
+                assert len(list(iter_emails(status['output']))) == 20
+            with open(os.path.join(tmp_dir, 'exports', 'status.json'), 'r', encoding='utf-8') as f:
+                assert [s['state'] for s in json.load(f)['accounts']] == ['done', 'done', 'failed']
+            
+            # Both accounts shared the project quota, and the survivor got the full per-user rate back
+            assert all(rate == scheduler.fair_share(len(rates)) for rates in scheduler.rates for rate in rates.values())
+            assert {150} in [set(rates.values()) for rates in scheduler.rates]
+            sizes = [len(rates) for rates in scheduler.rates]
+            assert any(a == 2 and b == 1 for a, b in zip(sizes, sizes[1:]))
+            assert scheduler.rates[-1] == {} and max(s['quota_units_per_sec'] for s in report[:2]) == 250
+    finally:
+        server.shutdown()
+    
+    logger.info("Scheduler export test completed!")
+
+def test_filter_benchmark():
+    """Test the synthetic corpus and the filter regression check against the stored baseline"""
+    
+    logger.info("Testing filter benchmark...")
+    
+    from benchmark_filter import compare, load_baseline, run_benchmark
+    from filter_corpus import generate_corpus
+    
+    corpus = generate_corpus(300, seed=5)
+    assert len(corpus) == 300 and corpus == generate_corpus(300, seed=5)
+    assert {email['_category'] for email in corpus} == {'thread', 'newsletter', 'receipt', 'calendar', 'notification'}
+    assert all(email['_expected'] == 'keep' for email in corpus if email['_category'] == 'thread')
+    
+    result = run_benchmark(corpus, repeat=1)
+    assert sum(sum(row.values()) for row in result['matrix'].values()) == 300
+    assert result['emails_per_second'] > 0 and result['p99_ms'] >= result['p50_ms']
+    assert compare(result, result) == []
+    worse = dict(result, emails_per_second=result['emails_per_second'] / 2, recall=result['recall'] - 0.05)
+    assert [r.split(':')[0] for r in compare(worse, result)] == ['emails_per_second', 'recall']
+    
+    # Accuracy on the stored baseline corpus must not regress (speed depends on the machine)
+    baseline = load_baseline()
+    emails = generate_corpus(baseline['corpus']['emails'], baseline['corpus']['seed'])
+    regressions = compare(run_benchmark(emails, repeat=1), baseline, check_speed=False)
+    assert regressions == [], regressions
+    
+    logger.info("Filter benchmark test completed!")
+
 if __name__ == "__main__":
     logger.info("Starting system tests...")
     
     # Run tests
     test_email_filtering()
+    test_filter_batch()
+    test_sender_cache()
+    test_windowed_body_scan()
+    test_filter_profiling()
+    test_newsletter_classifier()
+    test_bulk_header_rules()
+    test_filter_rules_reload()
+    test_filter_pattern_sets()
+    test_filter_benchmark()
     test_llm_prompts()
+    test_combined_extraction()
+    test_async_processing()
+    test_llm_cache()
+    test_thread_extraction()
+    test_streaming_processing()
+    test_email_export_formats()
+    test_export_checkpoint_resume()
+    test_email_store()
+    test_email_store_compaction_recovery()
+    test_email_store_line_separators()
+    test_payload_body_extraction()
+    test_multi_account_scheduling()
+    test_scheduler_export()
+    test_fetch_engine()
+    test_incremental_thread_export()
+    test_two_phase_export()
+    test_history_changes()
+    test_incremental_export()
     test_email_processing()
     
     logger.info("All tests completed!")
\ No newline at end of file
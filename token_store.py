@@ -0,0 +1,68 @@
+"""
+Per-account OAuth token store for exporting many mailboxes.
+oauth_server.py saves each sign-in as tokens/<email address>.json (instead of only
+overwriting token_remote.json), and export_scheduler.py exports every stored account.
+Each token file keeps its own sync checkpoint next to it (see gmail_sync.py).
+
+Set GMAIL_TOKENS_DIR to keep the tokens somewhere else.
+"""
+
+import os
+import re
+from pathlib import Path
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+
+SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
+_tokens_dir = os.environ.get("GMAIL_TOKENS_DIR", "tokens")
+TOKENS_DIR = Path(_tokens_dir) if os.path.isabs(_tokens_dir) else Path(__file__).parent / _tokens_dir
+TOKEN_SUFFIX = ".json"
+# gmail_sync.py stores <token>.sync.json next to each token; those are not accounts
+SYNC_SUFFIX = ".sync.json"
+
+
+def account_key(email):
+    """File-name-safe key for an account: lower-cased address, odd characters replaced."""
+    return re.sub(r"[^a-z0-9@._+-]", "_", email.strip().lower())
+
+
+def token_path(email, tokens_dir=TOKENS_DIR):
+    return Path(tokens_dir) / (account_key(email) + TOKEN_SUFFIX)
+
+
+def save_token(email, creds, tokens_dir=TOKENS_DIR):
+    """Store credentials for an account (atomically, so a running export never reads half a file)."""
+    path = token_path(email, tokens_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        f.write(creds.to_json())
+    tmp_path.replace(path)
+    return path
+
+
+def list_accounts(tokens_dir=TOKENS_DIR):
+    """Account keys with a stored token, sorted."""
+    tokens_dir = Path(tokens_dir)
+    if not tokens_dir.exists():
+        return []
+    return sorted(
+        p.name[:-len(TOKEN_SUFFIX)]
+        for p in tokens_dir.iterdir()
+        if p.name.endswith(TOKEN_SUFFIX) and not p.name.endswith(SYNC_SUFFIX)
+    )
+
+
+def load_credentials(email, tokens_dir=TOKENS_DIR):
+    """Load an account's credentials, refreshing (and re-saving) an expired access token."""
+    path = token_path(email, tokens_dir)
+    if not path.exists():
+        raise FileNotFoundError(f"No token stored for {email} (expected {path})")
+    creds = Credentials.from_authorized_user_file(str(path), SCOPES)
+    if not creds.valid:
+        if not creds.refresh_token:
+            raise ValueError(f"Token for {email} has expired and has no refresh token; ask them to sign in again")
+        creds.refresh(Request())
+        save_token(email, creds, tokens_dir)
+    return creds